@@ -0,0 +1,256 @@
+################################################################################################
+# Answer files
+################################################################################################
+# Headless mode (--answers): the choices the user would make in the UI come from a JSON file instead, and drive
+# the same Cores/filter_hosts/WekaCluster logic, so automation can generate config.sh without the curses UI.
+#
+# {
+#     "networks": ["10.1.0.0/24"],    # dataplane networks - default is all of the reference host's networks
+#     "hosts": {"include": ["weka*"], "exclude": ["weka07"], "min_hosts": 5},    # shell-style patterns
+#     "bias": {"protocols": false, "protocols_primary": false, "drives": false},
+#     "cores": {"fe": 1, "drives": 6, "compute": 12},    # overrides - default is the calculated split
+#     "data_drives": 6, "parity_drives": 2, "hot_spares": 1,    # default is what the UI suggests
+#     "cluster_name": "mycluster",
+#     "protocols_memory": 20,    # GB of RAM per host to reserve for protocols - default depends on the bias
+#     "high_availability": null,    # true/false, or null to decide the way the UI does
+#     "multicontainer": null
+# }
+import fnmatch
+import ipaddress
+import json
+from logging import getLogger
+
+from logic import Cores, filter_hosts, host_cores, host_drives
+
+log = getLogger(__name__)
+
+ANSWER_KEYS = ("networks", "hosts", "bias", "cores", "data_drives", "parity_drives", "hot_spares", "cluster_name",
+               "protocols_memory", "high_availability", "multicontainer")
+MIN_HOSTS = 5
+
+
+def load_answers(filename):
+    """
+    :param filename: a JSON answer file
+    :return: the answers (dict), or None if the file isn't usable
+    """
+    try:
+        with open(filename) as fp:
+            answers = json.load(fp)
+    except (OSError, ValueError) as exc:
+        log.error(f"Unable to read answer file {filename}: {exc}")
+        return None
+    if not isinstance(answers, dict):
+        log.error(f"Answer file {filename} must contain a JSON object")
+        return None
+    unknown = [key for key in answers.keys() if key not in ANSWER_KEYS]
+    if len(unknown) > 0:
+        log.error(f"Unknown settings in answer file {filename}: {unknown}")
+        return None
+    return answers
+
+
+class HeadlessConfig(object):
+    """
+    Stands in for WekaConfigApp - has the same attributes, so WekaCluster can generate config.sh from it
+    """
+    def __init__(self, hostgroup):
+        self.target_hosts = hostgroup  # WekaHostGroup object
+        self.selected_dps = list()
+        self.selected_hosts = dict()
+        self.selected_cores = None
+        self.clustername = ""
+        self.datadrives = None
+        self.paritydrives = None
+        self.cleanexit = False
+        self.hot_spares = 1
+        self.dedicated = True
+        self.auto_failure_domain = False
+        self.cloud_enable = False
+        self.weka_ver = hostgroup.reference_host.version.split('.')
+        self.Multicontainer = int(self.weka_ver[0]) >= 4
+        self.protocols_memory = 0
+        self.HighAvailability = False
+        self.nets = list()
+        self.one_net_multi_nic = False
+        self.min_host_ramGB = None
+        self.num_containers_per_host = None
+
+    def apply(self, answers):
+        """
+        make the choices in answers, the way the UI would
+
+        :param answers: from load_answers()
+        :return: True if we can generate a config; errors are logged
+        """
+        if not self.select_networks(answers.get("networks")):
+            return False
+        if not self.select_hosts(answers.get("hosts", dict())):
+            return False
+        self.set_options(answers)
+        if not self.select_cores(answers.get("bias", dict()), answers.get("cores", dict()),
+                                 answers.get("protocols_memory")):
+            return False
+        if not self.set_protection(answers):
+            return False
+        self.clustername = answers.get("cluster_name", "")
+        self.cleanexit = True
+        return True
+
+    def select_networks(self, networks):
+        """
+        like SelectHostsForm.guess_networks() and the Networks widget
+        """
+        seen = list()
+        for iface, nic in sorted(self.target_hosts.reference_host.nics.items()):
+            if nic.network in seen:
+                self.one_net_multi_nic = True
+            else:
+                seen.append(nic.network)
+                self.nets.append(nic.network)
+
+        if networks is None:
+            self.selected_dps = list(self.nets)
+        else:
+            for network in networks:
+                try:
+                    dp = ipaddress.IPv4Network(network, strict=False)
+                except ValueError as exc:
+                    log.error(f"Invalid network in answer file: {exc}")
+                    return False
+                if dp not in self.nets:
+                    log.error(f"Network {dp} is not on the reference host - choose from {[str(n) for n in self.nets]}")
+                    return False
+                self.selected_dps.append(dp)
+        if len(self.selected_dps) == 0:
+            log.error("No dataplane networks selected")
+            return False
+        log.info(f"Dataplane networks: {[str(dp) for dp in self.selected_dps]}")
+        return True
+
+    def select_hosts(self, rules):
+        """
+        the hosts reachable on the selected networks (like the Networks widget), narrowed to the ones on all of
+        them by filter_hosts(), then by the answer file's include/exclude patterns
+        """
+        network_index = self.target_hosts.network_index
+        possible_hosts = network_index.hostnames(network_index.reachable(self.selected_dps))
+        usable = self.target_hosts.usable_hosts
+        candidates = {hostname: usable[hostname] for hostname in possible_hosts if hostname in usable}
+
+        included, excluded = filter_hosts(self.selected_dps, candidates, self.target_hosts.mesh, network_index)
+        for hostname in sorted(excluded.keys()):
+            log.info(f"{hostname} is not on all the selected networks - skipping")
+
+        include = rules.get("include", ["*"])
+        exclude = rules.get("exclude", [])
+        for hostname in sorted(included.keys()):
+            if not any(fnmatch.fnmatch(hostname, pattern) for pattern in include):
+                continue
+            if any(fnmatch.fnmatch(hostname, pattern) for pattern in exclude):
+                continue
+            self.selected_hosts[hostname] = included[hostname]
+
+        min_hosts = rules.get("min_hosts", MIN_HOSTS)
+        if len(self.selected_hosts) < min_hosts:
+            log.error(f"Only {len(self.selected_hosts)} hosts selected - need at least {min_hosts}")
+            return False
+        log.info(f"Selected hosts: {list(self.selected_hosts.keys())}")
+
+        # find the amount of RAM we can use...  min of all hosts in the cluster
+        self.min_host_ramGB = self.target_hosts.host_table.min("ram_gb", self.selected_hosts.keys())
+        return True
+
+    def set_options(self, answers):
+        """
+        like the Hosts widget - HA if there's more than one dataplane nic; MCB from the weka version
+        """
+        if answers.get("high_availability") is not None:
+            self.HighAvailability = answers["high_availability"]
+        else:
+            self.HighAvailability = len(self.selected_dps) > 1 or self.one_net_multi_nic
+        if answers.get("multicontainer") is not None:
+            self.Multicontainer = answers["multicontainer"]
+
+    def select_cores(self, bias, overrides, protocols_memory):
+        """
+        like SelectCoresForm and the BiasWidget, then any core overrides, checked the way the core widgets do
+        """
+        host_table = self.target_hosts.host_table
+        num_cores, homogeneous = host_cores(host_table, self.selected_hosts.keys())
+        if not homogeneous:
+            log.warning("The hosts are not homogenous; they have different numbers of cores/threads.")
+        cores = Cores(num_cores, host_drives(host_table, self.selected_hosts.keys()), self.Multicontainer)
+        cores.protocols = bias.get("protocols", False) or bias.get("protocols_primary", False)
+        cores.proto_primary = bias.get("protocols_primary", False)
+        cores.drives_bias = bias.get("drives", False)
+        cores.drives = cores.num_actual_drives
+        cores.calculate()
+        self.selected_cores = cores
+
+        if cores.protocols:
+            self.protocols_memory = 60 if cores.proto_primary else 20  # reserve RAM for protocol
+        if protocols_memory is not None:
+            self.protocols_memory = protocols_memory
+        if self.protocols_memory > self.min_host_ramGB:
+            log.error(f"{self.protocols_memory}GB of ram is greater than the max usable of {self.min_host_ramGB}GB")
+            return False
+
+        for core_type in ("fe", "drives", "compute"):
+            if core_type not in overrides:
+                continue
+            if overrides[core_type] <= 0:
+                log.error(f"You must have at least 1 {core_type.upper()} core")
+                return False
+            if overrides[core_type] > cores.usable - 2:  # have to leave 1 compute and 1 drives core!
+                log.error(f"Too many {core_type.upper()} cores - you must allow for at least 1 of each core type")
+                return False
+            setattr(cores, core_type, overrides[core_type])
+        cores.used = cores.fe + cores.drives + cores.compute
+        if cores.used > cores.usable:
+            log.error(f"Too many total cores ({cores.used}) - only {cores.usable} are usable")
+            return False
+        log.info(str(cores))
+
+        # calculate the number of containers we'll have
+        if self.Multicontainer:
+            self.num_containers_per_host = 3
+            for count in (cores.drives, cores.compute, cores.fe):
+                if count > 19:
+                    self.num_containers_per_host += 1
+        else:
+            self.num_containers_per_host = 1
+        return True
+
+    def set_protection(self, answers):
+        """
+        data/parity/spares - defaults as in SelectCoresForm, checked the way the data/parity/spares widgets do
+        """
+        clustersize = len(self.selected_hosts)
+        if clustersize <= 18:
+            self.datadrives = max(clustersize - 3, 3)
+        else:
+            self.datadrives = 16
+        self.paritydrives = 2
+        self.datadrives = answers.get("data_drives", self.datadrives)
+        self.paritydrives = answers.get("parity_drives", self.paritydrives)
+        self.hot_spares = answers.get("hot_spares", self.hot_spares)
+
+        if self.paritydrives not in [2, 4]:
+            log.error("Parity must be either 2 or 4")
+            return False
+        if self.paritydrives == 4 and clustersize <= 8:
+            log.error("Parity of 4 can only be used with clusters with more than 8 hosts")
+            return False
+        max_data = (clustersize - self.paritydrives) if clustersize < (16 + self.paritydrives) else 16
+        if self.datadrives not in range(3, max_data + 1):
+            log.error(f"Data drives must be between 3 and {max_data}")
+            return False
+        if self.datadrives + self.paritydrives == clustersize and clustersize > 5:
+            log.warning(f"Stripe width ({self.datadrives}+{self.paritydrives}) matches cluster size, forming a " +
+                        f"narrow cluster. Using a stripe width of {self.datadrives - 1}+{self.paritydrives} is " +
+                        "strongly recommended instead.")
+        if self.hot_spares >= clustersize or self.hot_spares < 0:
+            log.error("Hot Spares out of range")
+            return False
+        return True
@@ -0,0 +1,106 @@
+################################################################################################
+# API connection racing
+################################################################################################
+# A host beacons on all of its ips, and we often can't reach some of them (dataplane networks that aren't routed to
+# us).  Rather than trying them one after another and waiting out a timeout on each, open the API on all of them at
+# once, a little apart ("happy eyeballs", RFC 8305), and take the first that logs in.  The subnets that win are
+# remembered, so later hosts try those first - on a big fleet, nearly every host then opens on its first try.
+import ipaddress
+import queue
+import threading
+from collections import Counter
+from logging import getLogger
+
+from wekalib.exceptions import LoginError, CommunicationError, NewConnectionError
+
+log = getLogger(__name__)
+
+DEFAULT_STAGGER = 0.25  # seconds between starting attempts, unless the previous one fails first
+FALLBACK_PREFIX = 24  # how ips are grouped when they aren't on a network we know
+
+
+class ApiRacer(object):
+    def __init__(self, stagger=DEFAULT_STAGGER):
+        """
+        :param stagger: seconds to wait for an attempt before starting the next one
+        """
+        self.stagger = stagger
+        self.networks = list()  # networks we know of (the reference host's), to group ips by
+        self.wins = Counter()  # {network: number of hosts whose API opened on it}
+        self._lock = threading.Lock()
+
+    def subnet(self, ip):
+        """
+        :return: the known network ip is on, or its /FALLBACK_PREFIX if it isn't on one (None if ip isn't an ip addr)
+        """
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None  # a hostname
+        for network in self.networks:
+            if address in network:
+                return network
+        return ipaddress.ip_network(f"{address}/{FALLBACK_PREFIX if address.version == 4 else 64}", strict=False)
+
+    def order(self, ip_list):
+        """
+        :return: ip_list with the ips on the subnets that have won most often first (otherwise in the same order)
+        """
+        with self._lock:
+            wins = {ip: self.wins[self.subnet(ip)] for ip in ip_list}
+        return sorted(ip_list, key=lambda ip: -wins[ip])
+
+    def race(self, hostname, ip_list, opener):
+        """
+        Start opener on each ip in turn - the next starts after stagger seconds, or as soon as the one before it
+        fails - and return the first that succeeds.  Attempts still running when one wins are left to finish in the
+        background and what they return is dropped (a blocked connect can't be cancelled).
+
+        :param hostname: for logging
+        :param ip_list: list of ip addrs (or hostnames) to try
+        :param opener: opener(ip) returns an open WekaApi, or raises
+        :return: (api, ip, number of attempts started), api and ip are None if none of them worked
+        """
+        ordered = self.order(ip_list)
+        results = queue.Queue()
+
+        def attempt(ip):
+            try:
+                results.put((ip, opener(ip)))
+            except LoginError:
+                log.debug(f"host {hostname} failed login on ip {ip}?")
+                results.put((ip, None))
+            except (CommunicationError, NewConnectionError) as exc:
+                log.debug(f"Error opening API for host {hostname} on ip {ip}: {exc}")
+                results.put((ip, None))
+            except Exception as exc:
+                log.error(f"Other exception on host {hostname}: {exc}")
+                results.put((ip, None))
+
+        started = 0
+        finished = 0
+
+        def start_next():
+            nonlocal started
+            threading.Thread(target=attempt, args=(ordered[started],), daemon=True,
+                             name=f"api-{hostname}-{started}").start()
+            started += 1
+
+        while finished < len(ordered):
+            if started == finished:  # nothing in flight - start the next one now
+                start_next()
+            try:
+                ip, api = results.get(timeout=self.stagger if started < len(ordered) else None)
+            except queue.Empty:
+                log.debug(f"{hostname}: no answer yet - also trying {ordered[started]}")
+                start_next()
+                continue
+            finished += 1
+            if api is not None:
+                with self._lock:
+                    self.wins[self.subnet(ip)] += 1
+                return api, ip, started
+        return None, None, started
+
+
+default_racer = ApiRacer()
@@ -0,0 +1,314 @@
+################################################################################################
+# Discovery scale benchmarks
+################################################################################################
+# Times the CPU-side discovery stages (no API or ssh) against in-process synthetic fleets of STEMHosts, from a
+# handful of hosts to thousands, and reports the time and peak memory of each stage at each fleet size - so we can
+# see where things go quadratic.  Results are JSON; --compare shows the change from an earlier run (another commit)
+#
+#     python benchmark.py --sizes 8,64,512,2048,10000 --output bench.json
+#     python benchmark.py --output bench-new.json --compare bench.json
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import types
+from logging import getLogger
+
+from sortedcontainers import SortedDict
+
+from hosttable import HostTable
+from logic import filter_hosts
+from netindex import NetworkIndex
+from simulator import Fleet, load_profile
+from timing import default_recorder
+from weka import STEMHost, WekaHostGroup
+from widgets import Networks
+
+log = getLogger(__name__)
+
+BENCHMARK_FORMAT = 1
+DEFAULT_SIZES = (8, 32, 128, 512, 2048, 10000)
+DEFAULT_REPEAT = 3
+
+
+def build_hostgroup(fleet):
+    """
+    a WekaHostGroup as it would be after discovery - every host's machine info parsed, nics validated and pingable
+    from the reference host - without running discovery
+
+    :param fleet: a simulator.Fleet (its API is never started; we only want its hosts' machine info)
+    :return: WekaHostGroup
+    """
+    group = WekaHostGroup.__new__(WekaHostGroup)
+    group.mixed_networking = False
+    group.link_types = list()
+    group.local_subnets = list()
+    group.isrouted = False
+    group.one_network = False
+    group.usable_hosts = SortedDict()
+    group.accessible_hosts = SortedDict()
+    group.pingable_ips = SortedDict()
+    group.networks = SortedDict()
+    group.candidates = SortedDict()
+    group.rejected_hosts = SortedDict()
+    group.uuids = dict()
+    group.mesh = None
+    group.local_ips = list()
+    group._lock = threading.Lock()
+
+    for sim_host in fleet.hosts:
+        host = STEMHost(sim_host.name)
+        host.machine_info = sim_host.machine_info
+        host.parse_machine_info()
+        host.validate_nics()
+        host.beacon_ips = list(sim_host.ips)
+        group.candidates[host.name] = host
+    group.reference_host = group.candidates[fleet.hosts[0].name]
+    group.reference_host.is_reference = True
+    group.weka_version = group.reference_host.version
+    for host in group.candidates.values():
+        group.claim_uuid(host)
+
+    for source_interface, nic in group.reference_host.nics.items():
+        group.accessible_hosts[source_interface] = set()
+        group.pingable_ips[source_interface] = [nic]
+        group.networks[source_interface] = set()
+    for host in group.candidates.values():
+        for source_interface, source_nic in group.reference_host.nics.items():
+            for targetif, targetip in host.nics.items():
+                if targetip.network == source_nic.network and str(targetip.ip) not in fleet.hosts[0].unreachable:
+                    group.add_reachable(source_interface, host.name, targetip)
+    return group
+
+
+def reset_analysis(group):
+    # what analyze_networks() fills in, so it can be run again
+    group.usable_hosts = SortedDict()
+    group.local_subnets = list()
+    group.link_types = list()
+    group.isrouted = False
+    group.one_network = False
+    group.mixed_networking = False
+
+
+def networks_widget(group):
+    """
+    :return: a stand-in for the Networks widget on SelectHostsForm (with every network selected), with just what
+             when_value_edited() uses
+    """
+    nets = list()
+    for nic in group.reference_host.nics.values():
+        if nic.network not in nets:
+            nets.append(nic.network)
+    app = types.SimpleNamespace(target_hosts=group, nets=nets, selected_dps=list(), possible_hosts=set())
+    form = types.SimpleNamespace(parentApp=app, display=lambda: None,
+                                 dataplane_networks_field=types.SimpleNamespace(value=list(range(len(nets)))))
+    return types.SimpleNamespace(parent=form)
+
+
+def stage_validate_nics(group):
+    for host in group.candidates.values():
+        host.nics = SortedDict()
+        host.validate_nics()
+
+
+def stage_check_weka_release(group):
+    # just the release and uuid checks - the hosts' details were parsed when the fleet was built.  No uuids are
+    # claimed at the start, and no hosts are rejected, so every run does the same work
+    group.uuids = dict()
+    for host in group.candidates.values():
+        group.release_problem(host)
+
+
+def stage_analyze_networks(group):
+    reset_analysis(group)
+    group.analyze_networks()
+
+
+def stage_host_table(group):
+    group.host_table = HostTable(group.usable_hosts)
+
+
+def stage_network_index(group):
+    group.network_index = NetworkIndex(group.usable_hosts, group.reference_host, group.accessible_hosts)
+
+
+def stage_filter_hosts(group):
+    filter_hosts([nic.network for nic in group.reference_host.nics.values()], group.usable_hosts, group.mesh,
+                 group.network_index)
+
+
+def stage_networks_widget(group):
+    Networks.when_value_edited(networks_widget(group))
+
+
+# in the order discovery runs them - analyze_networks fills in usable_hosts (and the host table and network index
+# are built from it) for the ones after it
+STAGES = (
+    ("validate_nics", stage_validate_nics),
+    ("check_weka_release", stage_check_weka_release),
+    ("check_uuids", WekaHostGroup.check_uuids),
+    ("analyze_networks", stage_analyze_networks),
+    ("host_table", stage_host_table),
+    ("network_index", stage_network_index),
+    ("is_homogeneous", WekaHostGroup.is_homogeneous),
+    ("filter_hosts", stage_filter_hosts),
+    ("networks_widget", stage_networks_widget),
+)
+
+
+def measure(stage, group, repeat):
+    """
+    :return: (best time of repeat runs in seconds, peak memory allocated during a run in bytes)
+    """
+    best = None
+    for run in range(repeat):
+        start = time.perf_counter()
+        stage(group)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        default_recorder.spans = list()  # the @timed stages add spans; don't let them pile up
+
+    tracemalloc.start()  # slows things down, so it gets a run of its own
+    stage(group)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    default_recorder.spans = list()
+    return best, peak
+
+
+def growth(results):
+    """
+    :param results: list of {"hosts", "seconds"}, by increasing host count
+    :return: the exponent k in time ~ hosts**k between each pair of sizes (1 is linear, 2 is quadratic)
+    """
+    exponents = list()
+    for smaller, larger in zip(results, results[1:]):
+        if smaller["seconds"] <= 0 or larger["seconds"] <= 0:
+            exponents.append(None)
+            continue
+        exponents.append(round(math.log(larger["seconds"] / smaller["seconds"]) /
+                               math.log(larger["hosts"] / smaller["hosts"]), 2))
+    return exponents
+
+
+def run_benchmarks(sizes, repeat=DEFAULT_REPEAT, stages=None, profile=None):
+    """
+    :param sizes: fleet sizes (number of hosts)
+    :param stages: names of the stages to run, or None for all of them
+    :param profile: simulator.Fleet settings for the synthetic hosts
+    :return: dict of results, ready to be written as JSON
+    """
+    results = {name: list() for name, stage in STAGES if stages is None or name in stages}
+    for num_hosts in sorted(sizes):
+        start = time.perf_counter()
+        group = build_hostgroup(Fleet(num_hosts, **(profile or dict())))
+        stage_analyze_networks(group)  # fills in usable_hosts, in case analyze_networks isn't one of the stages
+        stage_host_table(group)
+        stage_network_index(group)
+        log.info(f"{num_hosts} hosts: fleet built in {round(time.perf_counter() - start, 2)}s")
+        for name, stage in STAGES:
+            if name not in results:
+                continue
+            seconds, peak = measure(stage, group, repeat)
+            results[name].append({"hosts": num_hosts, "seconds": round(seconds, 6), "peak_bytes": peak})
+            log.info(f"    {name}: {round(seconds * 1000, 3)}ms, peak {round(peak / 1024 / 1024, 2)}MiB")
+
+    return {
+        "format": BENCHMARK_FORMAT,
+        "created": time.time(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "repeat": repeat,
+        "profile": profile or dict(),
+        "stages": {name: {"results": stage_results, "growth": growth(stage_results)}
+                   for name, stage_results in results.items()},
+    }
+
+
+def git_commit():
+    """
+    :return: the commit we're running from, or None if we can't tell
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(old, new):
+    """
+    :return: list of lines showing how each stage's time and peak memory changed, for sizes that are in both
+    """
+    lines = [f"{old.get('commit')} -> {new.get('commit')}"]
+    for name, stage in new["stages"].items():
+        if name not in old["stages"]:
+            continue
+        before = {result["hosts"]: result for result in old["stages"][name]["results"]}
+        for result in stage["results"]:
+            previous = before.get(result["hosts"])
+            if previous is None:
+                continue
+            ratio = result["seconds"] / previous["seconds"] if previous["seconds"] > 0 else float("inf")
+            lines.append(f"{name:>20} {result['hosts']:>6} hosts: {previous['seconds'] * 1000:10.3f}ms -> " +
+                         f"{result['seconds'] * 1000:10.3f}ms ({ratio:.2f}x), peak " +
+                         f"{previous['peak_bytes'] / 1024 / 1024:.2f} -> {result['peak_bytes'] / 1024 / 1024:.2f}MiB")
+    return lines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the discovery stages against synthetic fleets")
+    parser.add_argument("--sizes", type=str, default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help=f"comma-separated fleet sizes (default {','.join(str(size) for size in DEFAULT_SIZES)})")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help=f"time each stage this many times and keep the best (default {DEFAULT_REPEAT})")
+    parser.add_argument("--stages", type=str, default=None,
+                        help=f"comma-separated stages to run (default all: {','.join(name for name, s in STAGES)})")
+    parser.add_argument("--profile", type=str, default=None,
+                        help="JSON file of synthetic host settings (see simulator.py)")
+    parser.add_argument("--output", type=str, default=None, help="write the results to this JSON file")
+    parser.add_argument("--compare", type=str, default=None, help="compare with the results in this JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    logging.getLogger("weka").setLevel(logging.CRITICAL)  # the stages log about every host
+    logging.getLogger("logic").setLevel(logging.CRITICAL)
+
+    profile = None
+    if args.profile is not None:
+        profile = load_profile(args.profile)
+        if profile is None:
+            sys.exit(1)
+    stages = None
+    if args.stages is not None:
+        stages = [name.strip() for name in args.stages.split(",")]
+        unknown = [name for name in stages if name not in dict(STAGES)]
+        if len(unknown) > 0:
+            log.error(f"Unknown stages {unknown} - choose from {[name for name, stage in STAGES]}")
+            sys.exit(1)
+
+    report = run_benchmarks([int(size) for size in args.sizes.split(",")], args.repeat, stages, profile)
+
+    for name, stage in report["stages"].items():
+        log.info(f"{name}: growth {stage['growth']}")
+    if args.output is not None:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=2)
+        log.info(f"Results written to {args.output}")
+    if args.compare is not None:
+        try:
+            with open(args.compare) as fp:
+                baseline = json.load(fp)
+        except (OSError, ValueError) as exc:
+            log.error(f"Unable to read {args.compare}: {exc}")
+            sys.exit(1)
+        for line in compare(baseline, report):
+            log.info(line)
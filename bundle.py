@@ -0,0 +1,226 @@
+################################################################################################
+# Record/replay bundles
+################################################################################################
+# --record saves every API response and remote command (with its output and how long it took) to a bundle;
+# --replay serves them back with no network or ssh at all.  Discovery runs the same way either way, so a customer's
+# scan can be re-run (and debugged, or profiled) on a laptop
+import atexit
+import gzip
+import json
+import threading
+import time
+from logging import getLogger
+
+import wekalib.exceptions
+from wekapyutils.wekassh import CommandOutput
+
+log = getLogger(__name__)
+
+BUNDLE_FORMAT = 1
+
+
+class RecordingApi(object):
+    """
+    wraps a WekaApi, recording what weka_api_command() returns
+    """
+    def __init__(self, bundle, hostname, api):
+        self._bundle = bundle
+        self._hostname = hostname
+        self._api = api
+
+    def __getattr__(self, name):
+        return getattr(self._api, name)  # STEMMode, etc
+
+    def weka_api_command(self, method, parms=None):
+        key = f"{self._hostname} {method} {json.dumps(parms, sort_keys=True)}"
+        return self._bundle.record_call("api", key, lambda: self._api.weka_api_command(method, parms=parms))
+
+
+class ReplayApi(object):
+    """
+    stands in for a WekaApi, serving weka_api_command() from the bundle
+    """
+    def __init__(self, bundle, hostname, stem_mode):
+        self._bundle = bundle
+        self._hostname = hostname
+        self.STEMMode = stem_mode
+
+    def weka_api_command(self, method, parms=None):
+        return self._bundle.replay_call("api", f"{self._hostname} {method} {json.dumps(parms, sort_keys=True)}")
+
+
+class ReplayConnection(object):
+    """
+    stands in for a connected RemoteServer - commands go through the bundle, not here
+    """
+    def __init__(self, hostname):
+        self.hostname = hostname
+        self.connected = True
+
+
+class IOBundle(object):
+    """
+    Everything that talks to the outside world goes through here.  Normally it just calls through; when recording
+    it saves what came back, and when replaying it answers from the bundle instead.
+
+    Entries are kept in lists by key, in the order they happened; replay hands them out in the same order
+    (repeating the last one if it's asked more times than were recorded)
+    """
+    def __init__(self):
+        self.mode = None  # None, "record" or "replay"
+        self.filename = None
+        self.latency = 1.0  # replay: multiply the recorded latencies by this (0 to not wait at all)
+        self.entries = {"local_ips": dict(), "api_open": dict(), "api": dict(), "connect": dict(), "run": dict()}
+        self.cursors = dict()
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, filename):
+        """
+        start recording; the bundle is saved when we exit (so failed scans are captured too)
+        """
+        self.mode = "record"
+        self.filename = filename
+        atexit.register(self.save)
+        log.info(f"Recording API and ssh traffic to {filename}")
+
+    def replay(self, filename, latency=1.0):
+        """
+        :return: False if the bundle can't be loaded
+        """
+        try:
+            with gzip.open(filename, "rt") as fp:
+                contents = json.load(fp)
+        except (OSError, ValueError) as exc:
+            log.error(f"Unable to read bundle {filename}: {exc}")
+            return False
+        if contents.get("format") != BUNDLE_FORMAT:
+            log.error(f"Bundle {filename} is from a different version of wekaconfig")
+            return False
+        self.entries = contents["entries"]
+        self.mode = "replay"
+        self.filename = filename
+        self.latency = latency
+        log.info(f"Replaying API and ssh traffic from {filename} (recorded {time.ctime(contents['created'])})")
+        return True
+
+    def save(self):
+        if self.mode != "record":
+            return
+        with self._lock:
+            try:
+                with gzip.open(self.filename, "wt") as fp:
+                    json.dump({"format": BUNDLE_FORMAT, "created": time.time(), "entries": self.entries}, fp)
+            except OSError as exc:
+                log.error(f"Unable to write bundle {self.filename}: {exc}")
+                return
+        log.info(f"Bundle saved to {self.filename}")
+
+    def _add(self, kind, key, entry):
+        with self._lock:
+            self.entries[kind].setdefault(key, list()).append(entry)
+
+    def _next(self, kind, key):
+        """
+        :return: the next recorded entry for key, or None if it was never recorded
+        """
+        with self._lock:
+            recorded = self.entries[kind].get(key)
+            if recorded is None or len(recorded) == 0:
+                self.misses += 1
+                log.error(f"Replay: no recorded {kind} for {key}")
+                return None
+            cursor = self.cursors.get((kind, key), 0)
+            self.cursors[(kind, key)] = cursor + 1
+            entry = recorded[min(cursor, len(recorded) - 1)]
+        if self.latency > 0:
+            time.sleep(entry["elapsed"] * self.latency)
+        return entry
+
+    def record_call(self, kind, key, call):
+        """
+        make the call, and record what it returned or raised, and how long it took
+        """
+        start = time.time()
+        try:
+            result = call()
+        except Exception as exc:
+            self._add(kind, key, {"elapsed": time.time() - start, "error": type(exc).__name__, "message": str(exc)})
+            raise
+        self._add(kind, key, {"elapsed": time.time() - start, "result": result})
+        return result
+
+    def replay_call(self, kind, key):
+        entry = self._next(kind, key)
+        if entry is None:
+            raise wekalib.exceptions.CommunicationError(f"{key} is not in the bundle")
+        if "error" in entry:
+            exc_class = getattr(wekalib.exceptions, entry["error"], None)
+            if not (isinstance(exc_class, type) and issubclass(exc_class, Exception)):
+                exc_class = Exception
+            raise exc_class(entry["message"])
+        return entry["result"]
+
+    def local_ips(self, getter):
+        """
+        :param getter: returns this host's ip addresses
+        """
+        if self.mode == "record":
+            return self.record_call("local_ips", "local", getter)
+        elif self.mode == "replay":
+            entry = self._next("local_ips", "local")
+            return [] if entry is None else entry["result"]
+        return getter()
+
+    def open_api(self, hostname, ip, opener):
+        """
+        :param hostname: the STEMHost's name
+        :param ip: the ip we're opening it on
+        :param opener: opens the API (returns a WekaApi, or raises)
+        """
+        key = f"{hostname} {ip}"
+        if self.mode == "record":
+            opened = list()
+
+            def open_and_keep():
+                opened.append(opener())
+                return opened[0].STEMMode  # all we need of it later
+
+            self.record_call("api_open", key, open_and_keep)
+            return RecordingApi(self, hostname, opened[0])
+        elif self.mode == "replay":
+            return ReplayApi(self, hostname, self.replay_call("api_open", key))
+        return opener()
+
+    def connect(self, hostname, connector):
+        """
+        :param connector: opens an ssh session to the host (returns a RemoteServer, or None)
+        """
+        if self.mode == "record":
+            server = connector()
+            self._add("connect", hostname, {"elapsed": 0, "result": server is not None})
+            return server
+        elif self.mode == "replay":
+            entry = self._next("connect", hostname)
+            return ReplayConnection(hostname) if entry is not None and entry["result"] else None
+        return connector()
+
+    def run(self, hostname, command, runner):
+        """
+        :param runner: runs the command on the host (returns a CommandOutput or CompletedProcess)
+        """
+        if self.mode == "record":
+            start = time.time()
+            output = runner()
+            self._add("run", f"{hostname} {command}", {"elapsed": time.time() - start, "status": output.status,
+                                                       "stdout": output.stdout, "stderr": output.stderr})
+            return output
+        elif self.mode == "replay":
+            entry = self._next("run", f"{hostname} {command}")
+            if entry is None:
+                return CommandOutput(255, "", f"'{command}' on {hostname} is not in the bundle")
+            return CommandOutput(entry["status"], entry["stdout"], entry["stderr"])
+        return runner()
+
+
+default_bundle = IOBundle()
@@ -0,0 +1,112 @@
+################################################################################################
+# Machine info cache
+################################################################################################
+# keeps each host's machine_query_info output on disk between runs, so re-running the configurator
+# (while fixing cabling, for example) doesn't have to fetch and parse the full inventory of every host again
+import gzip
+import json
+import os
+import threading
+import time
+from logging import getLogger
+
+log = getLogger(__name__)
+
+CACHE_FORMAT = 1
+DEFAULT_CACHE_FILE = "wekaconfig_cache.json.gz"
+DEFAULT_CACHE_TTL = 3600  # seconds
+
+
+class MachineInfoCache(object):
+    """
+    Entries are keyed by hostname, product_uuid and weka version:
+        {hostname: {"<product_uuid> <version>": {"timestamp": t, "ips": [...], "machine_info": {...}}}}
+
+    An entry is only used if it hasn't expired, it's for the version we're looking for, and the host is still
+    beaconing on the same ips it had when it was cached - all things we know without asking the host.
+    """
+    def __init__(self, filename=DEFAULT_CACHE_FILE, ttl=DEFAULT_CACHE_TTL, refresh=False):
+        """
+        :param filename: where to keep the cache
+        :param ttl: how long (seconds) an entry is good for
+        :param refresh: ignore what's in the cache (but still update it)
+        """
+        self.filename = filename
+        self.ttl = ttl
+        self.refresh = refresh
+        self.hosts = dict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with gzip.open(self.filename, "rt") as fp:
+                contents = json.load(fp)
+        except (OSError, ValueError) as exc:
+            log.error(f"Unable to read cache {self.filename}: {exc} - ignoring it")
+            return
+        if contents.get("format") != CACHE_FORMAT:
+            log.info(f"cache {self.filename} is from a different version of wekaconfig - ignoring it")
+            return
+        self.hosts = contents["hosts"]
+        log.debug(f"loaded {len(self.hosts)} hosts from cache {self.filename}")
+
+    def save(self):
+        now = time.time()
+        with self._lock:
+            # don't keep expired entries around forever
+            for hostname, entries in list(self.hosts.items()):
+                for key, entry in list(entries.items()):
+                    if now - entry["timestamp"] > self.ttl:
+                        del entries[key]
+                if len(entries) == 0:
+                    del self.hosts[hostname]
+            try:
+                with gzip.open(self.filename, "wt") as fp:
+                    json.dump({"format": CACHE_FORMAT, "hosts": self.hosts}, fp)
+            except OSError as exc:
+                log.error(f"Unable to write cache {self.filename}: {exc}")
+                return
+        log.info(f"Machine info cache: {self.hits} hits, {self.misses} misses, {len(self.hosts)} hosts saved")
+
+    def lookup(self, hostname, version, ips):
+        """
+        :param hostname: the host we're looking for
+        :param version: the weka version it has to be running
+        :param ips: the ips it is beaconing on now
+        :return: the cached machine_info, or None
+        """
+        if self.refresh:
+            return None
+        now = time.time()
+        with self._lock:
+            best = None
+            for entry in self.hosts.get(hostname, dict()).values():
+                if entry["machine_info"]["version"] != version:
+                    continue
+                if now - entry["timestamp"] > self.ttl:
+                    continue
+                if sorted(entry["ips"]) != sorted(ips):
+                    continue
+                if best is None or entry["timestamp"] > best["timestamp"]:
+                    best = entry
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return best["machine_info"]
+
+    def store(self, hostname, ips, machine_info, product_uuid):
+        with self._lock:
+            self.hosts.setdefault(hostname, dict())[f"{product_uuid} {machine_info['version']}"] = {
+                "timestamp": time.time(),
+                "ips": list(ips),
+                "machine_info": machine_info}
+
+    def invalidate(self, hostname):
+        with self._lock:
+            self.hosts.pop(hostname, None)
@@ -0,0 +1,267 @@
+################################################################################################
+# In-process deployment
+################################################################################################
+# Does what config.sh does (the same WekaCluster.phases()) from inside the tool, over the ssh sessions discovery
+# already opened (sshpool.py) - rather than config.sh spawning an ssh or scp process, and doing a handshake, for
+# every step.  Each host's chain of steps runs in its own thread, up to max_jobs hosts at a time, failed steps are
+# retried if they're safe to repeat (see output.Step), and every step is timed, so each phase of a deployment has
+# real throughput numbers (--deploy-report).
+#
+# The cluster-wide steps (config.sh runs them on the node it's run on) run on the reference host.  They're weka CLI
+# commands - the API sessions discovery has open are to STEM-mode hosts, which can't create or configure a cluster
+import json
+import os
+import threading
+import time
+from logging import getLogger
+
+from wekapyutils.sthreads import simul_threads
+
+from output import DEFAULT_MAX_JOBS, LIST_CONTAINERS, ADD_DRIVES, Step
+from sshpool import default_pool
+from timing import default_recorder
+
+log = getLogger(__name__)
+
+REPORT_FORMAT = 1
+DEFAULT_DEPLOY_REPORT = "wekaconfig_deploy.json"
+DEFAULT_STEP_RETRIES = 2  # times to retry a failed step (if it's safe to)
+RETRY_DELAY = 5.0  # seconds before the first retry of a step; it doubles each time
+STEP_TIMEOUT = 900  # seconds - setting up a container or creating the cluster can take minutes
+PROGRESS_INTERVAL = 5.0  # seconds between progress messages in a phase
+
+
+class Deployment(object):
+    def __init__(self, cluster, target_hosts, max_jobs=DEFAULT_MAX_JOBS, retries=DEFAULT_STEP_RETRIES,
+                 source_dir=".", timeout=STEP_TIMEOUT):
+        """
+        :param cluster: output.WekaCluster to deploy
+        :param target_hosts: the WekaHostGroup it was planned from (its STEMHosts have the ssh sessions)
+        :param max_jobs: how many hosts to work on at once
+        :param retries: times to retry a failed step
+        :param source_dir: where resources_generator.py is (config.sh expects it in the current directory)
+        :param timeout: seconds to allow each step
+        """
+        self.cluster = cluster
+        self.hosts = target_hosts.candidates
+        self.admin = target_hosts.reference_host  # where the cluster-wide steps run
+        self.max_jobs = max_jobs
+        self.retries = retries
+        self.source_dir = source_dir
+        self.timeout = timeout
+        self.drive_lists = dict()  # {(hostname, drives container): [device paths]}, read as the hosts are prepared
+        self.steps = list()  # a record of every step we've done
+        self.phases = list()  # a summary of each phase
+        self.started = None
+        self.finished = None
+        self.ssh = dict()  # how many ssh handshakes and commands the deployment took
+        self._lock = threading.Lock()
+
+    def run(self):
+        """
+        run every phase, stopping after a phase where something failed
+
+        :return: True if every step succeeded
+        """
+        self.started = time.time()
+        before = default_pool.stats()
+        try:
+            for phase in self.cluster.phases():
+                log.info(f"Deploying: {phase.name}")
+                with default_recorder.span(f"deploy_{phase.name}") as timer:
+                    ok = self.run_phase(phase)
+                    if not ok:
+                        timer.outcome = "failed"
+                if not ok:
+                    log.error(f"Deployment stopped - the {phase.name} phase failed")
+                    return False
+        finally:
+            self.finished = time.time()
+            after = default_pool.stats()
+            self.ssh = {key: after[key] - before[key] for key in ("handshakes", "commands")}
+            log.info(f"ssh: {self.ssh['handshakes']} new handshakes for {self.ssh['commands']} deployment commands")
+        log.info(f"Deployment complete in {round(self.finished - self.started, 1)}s")
+        return True
+
+    def run_phase(self, phase):
+        """
+        :return: True if every step in the phase succeeded
+        """
+        start = time.time()
+        first_step = len(self.steps)
+        failed_hosts = list()
+        ok = True
+
+        chains = [(host, steps) for host, steps in phase.chains.items() if len(steps) > 0]
+        if len(chains) > 0:
+            progress = {"done": 0, "reported": start}
+
+            def chain(host, steps):
+                for step in steps:
+                    if not self.run_step(phase.name, step):
+                        with self._lock:
+                            failed_hosts.append(host.name)
+                        break
+                with self._lock:
+                    progress["done"] += 1
+                    if progress["done"] == len(chains) or time.time() - progress["reported"] >= PROGRESS_INTERVAL:
+                        progress["reported"] = time.time()
+                        log.info(f"{phase.name}: {progress['done']}/{len(chains)} hosts done" +
+                                 (f", {len(failed_hosts)} failed" if len(failed_hosts) > 0 else ""))
+
+            threader = simul_threads(self.max_jobs)
+            for host, steps in chains:
+                threader.new(chain, host, steps)
+            threader.run()
+            if len(failed_hosts) > 0:
+                log.error(f"{phase.name} failed on {len(failed_hosts)} hosts: {sorted(failed_hosts)}")
+                ok = False
+
+        for step in phase.steps:
+            if not ok:
+                break
+            ok = self.run_step(phase.name, step)
+
+        seconds = time.time() - start
+        steps = self.steps[first_step:]
+        self.phases.append({
+            "phase": phase.name,
+            "seconds": round(seconds, 3),
+            "hosts": len(chains),
+            "steps": len(steps),
+            "failed": sum(1 for step in steps if step["outcome"] != "ok"),
+            "failed_hosts": sorted(failed_hosts),
+            "steps_per_second": round(len(steps) / seconds, 2) if seconds > 0 else None,
+        })
+        return ok
+
+    def run_step(self, phase, step):
+        """
+        do one step, retrying it (if it's safe to) when it fails
+
+        :return: True if it succeeded
+        """
+        if step.action == "add_drives":
+            return self.add_drives(phase)
+        return self._step(phase, step) is not None
+
+    def _step(self, phase, step):
+        """
+        :return: the step's CommandOutput, or None if it failed
+        """
+        host = self.admin if step.host is None else self.hosts[step.host.name]
+        label = f"copy {step.command} to {step.target}" if step.action == "copy" else step.description or step.command
+        attempts = 0
+        output = None
+        span_host = None if step.host is None else step.host.name  # cluster-wide steps aren't any host's time
+        with default_recorder.span(f"deploy_{phase}_step", span_host) as timer:
+            for attempt in range(1 + (self.retries if step.retry else 0)):
+                if attempt > 0:
+                    delay = RETRY_DELAY * 2 ** (attempt - 1)
+                    log.warning(f"{host.name}: '{label[:100]}' failed ({self._reason(output)}), " +
+                                f"retrying in {delay}s")
+                    timer.retries += 1
+                    time.sleep(delay)
+                attempts += 1
+                log.debug(f"{host.name}: {label}")
+                if step.action == "copy":
+                    output = host.put(os.path.join(self.source_dir, step.command), step.target)
+                else:
+                    output = host.run(step.command, timeout=self.timeout)
+                if output is not None and output.status == 0:
+                    break
+            ok = output is not None and output.status == 0
+            if not ok:
+                timer.outcome = "failed"
+                log.error(f"{host.name}: '{label[:100]}' failed after {attempts} attempts: {self._reason(output)}")
+            elif step.action == "drives":
+                with self._lock:
+                    self.drive_lists[(step.host.name, step.target)] = output.stdout.split()
+
+        with self._lock:
+            self.steps.append({
+                "phase": phase,
+                "host": host.name,
+                "step": label,
+                "start": round(timer.start - self.started, 3),
+                "seconds": round(timer.duration, 3),
+                "attempts": attempts,
+                "status": None if output is None else output.status,
+                "outcome": timer.outcome,
+            })
+        return output if ok else None
+
+    def add_drives(self, phase):
+        """
+        add each drives container's drives - its id from one listing of the cluster's containers, and its drives
+        from the lists read as the hosts were prepared
+
+        :return: True if every container's drives were added
+        """
+        output = self._step(phase, Step("run", None, LIST_CONTAINERS, description="Listing the cluster's containers",
+                                        retry=True))
+        if output is None:
+            return False
+
+        adds = list()
+        wanted = set(key for key, paths in self.drive_lists.items() if len(paths) > 0)
+        for line in output.stdout.splitlines():
+            words = line.split()
+            if len(words) < 3:
+                continue
+            container_id, hostname, container = words[:3]
+            paths = self.drive_lists.get((hostname, container))
+            if container.startswith("drives") and paths:
+                wanted.discard((hostname, container))
+                adds.append(Step("run", None, f"{ADD_DRIVES} {container_id} {' '.join(paths)}",
+                                 description=f"Adding drives to {container} on {hostname}"))
+        if len(wanted) > 0:
+            log.error(f"Drives containers not in the cluster: {sorted(f'{host}/{name}' for host, name in wanted)}")
+            return False
+
+        failed = list()
+
+        def add(step):
+            if not self.run_step(phase, step):
+                with self._lock:
+                    failed.append(step.description)
+
+        threader = simul_threads(self.max_jobs)
+        for step in adds:
+            threader.new(add, step)
+        threader.run()
+        log.info(f"{phase}: added drives to {len(adds) - len(failed)}/{len(adds)} containers")
+        return len(failed) == 0
+
+    @staticmethod
+    def _reason(output):
+        if output is None:
+            return "not connected"
+        message = (output.stderr or output.stdout or "").strip()
+        return f"status {output.status}" + (f": {message.splitlines()[-1][:200]}" if len(message) > 0 else "")
+
+    def report(self):
+        """
+        :return: dict of each phase's time and throughput, and every step's
+        """
+        end = self.finished if self.finished is not None else time.time()
+        with self._lock:
+            return {
+                "format": REPORT_FORMAT,
+                "started": self.started,
+                "elapsed": round(end - self.started, 3) if self.started is not None else None,
+                "max_jobs": self.max_jobs,
+                "retries": self.retries,
+                "ssh": dict(self.ssh),
+                "phases": list(self.phases),
+                "steps": list(self.steps),
+            }
+
+    def write_report(self, filename):
+        try:
+            with open(filename, "w") as fp:
+                json.dump(self.report(), fp, indent=2)
+        except OSError as exc:
+            log.error(f"Unable to write deployment report to {filename}: {exc}")
+            return
+        log.info(f"Deployment report written to {filename}")
@@ -0,0 +1,76 @@
+################################################################################################
+# Host fact collection
+################################################################################################
+# Everything we need to know about a host's OS (cpu, addresses, links, routes, rules) in one round trip: a single
+# shell script that prints one JSON document, rather than a separate ssh command for each thing we want to know
+import json
+from logging import getLogger
+
+log = getLogger(__name__)
+
+FACTS_FORMAT = 1
+
+# j runs an "ip -j" command and prints its json, or null if this iproute2 doesn't do json (or the command fails).
+# lscpu is turned into a json object with awk, since older versions don't have "lscpu -J" (lscpu values never
+# have quotes or backslashes in them, so we just drop any)
+FACTS_SCRIPT = r"""
+j() { out=$("$@" 2>/dev/null) && [ -n "$out" ] && printf '%s' "$out" || printf 'null'; }
+printf '{"format": {format}, "addr": '; j ip -j addr show
+printf ', "link": '; j ip -j link show
+printf ', "route": '; j ip -4 -j route show table all
+printf ', "rule": '; j ip -4 -j rule show
+printf ', "lscpu": {'
+lscpu 2>/dev/null | awk -F: 'NF > 1 {
+    k = $1; v = substr($0, index($0, ":") + 1)
+    gsub(/^[ \t]+|[ \t]+$/, "", k); gsub(/^[ \t]+|[ \t]+$/, "", v)
+    gsub(/[\\"]/, "", k); gsub(/[\\"]/, "", v)
+    printf "%s\"%s\": \"%s\"", sep, k, v; sep = ", " }'
+printf '}}\n'
+"""
+
+
+def facts_command():
+    """
+    :return: the command to run on the host
+    """
+    return FACTS_SCRIPT.replace("{format}", str(FACTS_FORMAT))
+
+
+def parse_facts(hostname, cmd_output):
+    """
+    :param hostname: for logging
+    :param cmd_output: what running facts_command() on the host returned
+    :return: dict of facts, or None if we didn't get any
+    """
+    if cmd_output.status != 0:
+        log.error(f"Host {hostname}: fact collection failed with rc={cmd_output.status}: {cmd_output.stderr}")
+        return None
+    try:
+        facts = json.loads(cmd_output.stdout)
+    except ValueError as exc:
+        log.error(f"Host {hostname}: unable to parse fact collection output: {exc}")
+        return None
+    if facts.get("format") != FACTS_FORMAT:
+        log.error(f"Host {hostname}: unexpected fact collection output")
+        return None
+    return facts
+
+
+def ip_rules(facts):
+    """
+    :return: the host's source-based routing rules, in the same form as STEMHost.check_source_routing() -
+             {priority: [words]} - or None if the host couldn't tell us
+    """
+    if facts["rule"] is None:
+        return None
+    rules = dict()
+    for rule in facts["rule"]:
+        if rule.get("src", "all") == "all":  # same as 'ip rule show | grep -v all'
+            continue
+        src = rule["src"] if "srclen" not in rule else f"{rule['src']}/{rule['srclen']}"
+        words = ["from", src]
+        if "table" in rule:
+            words += ["lookup", rule["table"]]
+        rules[str(rule.get("priority", 0))] = words
+    return rules
+
@@ -13,7 +13,7 @@ from widgets import UsableCoresWidget, ComputeCoresWidget, FeCoresWidget, Drives
     NameWidget, DataWidget, ParityWidget, WekaTitleFixedText, MemoryWidget, Networks, Hosts, \
     SparesWidget, BiasWidget, OptionsWidget
 
-from logic import Cores
+from logic import Cores, host_cores, host_drives
 
 movement_help = """Cursor movement:
     arrow keys: up, down, left, right - move between and within fields
@@ -271,71 +271,17 @@ class SelectCoresForm(PrevDoneForm):
         self.parentApp.switchFormPrevious()  # go to previous screen; they hit 'Prev'
 
     def analyse_cores(self):
-        # let's gather together the info
-        xref_dict = dict()
-        xref_dict["cores"] = dict()
-        xref_dict["threads"] = dict()
-
-        for hostname in self.parentApp.selected_hosts:
-            xref_dict["cores"][hostname] = self.parentApp.target_hosts.usable_hosts[hostname].num_cores
-            xref_dict["threads"][hostname] = self.parentApp.target_hosts.usable_hosts[hostname].threads_per_core
-
-        # are they all the same?
-        reference_cores = 0
-        ref_threads_per_core = 0
-        errors = False
-        for host, cores in xref_dict["cores"].items():
-            if reference_cores == 0:
-                reference_cores = cores
-                # continue
-            else:
-                if cores != reference_cores:
-                    # Error!   hosts have different number of cores!
-                    errors = True
-                    # break
-
-            if ref_threads_per_core == 0:
-                ref_threads_per_core = xref_dict["threads"][host]  # should be for reference_host
-                # continue
-            else:
-                if xref_dict["threads"][host] != ref_threads_per_core:
-                    # Error!   hosts have different number of cores!
-                    errors = True
-                #    break
-
-        if errors:
+        PA = self.parentApp
+        cores, homogeneous = host_cores(PA.target_hosts.host_table, PA.selected_hosts.keys())
+        if not homogeneous:
             # make noise
             wekatui.notify_confirm("The hosts are not homogenous; they have different numbers of cores/threads.",
                                    title="Error", form_color='STANDOUT', wrap=True, editw=1)
-
-        return int(reference_cores / ref_threads_per_core)
+        return cores
 
     def analyse_drives(self):
-        # let's gather together the info
-        num_drives = dict()
-        for hostname in self.parentApp.selected_hosts:
-            num_drives[hostname] = len(self.parentApp.target_hosts.usable_hosts[hostname].drives)
-
-        reference_drives = 0
-        # errors = False
-        # change to whatever max drives per host (in case they are different)
-        for drives in num_drives.values():
-            if drives > reference_drives:
-                reference_drives = drives
-
-            # if reference_drives == 0:
-            #    reference_drives = drives
-            #    continue
-            # else:
-            #    if drives != reference_drives:
-            #        errors = True
-            #        break
-        # if errors:
-        # make noise
-        # wekatui.notify_confirm("The hosts are not homogenous; they have different numbers of drives.",
-        #                         title="Error", form_color='STANDOUT', wrap=True, editw=1)
-
-        return reference_drives
+        PA = self.parentApp
+        return host_drives(PA.target_hosts.host_table, PA.selected_hosts.keys())
 
 
 # the form for selecting what hosts will be in the cluster
@@ -431,12 +377,7 @@ class SelectHostsForm(CancelNextForm):
         #    PA.selected_hosts[PA.sorted_hosts[index]] = PA.target_hosts.usable_hosts[PA.sorted_hosts[index]]
 
         # find the amount of RAM we can use...  min of all hosts in the cluster
-        for host in PA.selected_hosts.values():
-            try:
-                if int(host.total_ramGB) < PA.min_host_ramGB:
-                    PA.min_host_ramGB = int(host.total_ramGB)
-            except AttributeError:  # haven't set self.min_host_ramGB yet...
-                PA.min_host_ramGB = int(host.total_ramGB)
+        PA.min_host_ramGB = PA.target_hosts.host_table.min("ram_gb", PA.selected_hosts.keys())
 
         #if 0 in self.options_field.values:
         #    PA.HighAvailability = True
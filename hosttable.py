@@ -0,0 +1,137 @@
+################################################################################################
+# Host table
+################################################################################################
+# The facts we compare hosts by (cores, RAM, drives, nics), in columns - one row per host - built once after
+# discovery.  Homogeneity checks and sizing (is_homogeneous, the cores/drives/RAM the forms need) are group-bys and
+# min/max over a column, rather than each walking every STEMHost and building its own groupings
+from array import array
+from collections import Counter
+from logging import getLogger
+
+from sortedcontainers import SortedDict
+
+log = getLogger(__name__)
+
+UNKNOWN = -1  # what None is stored as in a numeric column
+
+# numeric columns: {column: function to get it from a STEMHost}
+NUMERIC_COLUMNS = {
+    "num_cores": lambda host: host.num_cores,
+    "physical_cores": lambda host: host.physical_cores,
+    "threads_per_core": lambda host: host.threads_per_core,
+    "hyperthread": lambda host: host.hyperthread,
+    "ram_gb": lambda host: None if host.total_ramGB is None else int(host.total_ramGB),
+    "num_drives": lambda host: len(host.drives),
+    "num_nics": lambda host: len(host.nics),
+}
+BOOLEAN_COLUMNS = ("hyperthread",)
+
+# columns with several values per host (kept as a sorted tuple per row)
+MULTI_COLUMNS = {
+    "drive_sizes": lambda host: tuple(sorted({drive['sizeBytes'] for drive in host.drives.values()})),
+    "nic_names": lambda host: tuple(sorted(host.nics.keys())),
+}
+
+
+class HostTable(object):
+    def __init__(self, hosts):
+        """
+        :param hosts: dict of hostname:STEMHost objects (ie: WekaHostGroup.usable_hosts)
+        """
+        self.names = list(hosts.keys())
+        self.index = {hostname: row for row, hostname in enumerate(self.names)}
+        self.columns = dict()
+        for column, getter in NUMERIC_COLUMNS.items():
+            values = (getter(host) for host in hosts.values())
+            self.columns[column] = array('q', (UNKNOWN if value is None else int(value) for value in values))
+        for column, getter in MULTI_COLUMNS.items():
+            self.columns[column] = [getter(host) for host in hosts.values()]
+
+    def __len__(self):
+        return len(self.names)
+
+    def rows(self, hostnames=None):
+        """
+        :param hostnames: hosts to look at, or None for all of them
+        :return: their row numbers (hosts not in the table are ignored)
+        """
+        if hostnames is None:
+            return range(len(self.names))
+        return [self.index[hostname] for hostname in hostnames if hostname in self.index]
+
+    def _values(self, column, rows):
+        values = self.columns[column]
+        if isinstance(rows, range) and len(rows) == len(values):
+            return values
+        return [values[row] for row in rows]
+
+    def _decode(self, column, value):
+        if column in MULTI_COLUMNS:
+            return value
+        if value == UNKNOWN:
+            return None
+        return bool(value) if column in BOOLEAN_COLUMNS else value
+
+    def _known(self, column, hostnames):
+        values = self._values(column, self.rows(hostnames))
+        if UNKNOWN not in values:
+            return values
+        return [value for value in values if value != UNKNOWN]
+
+    def get(self, column, hostname):
+        return self._decode(column, self.columns[column][self.index[hostname]])
+
+    def group_by(self, column, hostnames=None):
+        """
+        :return: SortedDict of {value: [hostnames]}.  For a multi-valued column, a host is listed under each of
+                 its values
+        """
+        rows = self.rows(hostnames)
+        groups = dict()
+        if column in MULTI_COLUMNS:
+            values = self.columns[column]
+            for row in rows:
+                for value in values[row]:
+                    groups.setdefault(value, list()).append(self.names[row])
+            return SortedDict(groups)
+
+        for row, value in zip(rows, self._values(column, rows)):
+            groups.setdefault(value, list()).append(self.names[row])
+        decoded = SortedDict(lambda value: (value is not None, value))  # unknowns (None) first
+        for value, hosts in groups.items():
+            decoded[self._decode(column, value)] = hosts
+        return decoded
+
+    def distinct(self, column, hostnames=None):
+        """
+        :return: the number of different values of column
+        """
+        rows = self.rows(hostnames)
+        if column in MULTI_COLUMNS:
+            return len({value for row in rows for value in self.columns[column][row]})
+        return len(set(self._values(column, rows)))
+
+    def min(self, column, hostnames=None):
+        """
+        :return: the smallest known value of a numeric column, or None if there are none
+        """
+        known = self._known(column, hostnames)
+        return self._decode(column, min(known)) if len(known) > 0 else None
+
+    def max(self, column, hostnames=None):
+        """
+        :return: the largest known value of a numeric column, or None if there are none
+        """
+        known = self._known(column, hostnames)
+        return self._decode(column, max(known)) if len(known) > 0 else None
+
+    def outliers(self, column, hostnames=None):
+        """
+        :return: the hosts whose value of a numeric column isn't the most common one
+        """
+        rows = self.rows(hostnames)
+        values = self._values(column, rows)
+        if len(values) == 0:
+            return list()
+        most_common = Counter(values).most_common(1)[0][0]
+        return [self.names[row] for row, value in zip(rows, values) if value != most_common]
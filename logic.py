@@ -4,6 +4,8 @@
 import math
 from logging import getLogger
 
+from netindex import NetworkIndex
+
 log = getLogger(__name__)
 
 
@@ -146,47 +148,52 @@ class Cores:
             self.calculate()
 
 
-def filter_hosts(network_list, host_dict):
-    """Takes a list of selected IPv4Network objects and a dict of hostname:STEMHost objects
-    and returns two dicts: included and excluded hosts"""
-    host_sets = dict()
+def host_cores(host_table, hostnames):
+    """Takes a HostTable and the selected hostnames and returns the number of physical cores per host (from the
+    first host), and whether all the hosts have the same numbers of cores and threads"""
+    hostnames = list(hostnames)
+    if len(hostnames) == 0:
+        return 0, True
+    homogeneous = host_table.distinct("num_cores", hostnames) == 1 and \
+        host_table.distinct("threads_per_core", hostnames) == 1
+
+    # physical cores come from the cpu topology; older hosts may not report it, so fall back to dividing
+    first = hostnames[0]
+    if host_table.get("physical_cores", first) is not None:
+        return host_table.get("physical_cores", first), homogeneous
+    return int(host_table.get("num_cores", first) / host_table.get("threads_per_core", first)), homogeneous
+
 
+def host_drives(host_table, hostnames):
+    """Takes a HostTable and the selected hostnames and returns the most drives any of them has"""
+    # change to whatever max drives per host (in case they are different)
+    return host_table.max("num_drives", hostnames) or 0
+
+
+def filter_hosts(network_list, host_dict, mesh=None, index=None):
+    """Takes a list of selected IPv4Network objects and a dict of hostname:STEMHost objects
+    and returns two dicts: included and excluded hosts.  If a full-mesh ReachabilityMatrix is given,
+    hosts with broken links to the other included hosts on the selected networks are excluded too.
+    index is a NetworkIndex of the hosts (WekaHostGroup.network_index); one is built if it isn't given"""
     # No networks selected, so no hosts selected
     if len(network_list) == 0:
         return dict(), host_dict
 
-    # build a set of hosts for each dataplane network
-    for dp in network_list:
-        host_sets[dp] = set()
-        for host in host_dict.values():
-            for nic in host.nics.values():
-                if dp == nic.network:
-                    host_sets[dp].add(host)
-
-    # get the intersection of all the sets
-    set_intersection = None
-    for dp, host_set in host_sets.items():
-        if set_intersection is None:
-            set_intersection = host_set
-        else:
-            set_intersection &= host_set
+    if index is None:
+        index = NetworkIndex(host_dict)
 
-    full_set = set(host_dict.values())
-    excluded_hosts_list = full_set - set_intersection
-    included_hosts_list = list(set_intersection)
+    # the hosts on all of the dataplane networks
+    included_list = index.hostnames(index.on_all(network_list, host_dict.keys()))
 
-    included_hosts = dict()
-    excluded_hosts = dict()
+    if mesh is not None:
+        good, dropped = mesh.isolate(included_list, network_list)
+        for hostname, num_broken in dropped.items():
+            log.info(f"excluding {hostname} - {num_broken} broken links on the selected networks")
+        included_list = [hostname for hostname in included_list if hostname in good]
 
     # turn it back into a dict
-    for host in excluded_hosts_list:
-        excluded_hosts[str(host)] = host
-    for host in included_hosts_list:
-        included_hosts[str(host)] = host
-
-    excluded_hosts_list = list()  # make a list out of it
-    for host in excluded_hosts:
-        excluded_hosts_list.append(str(host))
+    included_hosts = {hostname: host_dict[hostname] for hostname in included_list}
+    excluded_hosts = {hostname: host for hostname, host in host_dict.items() if hostname not in included_hosts}
 
     return included_hosts, excluded_hosts
 
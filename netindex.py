@@ -0,0 +1,83 @@
+################################################################################################
+# Network membership index
+################################################################################################
+# Which hosts are on which networks, built once after discovery.  Hosts are numbered (in name order), and each
+# network has a bitset (a python int) of the hosts on it, so selecting dataplane networks - "on all of these"
+# (filter_hosts) or "reachable on any of these" (the Networks widget) - is an AND or OR of a few ints rather than
+# a walk over every host's nics
+from logging import getLogger
+
+log = getLogger(__name__)
+
+
+class NetworkIndex(object):
+    def __init__(self, hosts, reference_host=None, accessible_hosts=None):
+        """
+        :param hosts: dict of hostname:STEMHost objects (ie: WekaHostGroup.usable_hosts)
+        :param reference_host: the reference host STEMHost (with accessible_hosts, for reachable())
+        :param accessible_hosts: dict of {reference host ifname: set of hostnames reachable on it}
+        """
+        hostnames = set(hosts.keys())
+        for reachable in (accessible_hosts or dict()).values():
+            hostnames |= reachable
+        self.names = sorted(hostnames)
+        self.index = {hostname: bit for bit, hostname in enumerate(self.names)}
+
+        self.interfaces = dict()  # {hostname: {network: [ifnames]}}
+        on_network = dict()
+        for hostname, host in hosts.items():
+            by_network = self.interfaces[hostname] = dict()
+            for ifname, nic in host.nics.items():
+                by_network.setdefault(nic.network, list()).append(ifname)
+            for network in by_network.keys():
+                on_network.setdefault(network, list()).append(hostname)
+        # {network: bitset of the hosts with a nic on it}
+        self.members = {network: self.bits(hostnames) for network, hostnames in on_network.items()}
+
+        self.reachable_on = dict()  # {network: bitset of the hosts the reference host can reach on it}
+        if reference_host is not None and accessible_hosts is not None:
+            for ifname, nic in reference_host.nics.items():
+                self.reachable_on[nic.network] = self.reachable_on.get(nic.network, 0) | \
+                                                 self.bits(accessible_hosts.get(ifname, ()))
+
+    def __len__(self):
+        return len(self.names)
+
+    def bits(self, hostnames):
+        """
+        :return: bitset of hostnames (hosts not in the index are ignored)
+        """
+        # set the bits in a bytearray; ORing them into an int one at a time is quadratic
+        flags = bytearray(len(self.names) // 8 + 1)
+        for hostname in hostnames:
+            bit = self.index.get(hostname)
+            if bit is not None:
+                flags[bit >> 3] |= 1 << (bit & 7)
+        return int.from_bytes(flags, "little")
+
+    def hostnames(self, bits):
+        """
+        :return: list of the hostnames in bits, in name order
+        """
+        return [self.names[bit] for bit, digit in enumerate(reversed(bin(bits)[2:])) if digit == "1"]
+
+    def on_all(self, networks, within=None):
+        """
+        :param networks: list of IPv4Network objects
+        :param within: only consider these hostnames (None for all)
+        :return: bitset of the hosts with a nic on every one of networks
+        """
+        bits = (1 << len(self.names)) - 1 if within is None else self.bits(within)
+        for network in networks:
+            bits &= self.members.get(network, 0)
+        return bits
+
+    def reachable(self, networks):
+        """
+        :param networks: list of IPv4Network objects
+        :return: bitset of the hosts the reference host can reach on any of networks
+        """
+        bits = 0
+        for network in networks:
+            bits |= self.reachable_on.get(network, 0)
+        return bits
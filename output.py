@@ -1,148 +1,94 @@
 ################################################################################################
 # Output Utility routines
 ################################################################################################
-import math
+from collections import namedtuple
 from logging import getLogger
 
+from plan import build_plan
+
 log = getLogger(__name__)
 
+DEFAULT_MAX_JOBS = 32  # how many hosts' steps config.sh runs at once (it can be changed with --jobs)
+LIST_CONTAINERS = "sudo weka cluster container -o id,hostname,container --no-header"
+ADD_DRIVES = "sudo weka cluster drive add"  # <container id> <device paths>
+
+# one step of the deployment - config.sh renders it as shell, deploy.py runs it in-process
+#   action: "run" (run command), "copy" (copy the file named command to target on host), "drives" (command prints
+#           the paths of drives container target's drives), or "add_drives" (add every drives container's drives)
+#   host: the HostPlan it's done on, or None for the node config.sh runs on (deploy.py uses the reference host)
+#   description: echoed before the step
+#   retry: if it's safe to do again after it fails - copies, listings and settings are.  Creating the cluster, a
+#          container or adding drives isn't: if a try that timed out actually worked, the next one fails with
+#          "already exists"
+Step = namedtuple("Step", ["action", "host", "command", "target", "description", "retry"],
+                  defaults=(None, None, False))
+# a phase of the deployment - each host's chain of steps (chains is {HostPlan: [Steps]}, the hosts run at the same
+# time), or steps that run one after another on one node
+Phase = namedtuple("Phase", ["name", "chains", "steps"])
+
 SCRIPT_PREAMBLE = """#!/bin/bash
 
 usage() {
-	echo "Usage: $0 [--no-parallel]"
+	echo "Usage: $0 [--no-parallel] [--jobs N]"
 	echo "  Use --no-parallel to prevent parallel execution"
+	echo "  Use --jobs N to run the steps of at most N hosts at once (default @MAX_JOBS@)"
 	exit 1
 }
 
-para() {
-	TF=$1; shift
-	echo $*
-	$* &
-	[ $TF == "FALSE" ] && { echo para waiting; wait; }
-}
+MAX_JOBS=@MAX_JOBS@
 
-PARA="TRUE"
+# run a command in the background, once there are fewer than MAX_JOBS running
+run_limited() {
+	while [ $(jobs -rp | wc -l) -ge $MAX_JOBS ]; do
+		wait -n
+	done
+	"$@" &
+}
 
 # parse args
-if [ $# != 0 ]; then
-	if [ $# != 1 ]; then
-		usage
-	elif [ $1 == "--no-parallel" ]; then
-		PARA="FALSE"
-	else
-		echo "Error: unknown command line switch - $1"
-		usage
-	fi
-fi
-
-echo starting - PARA is $PARA
+while [ $# != 0 ]; do
+	case $1 in
+		--no-parallel)
+			MAX_JOBS=1 ;;
+		--jobs)
+			shift
+			[[ "$1" =~ ^[1-9][0-9]*$ ]] || usage
+			MAX_JOBS=$1 ;;
+		*)
+			echo "Error: unknown command line switch - $1"
+			usage ;;
+	esac
+	shift
+done
+
+echo starting - MAX_JOBS is $MAX_JOBS
 
 # ------------------ custom script below --------------
 """
-PARA = 'para ${PARA} '
 
 class WekaCluster(object):
-    def __init__(self, config):
+    def __init__(self, config, max_jobs=DEFAULT_MAX_JOBS):
+        """
+        :param max_jobs: the default for how many hosts config.sh works on at once
+        """
         self.config = config
-        # figure out everything here, and just have output routines?
-        # OR have each output routine figure out what it needs?
+        self.max_jobs = max_jobs
+        self.plan = build_plan(config)  # figure out everything here; the output routines just render it
 
     def _create(self):
-        output = 'create '
-        host_names, host_ips = self._host_names()
+        host_names = [host.name for host in self.plan.hosts]
+        host_ips = ['+'.join(host.management_ips) for host in self.plan.hosts]
         result = 'create ' + ' '.join(host_names) + ' --host-ips=' + ','.join(host_ips) + " -T infinite"
         return result
 
-    def _host_names(self):  # sets what the hostids will/should be
-        host_names = list()
-        host_ips = list()
-        hostid = 0
-        for hostname, host in sorted(self.config.selected_hosts.items()):
-            host_names.append(hostname)
-            host.host_id = hostid
-            hostid += 1
-
-            # make an uber list of pingable ips
-            all_pingable_ips = set()
-            for iface in self.config.target_hosts.pingable_ips.values():
-                all_pingable_ips.update(iface)
-
-            host.this_hosts_ifs = set()
-            count = 0
-            # select the interfaces that are on the selected networks
-            for name, iface in host.nics.items():
-                if iface.network in self.config.selected_dps:
-                    if iface in all_pingable_ips:  # list of ips accessible
-                        host.this_hosts_ifs.add(iface)
-
-
-            temp = str()
-            for nic in host.this_hosts_ifs:
-                if count > 0:
-                    if self.config.HighAvailability:
-                        temp += '+'
-                    else:
-                        continue  # not HA, but has more than one NIC on the same network
-                temp += nic.ip.exploded
-                count += 1
-            # temp += ','
-            host_ips.append(temp)
-            temp = str()
-        return host_names, host_ips
-
-
-    def _join_ips(self):  # sets what the hostids will/should be
-        # make a dict of hostname:[ips]
-        host_ips_dict = dict()
-        host_names = list()
-        host_ips = str()
-        hostid = 0
-        for hostname, host in sorted(self.config.selected_hosts.items()):
-            host_ips_dict[hostname] = list()
-
-            for nic in host.this_hosts_ifs:
-                host_ips_dict[hostname].append(nic.ip.exploded)
-
-        # make a string
-        num_hosts = len(self.config.selected_hosts.keys())
-        if num_hosts > 7:
-            num_hosts = 7
-        elif num_hosts % 2 != 1: # if even number...
-            num_hosts -= 1   # make it an odd number
-
-        if num_hosts <= 3:
-            log.error(f"Too few hosts?  num_hosts = {num_hosts}")
-
-        # pick out the first "num_hosts" ip addresses (ips could be 2-4x the number of hosts)
-        full_list = list(sorted(host_ips_dict.keys()))
-        join_ip_list = list()
-        for host in full_list[:num_hosts]:
-            join_ip_list += host_ips_dict[host]
-        return ','.join(join_ip_list)
-
-
-    # returns a list of strings
-    def _get_nics(self, hostname):  # for MCB... need a list of nics for a host
-        # base = 'host net add '
-        # host_id = 0
-        result = list()
-        host = self.config.selected_hosts[hostname]
-
-        for nic in sorted(list(host.this_hosts_ifs)):
-            if nic.gateway is not None:
-                fullname = f"{nic.name}/{nic.ip.exploded}/{nic.network.prefixlen}/{nic.gateway}"
-            else:
-                fullname = f"{nic.name}/{nic.ip.exploded}/{nic.network.prefixlen}"
-            result.append(fullname)
-
-        return result
+    def _join_ips(self):
+        return ','.join(self.plan.join_ips)
 
     def _net_add(self):
         base = 'host net add '
-        # host_id = 0
         result = list()
-        for hostname, host in sorted(self.config.selected_hosts.items()):
-            for nic in sorted(list(host.this_hosts_ifs)):
+        for host in self.plan.hosts:
+            for nic in host.interfaces:
                 if nic.gateway is not None:
                     gateway = f"--gateway={nic.gateway}"
                 else:
@@ -152,87 +98,75 @@ class WekaCluster(object):
 
         return result
 
-    """
     def _drive_add(self):
         base = 'drive add '
-        # host_id = 0
         result = list()
-        for hostname, host in sorted(self.config.selected_hosts.items()):
+        for host in self.plan.hosts:
             thishost = base + str(host.host_id) + ' '
-            for drivename, drive in sorted(host.drives.items()):
-                thishost += drive['devPath'] + ' '
+            for drive in host.drives:
+                thishost += drive + ' '
             # thishost += '--force'  # don't force it - can overwrite boot drives!
-            thishost += f'    # {hostname}'
+            thishost += f'    # {host.name}'
             result.append(thishost)
-            # host_id += 1
         return result
-    """
 
     def _host_cores(self):
         base = 'host cores '
-        # host_id = 0
         result = list()
-        for hostname, host in sorted(self.config.selected_hosts.items()):
-            cores = self.config.selected_cores
-            thishost = base + str(host.host_id) + ' ' + str(cores.fe + cores.drives + cores.compute) + ' --frontend-dedicated-cores ' + \
-                       str(cores.fe) + ' --drives-dedicated-cores ' + str(cores.drives)
-            # host_id += 1
+        plan = self.plan
+        for host in plan.hosts:
+            thishost = base + str(host.host_id) + ' ' + str(plan.fe_cores + plan.drives_cores + plan.compute_cores) + \
+                       ' --frontend-dedicated-cores ' + str(plan.fe_cores) + \
+                       ' --drives-dedicated-cores ' + str(plan.drives_cores)
             result.append(thishost)
         return result
 
     def _memory_alloc(self):
         base = 'host memory'
         result = list()
-        for hostname, host in sorted(self.config.selected_hosts.items()):
-            thishost = f'{base} {host.host_id} {self.config.memory}GB'
+        for host in self.plan.hosts:
+            thishost = f'{base} {host.host_id} {self.plan.memory}GB'
             result.append(thishost)
         return result
 
     def _dedicate(self):
-        if not self.config.dedicated:
+        if not self.plan.dedicated:
             return self._memory_alloc()
         base = 'host dedicate '
-        # host_id = 0
         result = list()
-        for hostname, host in sorted(self.config.selected_hosts.items()):
+        for host in self.plan.hosts:
             thishost = base + str(host.host_id) + ' on'
             result.append(thishost)
         return result
 
     def _parity(self):
         base = 'update '
-        # data_drives = len(self.config.selected_hosts) - 2
-        if self.config.datadrives > 16:
-            log.error(f"ERROR: datadrives is {self.config.datadrives}?")
-            self.config.datadrives = 16
-        result = base + f"--data-drives={self.config.datadrives}" + f" --parity-drives={self.config.paritydrives}"
+        result = base + f"--data-drives={self.plan.data_drives}" + f" --parity-drives={self.plan.parity_drives}"
         return result
 
     def _failure_domain(self):
-        if self.config.auto_failure_domain:
+        if self.plan.auto_failure_domain:
             base = 'host failure-domain '
-            # host_id = 0
             result = list()
-            for hostname, host in sorted(self.config.selected_hosts.items()):
-                thishost = base + str(host.host_id) + ' --name ' + hostname
+            for host in self.plan.hosts:
+                thishost = base + str(host.host_id) + ' --name ' + host.name
                 result.append(thishost)
-                # host_id += 1
             return result
         else:
             return []
 
     def _hot_spare(self):
-        return f"hot-spare {self.config.hot_spares}"
+        return f"hot-spare {self.plan.hot_spares}"
 
     def _cloud(self):
-        if self.config.cloud_enable:
+        if self.plan.cloud_enable:
             return "cloud enable"
         else:
             return None
 
     def _name(self):
-        if len(self.config.clustername) > 0:
-            return f"update --cluster-name={self.config.clustername}"
+        if len(self.plan.cluster_name) > 0:
+            return f"update --cluster-name={self.plan.cluster_name}"
         else:
             return None
 
@@ -244,210 +178,213 @@ class WekaCluster(object):
 
 
     def cluster_config(self, file):
-        if self.config.Multicontainer:
+        if self.plan.multicontainer:
             self.cluster_config_mcb(file)
         else:
             self.cluster_config_scb(file)
 
-    def cluster_config_mcb(self, file):
+    def phases(self):
+        """
+        :return: list of Phases - everything config.sh does, in order.  deploy.py runs the same list
+        """
+        if self.plan.multicontainer:
+            return self._mcb_phases()
+        return self._scb_phases()
+
+    def _mcb_phases(self):
+        """
+        Each host works through its own chain of steps (prepare, then its containers, then its frontend), so a slow
+        host only holds itself up.  The only points where every host waits for the others are the cluster-wide
+        steps: creating the cluster, adding drives, and the cluster settings.
+
+        Drives are added without a lookup per container: the drive paths are read while each host is prepared,
+        and the container ids come from one listing of the cluster's containers
+        """
         WEKA_CLUSTER = "sudo weka cluster "
         WEKA = "sudo weka "
-        NL = "\n"
-        host_names, host_ips = self._host_names()
-        create_command = WEKA_CLUSTER + 'create ' + ' '.join(host_names) + ' --host-ips=' + ','.join(host_ips) \
-                         + " -T infinite" + NL
-        if self.config.weka_ver[0] == '4' and int(self.config.weka_ver[1]) >= 1:
-            CONTAINER = 'container'
-        else:
-            CONTAINER = 'host'
+        plan = self.plan
+        WLSC = 'weka local setup ' + plan.container_type
+
+        # format the --join-ips list of ip addrs
+        host_ips_string = self._join_ips()
+
+        phases = list()
+        # each host: copy resources_generator.py, stop weka, generate its resources, start its drives0 container
+        # (so we can form a cluster)
+        phases.append(Phase("prepare", {host: self._prepare_steps(host) for host in plan.hosts}, []))
+
+        phases.append(Phase("create", dict(), [Step("run", None, WEKA_CLUSTER + self._create())]))
+
+        # each host: start its additional drives containers, if needed, and its compute containers
+        containers = [f"drives{container}" for container in range(1, plan.containers["drives"])] + \
+                     [f"compute{container}" for container in range(0, plan.containers["compute"])]
+        phases.append(Phase("containers", {
+            host: [Step("run", host, self._setup_container(host, WLSC, container, host_ips_string),
+                        description=f"Starting {container} container on host {host.name}")
+                   for container in containers]
+            for host in plan.hosts}, []))
+
+        # add drives - one listing of the cluster's containers for their ids, and each drives container's drives
+        # from the lists read back from the resources files as the hosts were prepared
+        phases.append(Phase("drives", dict(), [Step("add_drives", None, None)]))
+
+        settings = [Step("run", None, WEKA_CLUSTER + self._parity(), retry=True),
+                    Step("run", None, WEKA_CLUSTER + self._hot_spare(), retry=True)]
+        cloud = self._cloud()
+        if cloud is not None:
+            settings.append(Step("run", None, WEKA + cloud, retry=True))
+        name = self._name()
+        if name is not None:
+            settings.append(Step("run", None, WEKA_CLUSTER + name, retry=True))
+        phases.append(Phase("settings", dict(), settings))
+
+        # start FEs
+        phases.append(Phase("frontend", {
+            host: [Step("run", host, self._setup_container(host, WLSC, "frontend0", host_ips_string),
+                        description=f"Starting Front container on host {host.name}")]
+            for host in plan.hosts}, []))
+        return phases
 
+    def cluster_config_mcb(self, file):
+        """
+        Each phase's host chains run up to max_jobs hosts at a time (see _mcb_phases)
+        """
+        NL = "\n"
         with file as fp:
-            fp.write(SCRIPT_PREAMBLE + NL)
-
-            for host in host_names:
-                fp.write(f"echo Stopping weka on {host}" + NL)
-                if self.config.target_hosts.candidates[host].is_local:
-                    fp.write(PARA + 'cp ./resources_generator.py /tmp/' + NL)
-                    fp.write('sudo weka local stop' + NL)
-                    fp.write(PARA + 'sudo weka local rm -f default' + NL)
-                else:
-                    fp.write(PARA + f'scp -p ./resources_generator.py {host}:/tmp/' + NL)
-                    fp.write(PARA + f'ssh {host} "sudo weka local stop; sudo weka local rm -f default"' + NL)
-
-            fp.write(NL + 'wait' + NL)
-            for host in host_names:
-                fp.write(f"echo Running Resources generator on host {host}" + NL)
-                if self.config.target_hosts.candidates[host].is_local:
-                    fp.write(PARA + 'sudo /tmp/resources_generator.py -f --path /tmp --use-only-nic-identifier --net')
-                else:
-                    fp.write(PARA + f'ssh {host} sudo /tmp/resources_generator.py -f --path /tmp --use-only-nic-identifier --net')
-                net_names = self._get_nics(host)
-                for name in net_names:
-                    fp.write(f" {name}")
-
-                cores = self.config.selected_cores
-
-                fp.write(f' --compute-dedicated-cores {cores.compute}')
-                fp.write(f' --drive-dedicated-cores {cores.drives}')
-                fp.write(f' --frontend-dedicated-cores {cores.fe}')
-
-                if self.config.protocols_memory is not None:
-                    fp.write(f' --protocols-memory {self.config.protocols_memory}GiB')
-                fp.write(NL)
+            fp.write(SCRIPT_PREAMBLE.replace("@MAX_JOBS@", str(self.max_jobs)) + NL)
 
-            fp.write('wait' + NL)
-
-            # start DRIVES0 container so we can form a cluster
-            for host in host_names:
-                fp.write(f"echo Starting Drives container on server {host}" + NL)
-                if self.config.target_hosts.candidates[host].is_local:
-                    fp.write(PARA + f'sudo weka local setup {CONTAINER}' +
-                             f' --name drives0 --resources-path /tmp/drives0.json' + NL)
-                else:
-                    fp.write(PARA + f'ssh {host} "sudo weka local setup {CONTAINER}' +
-                             f' --name drives0 --resources-path /tmp/drives0.json"' + NL)
-
-            # wait for parallel commands to finish
-            fp.write(NL + 'wait' + NL)
-
-            # create cluster
-            fp.write(NL)
-            fp.write(create_command)
-
-            # format the --join-ips list of ip addrs
-            host_ips_string = self._join_ips()
-
-            # changing versions
-            WLS = 'weka local setup '
-            if self.config.weka_ver[0] == '4' and int(self.config.weka_ver[1]) >= 1:
-                WLSC = WLS + 'container'
-            else:
-                WLSC = WLS + 'host'
-
-            # create additional drives containers, if needed
-            for container in range(1, math.ceil(self.config.selected_cores.drives / 19)):
-                hostid = 0
-                for host in host_names:  # not sure
-                    fp.write(f"echo Starting drives container {container} on host {host}" + NL)
-                    if self.config.target_hosts.candidates[host].is_local:
-                        fp.write(PARA + 'sudo ' + WLSC +
-                                 f' --name drives{container}' +
-                                 f' --resources-path /tmp/drives{container}.json' +
-                                 f' --join-ips={host_ips_string}' +
-                                 f' --management-ips={host_ips[hostid].replace("+", ",")}' + NL)
-                    else:
-                        fp.write(PARA + f'ssh {host} sudo ' + WLSC +
-                             f' --name drives{container}' +
-                             f' --resources-path /tmp/drives{container}.json' +
-                             f' --join-ips={host_ips_string}' +
-                             f' --management-ips={host_ips[hostid].replace("+", ",")}' + NL)
-                    hostid += 1
-
-                # wait for parallel commands to finish
-                fp.write('wait' + NL)
-
-            # create compute containers
-            for container in range(0, math.ceil(self.config.selected_cores.compute / 19)):
-                hostid = 0
-                for host in host_names:  # not sure
-                    fp.write(f"echo Starting Compute container {container} on host {host}" + NL)
-                    if self.config.target_hosts.candidates[host].is_local:
-                        fp.write(PARA + 'sudo ' + WLSC +
-                                 f' --name compute{container}' +
-                                 f' --resources-path /tmp/compute{container}.json' +
-                                 f' --join-ips={host_ips_string}' +
-                                 f' --management-ips={host_ips[hostid].replace("+", ",")}' + NL)
-                    else:
-                        fp.write(PARA + f'ssh {host} sudo ' + WLSC +
-                             f' --name compute{container}' +
-                             f' --resources-path /tmp/compute{container}.json' +
-                             f' --join-ips={host_ips_string}' +
-                             f' --management-ips={host_ips[hostid].replace("+", ",")}' + NL)
-                    hostid += 1
-
-            # wait for parallel commands to finish
-            fp.write('wait' + NL)
-
-            # add drives
-            #fp.write(NL)
-            #for item in self._drive_add():
-            #    fp.write(PARA + WEKA_CLUSTER + item + NL)
-            fp.write(NL)
-            fp.write("for HOSTNAME in ")
-            #hosts=sorted(self.config.selected_hosts.keys())
-            #hosts2=' '.join(hosts)
-            fp.write(f'{" ".join(sorted(self.config.selected_hosts.keys()))}; do' + NL)
-            fp.write("  for CONTAINER in drives{0..")
-            fp.write(f"{math.ceil(self.config.selected_cores.drives / 19)-1}")
-            fp.write("}; do" + NL)
-            fp.write("    CONTAINER_ID=$(weka cluster container -F container=$CONTAINER,hostname=$HOSTNAME -o id --no-header)" + NL)
-            fp.write('    if [ "$CONTAINER_ID" != "" ]; then' + NL)
-            fp.write("      DRIVES=$(ssh $HOSTNAME jq '.drives[].path' /tmp/$CONTAINER.json | tr -d '\"')" + NL)
-            fp.write("      para ${PARA} sudo weka cluster drive add $CONTAINER_ID $DRIVES" + NL)
-            fp.write("    fi" + NL)
-            fp.write("  done" + NL)
-            fp.write("done" + NL)
-
-            # wait for parallel commands to finish
-            fp.write(NL + 'wait' + NL)
-
-            fp.write(WEKA_CLUSTER + self._parity() + NL)
-            fp.write(WEKA_CLUSTER + self._hot_spare() + NL)
-            cloud = self._cloud()
-            if cloud is not None:
-                fp.write(WEKA + cloud + NL)
-            name = self._name()
-            if name is not None:
-                fp.write(WEKA_CLUSTER + name + NL)
-
-            # start FEs
-            fp.write(NL)
-            hostid = 0
-            for host in host_names:  # not sure
-                fp.write(f"echo Starting Front container on host {host}" + NL)
-                if self.config.target_hosts.candidates[host].is_local:
-                    fp.write(PARA + 'sudo ' + WLSC + ' --name frontend0 --resources-path /tmp/frontend0.json ' +
-                             f'--join-ips={host_ips_string} --management-ips={host_ips[hostid].replace("+", ",")}' + NL)
-                else:
-                    fp.write(PARA +
-                         f'ssh {host} sudo ' + WLSC + ' --name frontend0 --resources-path /tmp/frontend0.json ' +
-                         f'--join-ips={host_ips_string} --management-ips={host_ips[hostid].replace("+", ",")}' + NL)
-                hostid += 1
+            # where each host's drives go, by drives container (filled in as the hosts are prepared)
+            fp.write('DRIVE_LISTS=$(mktemp -d /tmp/wekaconfig.XXXXXX)' + NL)
 
-            # wait for parallel commands to finish
-            fp.write(NL + 'wait' + NL)
+            for phase in self.phases():
+                self._write_chains(fp, phase.name, phase.chains)
+                if len(phase.steps) > 0:
+                    fp.write(NL)
+                for step in phase.steps:
+                    for line in self._render(step):
+                        fp.write(line + NL)
 
+            fp.write('rm -rf "$DRIVE_LISTS"' + NL)
             fp.write(f"echo Configuration process complete" + NL)
-        pass
 
-    def cluster_config_scb(self, file):
+    def _write_chains(self, fp, phase, steps):
+        """
+        write a shell function for each host that runs its steps in order, then run them (no more than MAX_JOBS
+        at once) and wait for all of them
+
+        :param phase: name of this phase (the functions are <phase>_<host id>)
+        :param steps: dict of {HostPlan: [Steps]}; hosts with no steps are left out
+        """
+        NL = "\n"
+        chains = [(host, host_steps) for host, host_steps in steps.items() if len(host_steps) > 0]
+        if len(chains) == 0:
+            return
+        fp.write(NL)
+        for host, host_steps in chains:
+            fp.write(f"{phase}_{host.host_id}() {{    # {host.name}" + NL)
+            for step in host_steps:
+                for line in self._render(step):
+                    fp.write("\t" + line + NL)
+            fp.write("}" + NL)
+        fp.write(NL)
+        for host, host_steps in chains:
+            fp.write(f"run_limited {phase}_{host.host_id}" + NL)
+        # wait for all the hosts to finish
+        fp.write('wait' + NL)
+
+    def _render(self, step):
+        """
+        :return: list of the shell lines that do step
+        """
+        lines = list() if step.description is None else [f"echo {step.description}"]
+        remote = step.host is not None and not step.host.is_local
+        if step.action == "copy":
+            lines.append(f"scp -p ./{step.command} {step.host.name}:{step.target}" if remote else
+                         f"cp ./{step.command} {step.target}")
+        elif step.action == "add_drives":
+            lines += [LIST_CONTAINERS + ' > "$DRIVE_LISTS/containers"',
+                      "while read CONTAINER_ID HOSTNAME CONTAINER; do",
+                      '\tif [[ "$CONTAINER" == drives* && -s "$DRIVE_LISTS/$HOSTNAME.$CONTAINER" ]]; then',
+                      '\t\trun_limited ' + ADD_DRIVES + ' $CONTAINER_ID $(cat "$DRIVE_LISTS/$HOSTNAME.$CONTAINER")',
+                      "\tfi",
+                      'done < "$DRIVE_LISTS/containers"',
+                      "wait"]  # for the drive adds
+        else:
+            command = f'ssh {step.host.name} "{step.command}"' if remote else step.command
+            if step.action == "drives":
+                command += f' > "$DRIVE_LISTS/{step.host.name}.{step.target}"'
+            lines.append(command)
+        return lines
+
+    def _prepare_steps(self, host):
+        """
+        :return: the Steps to get host ready to form a cluster
+        """
+        plan = self.plan
+        steps = [Step("copy", host, "resources_generator.py", "/tmp/", description=f"Stopping weka on {host.name}",
+                      retry=True),
+                 Step("run", host, "sudo weka local stop; sudo weka local rm -f default", retry=True)]
+
+        generate = 'sudo /tmp/resources_generator.py -f --path /tmp --use-only-nic-identifier --net'
+        for name in host.nic_specs:
+            generate += f" {name}"
+        generate += f' --compute-dedicated-cores {plan.compute_cores}'
+        generate += f' --drive-dedicated-cores {plan.drives_cores}'
+        generate += f' --frontend-dedicated-cores {plan.fe_cores}'
+        if plan.protocols_memory is not None:
+            generate += f' --protocols-memory {plan.protocols_memory}GiB'
+        steps.append(Step("run", host, generate, description=f"Running Resources generator on host {host.name}",
+                          retry=True))  # -f: it overwrites what a failed try left
+
+        # note which drives resources_generator.py put in each drives container, for adding them later
+        for container in range(plan.containers["drives"]):
+            steps.append(Step("drives", host, f"jq -r '.drives[].path' /tmp/drives{container}.json",
+                              f"drives{container}", retry=True))
+
+        steps.append(Step("run", host, f'sudo weka local setup {plan.container_type}' +
+                          f' --name drives0 --resources-path /tmp/drives0.json',
+                          description=f"Starting Drives container on server {host.name}"))
+        return steps
+
+    def _setup_container(self, host, setup_command, container, join_ips):
+        """
+        :return: the command to set up one of host's containers (after the cluster is created) and join it
+        """
+        return 'sudo ' + setup_command + f' --name {container} --resources-path /tmp/{container}.json' + \
+               f' --join-ips={join_ips} --management-ips={",".join(host.management_ips)}'
+
+    def _scb_phases(self):
+        """
+        single-container releases: the whole configuration is a list of cluster commands, run on one node
+        """
         WEKA_CLUSTER = "weka cluster "
         WEKA = "weka "
+        commands = [WEKA_CLUSTER + self._create()]
+        commands += [WEKA_CLUSTER + item for item in self._net_add()]
+        commands += [WEKA_CLUSTER + item for item in self._drive_add()]
+        commands += [WEKA_CLUSTER + item for item in self._host_cores()]
+        commands += [WEKA_CLUSTER + item for item in self._dedicate()]
+        commands.append(WEKA_CLUSTER + self._parity())
+        commands += [WEKA_CLUSTER + item for item in self._failure_domain()]
+        commands.append(WEKA_CLUSTER + self._hot_spare())
+        cloud = self._cloud()
+        if cloud is not None:
+            commands.append(WEKA + cloud)
+        name = self._name()
+        if name is not None:
+            commands.append(WEKA_CLUSTER + name)
+        commands.append(WEKA_CLUSTER + self._apply())
+        # commands.append("sleep 60")
+        # commands.append(WEKA_CLUSTER + self._start_io())  # won't start without license in 3.14+
+        return [Phase("configure", dict(), [Step("run", None, command) for command in commands])]
+
+    def cluster_config_scb(self, file):
         NL = "\n"
         with file as fp:
-            fp.write(WEKA_CLUSTER + self._create() + NL)
-            for item in self._net_add():
-                fp.write(WEKA_CLUSTER + item + NL)
-            for item in self._drive_add():
-                fp.write(WEKA_CLUSTER + item + NL)
-            for item in self._host_cores():
-                fp.write(WEKA_CLUSTER + item + NL)
-            for item in self._dedicate():
-                fp.write(WEKA_CLUSTER + item + NL)
-            fp.write(WEKA_CLUSTER + self._parity() + NL)
-            for item in self._failure_domain():
-                fp.write(WEKA_CLUSTER + item + NL)
-            fp.write(WEKA_CLUSTER + self._hot_spare() + NL)
-            cloud = self._cloud()
-            if cloud is not None:
-                fp.write(WEKA + cloud + NL)
-            name = self._name()
-            if name is not None:
-                fp.write(WEKA_CLUSTER + name + NL)
-            fp.write(WEKA_CLUSTER + self._apply() + NL)
-            return "host apply --all --force"
-            # fp.write("sleep 60\n")
-            # fp.write(WEKA_CLUSTER + self._start_io() + NL) # won't start without license in 3.14+
+            for phase in self.phases():
+                for step in phase.steps:
+                    for line in self._render(step):
+                        fp.write(line + NL)
 
     def dump(self, file):
         pass
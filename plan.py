@@ -0,0 +1,119 @@
+################################################################################################
+# Cluster plan
+################################################################################################
+# Everything config.sh is generated from - host ids, each host's dataplane interfaces, the join and management
+# ips, how many containers of each role, the drives - worked out once from the app state (WekaConfigApp or
+# HeadlessConfig).  The WekaCluster emitters only render it, so generating the script is linear in the number
+# of hosts.  Plans are immutable; build a new one if the choices change
+import math
+from collections import namedtuple
+from logging import getLogger
+from types import MappingProxyType
+
+log = getLogger(__name__)
+
+MAX_CORES_PER_CONTAINER = 19  # cores of one role in one container
+MAX_JOIN_HOSTS = 7  # hosts whose ips go in --join-ips
+
+# one host in the cluster
+#   interfaces: its WekaInterfaces on the selected dataplane networks, sorted
+#   management_ips: ip addrs (str) for --host-ips/--management-ips - all of them with HA, otherwise the first
+#   nic_specs: name/ip/prefixlen[/gateway] for each interface, for resources_generator.py --net
+#   drives: device paths of its data drives, by drive name
+HostPlan = namedtuple("HostPlan", ["name", "host_id", "is_local", "interfaces", "management_ips", "nic_specs",
+                                   "drives"])
+
+# the whole cluster
+#   hosts: HostPlans, by hostname (host ids are in this order); by_name is {hostname: HostPlan}
+#   containers: {role: number of containers of that role on each host}, in the order they're started
+#   container_type: what "weka local setup" calls a container in this release ("container" or "host")
+ClusterPlan = namedtuple("ClusterPlan", [
+    "hosts", "by_name", "join_ips", "containers", "container_type", "multicontainer",
+    "fe_cores", "drives_cores", "compute_cores", "protocols_memory", "memory", "dedicated",
+    "data_drives", "parity_drives", "hot_spares", "auto_failure_domain", "cloud_enable", "cluster_name"])
+
+
+def containers_for(cores):
+    """
+    :param cores: number of cores of one role
+    :return: how many containers it takes to hold them
+    """
+    return math.ceil(cores / MAX_CORES_PER_CONTAINER)
+
+
+def build_plan(config):
+    """
+    :param config: WekaConfigApp or HeadlessConfig (selected_hosts, selected_dps, selected_cores, etc)
+    :return: ClusterPlan.  Also sets host_id and this_hosts_ifs on the selected STEMHosts
+    """
+    # every ip the reference host could ping, once - not once per host
+    all_pingable_ips = set()
+    for ips in config.target_hosts.pingable_ips.values():
+        all_pingable_ips.update(ips)
+    selected_dps = set(config.selected_dps)
+
+    hosts = list()
+    all_ips = dict()  # {hostname: [ip addrs]} - every dataplane ip, for --join-ips
+    for host_id, (hostname, host) in enumerate(sorted(config.selected_hosts.items())):
+        # select the interfaces that are on the selected networks (and pingable)
+        host.host_id = host_id
+        host.this_hosts_ifs = set(iface for iface in host.nics.values()
+                                  if iface.network in selected_dps and iface in all_pingable_ips)
+
+        interfaces = tuple(sorted(host.this_hosts_ifs))
+        ips = [nic.ip.exploded for nic in interfaces]  # in interface order, so the first is the same every run
+        all_ips[hostname] = ips
+        nic_specs = list()
+        for nic in interfaces:
+            nic_spec = f"{nic.name}/{nic.ip.exploded}/{nic.network.prefixlen}"
+            nic_specs.append(nic_spec if nic.gateway is None else f"{nic_spec}/{nic.gateway}")
+
+        hosts.append(HostPlan(
+            name=hostname,
+            host_id=host_id,
+            is_local=bool(config.target_hosts.candidates[hostname].is_local),
+            interfaces=interfaces,
+            management_ips=tuple(ips if config.HighAvailability else ips[:1]),  # only HA uses more than one nic
+            nic_specs=tuple(nic_specs),
+            drives=tuple(drive['devPath'] for drivename, drive in sorted(host.drives.items()))))
+
+    # the first few hosts (an odd number, up to MAX_JOIN_HOSTS) are the ones new containers join through
+    num_hosts = len(hosts)
+    if num_hosts > MAX_JOIN_HOSTS:
+        num_hosts = MAX_JOIN_HOSTS
+    elif num_hosts % 2 != 1:  # if even number...
+        num_hosts -= 1  # make it an odd number
+    if num_hosts <= 3:
+        log.error(f"Too few hosts?  num_hosts = {num_hosts}")
+    join_ips = tuple(ip for host in hosts[:num_hosts] for ip in all_ips[host.name])
+
+    cores = config.selected_cores
+    containers = {"drives": containers_for(cores.drives), "compute": containers_for(cores.compute), "frontend": 1}
+
+    weka_ver = config.weka_ver
+    container_type = 'container' if weka_ver[0] == '4' and int(weka_ver[1]) >= 1 else 'host'
+
+    data_drives = config.datadrives
+    if data_drives > 16:
+        log.error(f"ERROR: datadrives is {data_drives}?")
+        data_drives = 16
+
+    return ClusterPlan(
+        hosts=tuple(hosts),
+        by_name=MappingProxyType({host.name: host for host in hosts}),
+        join_ips=join_ips,
+        containers=MappingProxyType(containers),
+        container_type=container_type,
+        multicontainer=config.Multicontainer,
+        fe_cores=cores.fe,
+        drives_cores=cores.drives,
+        compute_cores=cores.compute,
+        protocols_memory=config.protocols_memory,
+        memory=getattr(config, "memory", None),
+        dedicated=config.dedicated,
+        data_drives=data_drives,
+        parity_drives=config.paritydrives,
+        hot_spares=config.hot_spares,
+        auto_failure_domain=config.auto_failure_domain,
+        cloud_enable=config.cloud_enable,
+        cluster_name=config.clustername)
@@ -0,0 +1,144 @@
+################################################################################################
+# Route table
+################################################################################################
+# Answers "ip route get <target> oif <nic>" locally, from a host's routing tables and policy rules
+# (ip -4 -j route show table all / ip -4 -j rule show - see facts.py), so finding gateways takes no extra ssh commands
+import ipaddress
+from logging import getLogger
+
+log = getLogger(__name__)
+
+NO_ROUTE_TYPES = ("unreachable", "blackhole", "prohibit", "throw")
+
+
+class PrefixTrie(object):
+    """
+    binary trie of ipv4 prefixes; each node is [zero child, one child, list of routes]
+    """
+    def __init__(self):
+        self.root = [None, None, list()]
+
+    def insert(self, network, route):
+        node = self.root
+        address = int(network.network_address)
+        for bit in range(network.prefixlen):
+            branch = (address >> (31 - bit)) & 1
+            if node[branch] is None:
+                node[branch] = [None, None, list()]
+            node = node[branch]
+        node[2].append(route)
+
+    def matches(self, address):
+        """
+        :param address: an ipaddress.IPv4Address
+        :return: the route lists on the way to address, longest prefix first
+        """
+        address = int(address)
+        node = self.root
+        found = [node[2]] if node[2] else []
+        for bit in range(32):
+            node = node[(address >> (31 - bit)) & 1]
+            if node is None:
+                break
+            if node[2]:
+                found.append(node[2])
+        found.reverse()
+        return found
+
+
+class RouteTable(object):
+    def __init__(self, routes, rules):
+        """
+        :param routes: the output of 'ip -4 -j route show table all'
+        :param rules: the output of 'ip -4 -j rule show', or None to just use the main table
+        """
+        self.tables = dict()  # {table name: PrefixTrie}
+        for route in routes:
+            dst = route.get("dst")
+            try:
+                network = ipaddress.IPv4Network("0.0.0.0/0" if dst == "default" else dst, strict=False)
+            except (ValueError, TypeError):
+                continue  # not something we route by (ipv6, for example)
+            table = str(route.get("table", "main"))
+            if table not in self.tables:
+                self.tables[table] = PrefixTrie()
+            self.tables[table].insert(network, route)
+        if rules is None:
+            rules = [{"priority": 32766, "src": "all", "table": "main"}]
+        self.rules = sorted(rules, key=lambda rule: rule.get("priority", 0))
+
+    def lookup(self, target, oif, source=None):
+        """
+        like 'ip route get <target> oif <oif>' on the host
+
+        :param target: ip address we want to get to
+        :param oif: the interface we have to go out of
+        :param source: the interface's ip, for matching source-based routing rules - weka sends from it
+        :return: the route dict (as in ip -j route), or None if there's no route
+        """
+        target = ipaddress.IPv4Address(str(target))
+        for rule in self.rules:
+            if not self.rule_matches(rule, target, oif, source):
+                continue
+            trie = self.tables.get(str(rule.get("table", "main")))
+            if trie is None:
+                continue
+            route = self.best_route(trie, target, oif)
+            if route is not None:
+                if route.get("type") == "throw":
+                    continue  # on to the next rule
+                if route.get("type") in NO_ROUTE_TYPES:
+                    return None
+                return route
+        return None
+
+    @staticmethod
+    def rule_matches(rule, target, oif, source):
+        if rule.get("action", "to_tbl") not in ("to_tbl", "lookup"):
+            return False
+        if "oif" in rule and rule["oif"] != oif:
+            return False
+        if rule.get("iif", "lo") != "lo":  # rules for traffic arriving on another interface
+            return False
+        for field, address in (("src", source), ("dst", target)):
+            if rule.get(field, "all") == "all":
+                continue
+            if address is None:
+                return False
+            prefix = f"{rule[field]}/{rule.get(field + 'len', 32)}"
+            if ipaddress.IPv4Address(str(address)) not in ipaddress.IPv4Network(prefix, strict=False):
+                return False
+        return True
+
+    @staticmethod
+    def best_route(trie, target, oif):
+        """
+        :return: the longest-prefix, lowest-metric route out of oif, with its nexthop (if multipath) for oif
+        """
+        for routes in trie.matches(target):
+            best = None
+            for route in routes:
+                if route.get("type") in NO_ROUTE_TYPES:
+                    candidate = route
+                elif route.get("dev") == oif:
+                    candidate = route
+                else:
+                    candidate = None
+                    for nexthop in route.get("nexthops", []):
+                        if nexthop.get("dev") == oif:
+                            candidate = dict(route, **nexthop)
+                            break
+                if candidate is None:
+                    continue
+                if best is None or candidate.get("metric", 0) < best.get("metric", 0):
+                    best = candidate
+            if best is not None:
+                return best
+        return None
+
+    def gateway(self, target, oif, source=None):
+        """
+        :return: the gateway oif would use to get to target, or None if it's directly connected (or unreachable)
+        """
+        route = self.lookup(target, oif, source)
+        return None if route is None else route.get("gateway")
@@ -0,0 +1,539 @@
+################################################################################################
+# STEM-mode fleet simulator
+################################################################################################
+# A synthetic fleet of STEM-mode hosts for load-testing discovery: a local stand-in for the JSON-RPC API that
+# WekaApi talks to (cluster_list_beacons and machine_query_info), listening on a loopback address for every host
+# nic, plus an ssh stand-in that answers the commands discovery runs (facts, pings, ping sweeps, ip route get,
+# lscpu, ip rule) and the ones deploy.py runs (weka local/cluster, resources_generator.py, reading the drive lists).
+# scan_hosts() runs against it unmodified - give it the first host's address:
+#
+#     fleet = Fleet(500, latency=0.02, error_rate=0.01)
+#     fleet.start(port)
+#     fleet.install()    # ssh sessions go to the fleet instead of the network
+#     scan_hosts([fleet.reference_ip], port, ...)
+#
+# Host n's nic k is 127.(16 + k).(n // 250).(n % 250 + 1)/16, so every nic is on its own network.  Linux routes all
+# of 127.0.0.0/8 to lo, so nothing needs to be configured to bind them.
+import json
+import math
+import random
+import resource
+import selectors
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+
+from wekapyutils.wekassh import CommandOutput
+
+from facts import FACTS_FORMAT
+from sshpool import default_pool, TIMED_OUT
+
+log = getLogger(__name__)
+
+HOSTS_PER_OCTET = 250
+FIRST_NET_OCTET = 16
+DEFAULT_HANG = 10.0  # seconds a "timed out" request hangs for - longer than WekaApi's 5 second timeout
+STEM_MODE_ERROR = -32601  # what login returns on a STEM-mode host (also "method not found")
+
+# the keyword arguments Fleet() takes, for loading a profile from JSON
+PROFILE_KEYS = ("nics", "bonds", "sockets", "cores", "threads_per_core", "cpu_topology", "drives", "ram_gb",
+                "version", "version_mismatch_rate", "bad_eth_rate", "down_rate", "unreachable_rate", "ssh_fail_rate",
+                "gateway", "latency", "jitter", "error_rate", "timeout_rate", "hang", "command_latency",
+                "deploy_error_rate", "seed")
+
+
+class SimulatedHost(object):
+    def __init__(self, fleet, index, rng):
+        """
+        :param fleet: the Fleet it's in (for the profile)
+        :param index: the host's number in the fleet
+        :param rng: random.Random for this host, so a fleet is the same every time for a given seed
+        """
+        self.index = index
+        self.name = f"simhost{index:05d}"
+        self.ips = [fleet.nic_ip(index, nic) for nic in range(fleet.nics)]
+        self.version = fleet.version if rng.random() >= fleet.version_mismatch_rate else "3.14.0"
+        self.down = rng.random() < fleet.down_rate  # beacons, but the API never answers
+        self.ssh_fails = rng.random() < fleet.ssh_fail_rate
+        self.unreachable = {ip for ip in self.ips if rng.random() < fleet.unreachable_rate}  # don't answer pings
+        self.bad_eths = {nic for nic in range(fleet.nics) if rng.random() < fleet.bad_eth_rate}
+        self.drives_containers = 1  # how many drives containers resources_generator.py was asked for
+        self.machine_info = self.build_machine_info(fleet)
+
+    def nic_name(self, fleet, nic):
+        return f"bond{nic}" if fleet.bonds else f"ens{nic}"
+
+    def build_machine_info(self, fleet):
+        """
+        :return: what machine_query_info returns for this host
+        """
+        cores = list()
+        for socket_id in range(fleet.sockets):
+            for thread in range(fleet.threads_per_core):
+                for core_id in range(fleet.cores):
+                    core = {"model": "Simulated CPU @ 2.80GHz"}
+                    if fleet.cpu_topology:
+                        core.update({"core_id": core_id, "socket": socket_id, "numa": socket_id, "thread": thread})
+                    cores.append(core)
+
+        disks = [{"devName": "sda", "devPath": "/dev/sda", "type": "DISK", "isRotational": False, "isMounted": False,
+                  "pciAddr": "0000:00:17.0", "sizeBytes": 480103981056, "parentName": ""},
+                 {"devName": "sda1", "devPath": "/dev/sda1", "type": "PARTITION", "isRotational": False,
+                  "isMounted": True, "pciAddr": "", "sizeBytes": 480102932480, "parentName": "sda"}]
+        for drive in range(fleet.drives):
+            disks.append({"devName": f"nvme{drive}n1", "devPath": f"/dev/nvme{drive}n1", "type": "DISK",
+                          "isRotational": False, "isMounted": False, "pciAddr": f"0000:{drive + 0x81:02x}:00.0",
+                          "sizeBytes": 3840755982336, "parentName": ""})
+
+        interfaces = [{"name": "lo", "bondType": "NONE", "linkLayer": "ETH", "mtu": 65536, "ip4": "127.0.0.1",
+                       "ip4Netmask": 8, "name_slaves": []}]
+        eths = list()
+        for nic, ip in enumerate(self.ips):
+            name = self.nic_name(fleet, nic)
+            ports = [f"ens{nic}f0", f"ens{nic}f1"] if fleet.bonds else [name]
+            if fleet.bonds:
+                interfaces.append({"name": name, "bondType": "BOND_MLTI_NIC", "linkLayer": "ETH", "mtu": 9000,
+                                   "ip4": ip, "ip4Netmask": 16, "name_slaves": ports})
+                for port in ports:
+                    interfaces.append({"name": port, "bondType": "SLAVE", "linkLayer": "ETH", "mtu": 9000,
+                                       "ip4": "", "ip4Netmask": 0, "name_slaves": []})
+            else:
+                interfaces.append({"name": name, "bondType": "NONE", "linkLayer": "ETH", "mtu": 9000,
+                                   "ip4": ip, "ip4Netmask": 16, "name_slaves": []})
+            for port in ports:
+                good = nic not in self.bad_eths
+                eths.append({"interface_alias": port, "ethName": port, "speedMbps": 100000, "linkDetected": good,
+                             "validationCode": "OK" if good else "DRIVER_NOT_SUPPORTED"})
+
+        return {"version": self.version,
+                "cores": cores,
+                "memory": {"total": fleet.ram_gb * 1024 ** 3},
+                "osinfo": {"sys_vendor_info": {"product_uuid": f"5a1e0000-0000-4000-8000-{self.index:012d}"}},
+                "disks": disks,
+                "net": {"interfaces": interfaces},
+                "eths": eths}
+
+    def lscpu(self, fleet):
+        """
+        :return: dict of lscpu's "key: value" lines
+        """
+        return {"Architecture": "x86_64",
+                "CPU(s)": str(fleet.sockets * fleet.cores * fleet.threads_per_core),
+                "Thread(s) per core": str(fleet.threads_per_core),
+                "Core(s) per socket": str(fleet.cores),
+                "Socket(s)": str(fleet.sockets),
+                "NUMA node(s)": str(fleet.sockets),
+                "Model name": "Simulated CPU @ 2.80GHz"}
+
+    def facts(self, fleet):
+        """
+        :return: what the facts script (see facts.py) prints on this host
+        """
+        addr = [{"ifindex": 1, "ifname": "lo", "addr_info": [{"family": "inet", "local": "127.0.0.1", "prefixlen": 8}]}]
+        link = [{"ifindex": 1, "ifname": "lo", "link_type": "loopback", "mtu": 65536}]
+        route = list()
+        for nic, ip in enumerate(self.ips):
+            name = self.nic_name(fleet, nic)
+            addr.append({"ifindex": nic + 2, "ifname": name,
+                         "addr_info": [{"family": "inet", "local": ip, "prefixlen": 16}]})
+            link.append({"ifindex": nic + 2, "ifname": name, "link_type": "ether", "mtu": 9000})
+            route.append({"dst": fleet.network(nic), "dev": name, "protocol": "kernel", "scope": "link",
+                          "prefsrc": ip})
+        if fleet.gateway:
+            route.append({"dst": "default", "gateway": fleet.gateway_ip(0), "dev": self.nic_name(fleet, 0)})
+        rule = [{"priority": 0, "src": "all", "table": "local"},
+                {"priority": 32766, "src": "all", "table": "main"},
+                {"priority": 32767, "src": "all", "table": "default"}]
+        return {"format": FACTS_FORMAT, "addr": addr, "link": link, "route": route, "rule": rule,
+                "lscpu": self.lscpu(fleet)}
+
+
+class Fleet(object):
+    def __init__(self, num_hosts, nics=2, bonds=False, sockets=2, cores=16, threads_per_core=2, cpu_topology=True,
+                 drives=8, ram_gb=384, version="4.2.1", version_mismatch_rate=0.0, bad_eth_rate=0.0, down_rate=0.0, unreachable_rate=0.0,
+                 ssh_fail_rate=0.0, gateway=True, latency=0.0, jitter=0.0, error_rate=0.0, timeout_rate=0.0,
+                 hang=DEFAULT_HANG, command_latency=0.0, deploy_error_rate=0.0, seed=0):
+        """
+        :param num_hosts: how many hosts
+        :param nics: dataplane nics per host, each on its own network
+        :param bonds: make each nic a bond of two ports
+        :param sockets, cores, threads_per_core: cpu topology (cores is per socket)
+        :param cpu_topology: put each core's topology in machine info; without it, discovery has to use lscpu
+        :param drives: nvme drives per host (each host also has a boot drive that's in use)
+        :param version: the weka version the hosts run; version_mismatch_rate of them run an older one
+        :param bad_eth_rate: fraction of nics that fail validation
+        :param down_rate: fraction of hosts that beacon, but whose API doesn't answer
+        :param unreachable_rate: fraction of nic ips that don't answer pings
+        :param ssh_fail_rate: fraction of hosts we can't ssh to
+        :param gateway: give the hosts a default route via a gateway on their first nic
+        :param latency: seconds each API request takes, plus up to jitter more
+        :param error_rate: fraction of API requests dropped without a response
+        :param timeout_rate: fraction of API requests that hang for hang seconds
+        :param command_latency: seconds each ssh command takes
+        :param deploy_error_rate: fraction of deployment commands (and file copies) that fail
+        :param seed: the fleet (and which requests fail) is the same every time for the same seed
+        """
+        if num_hosts > HOSTS_PER_OCTET * 256:
+            raise ValueError(f"can't simulate more than {HOSTS_PER_OCTET * 256} hosts")
+        self.nics = nics
+        self.bonds = bonds
+        self.sockets = sockets
+        self.cores = cores
+        self.threads_per_core = threads_per_core
+        self.cpu_topology = cpu_topology
+        self.drives = drives
+        self.ram_gb = ram_gb
+        self.version = version
+        self.version_mismatch_rate = version_mismatch_rate
+        self.bad_eth_rate = bad_eth_rate
+        self.down_rate = down_rate
+        self.unreachable_rate = unreachable_rate
+        self.ssh_fail_rate = ssh_fail_rate
+        self.gateway = gateway
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.hang = hang
+        self.command_latency = command_latency
+        self.deploy_error_rate = deploy_error_rate
+        self.rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+        self.hosts = list()
+        self.by_ip = dict()  # {ip addr: SimulatedHost}
+        self.by_name = dict()  # {hostname or ip addr: SimulatedHost} - what ssh connects to
+        for index in range(num_hosts):
+            host = SimulatedHost(self, index, random.Random(f"{seed}/{index}"))
+            self.hosts.append(host)
+            self.by_name[host.name] = host
+            for ip in host.ips:
+                self.by_ip[ip] = host
+                self.by_name[ip] = host
+        self.containers = list()  # [(hostname, container name)] set up by deploy.py; their ids are their index
+        self._containers_lock = threading.Lock()
+        self.servers = list()
+        self._selector = None
+        self._saved_factory = None
+
+    @staticmethod
+    def nic_ip(index, nic):
+        return f"127.{FIRST_NET_OCTET + nic}.{index // HOSTS_PER_OCTET}.{index % HOSTS_PER_OCTET + 1}"
+
+    @staticmethod
+    def network(nic):
+        return f"127.{FIRST_NET_OCTET + nic}.0.0/16"
+
+    @staticmethod
+    def gateway_ip(nic):
+        return f"127.{FIRST_NET_OCTET + nic}.255.254"
+
+    @property
+    def reference_ip(self):
+        """
+        the address to give scan_hosts() - beacons come from the first host
+        """
+        return self.hosts[0].ips[0]
+
+    def random(self):
+        with self._rng_lock:
+            return self.rng.random()
+
+    def chance(self, rate):
+        return rate > 0 and self.random() < rate
+
+    def beacons(self):
+        """
+        :return: what cluster_list_beacons returns - {ip addr: hostname} for every nic of every host
+        """
+        return {ip: host.name for ip, host in self.by_ip.items()}
+
+    ########################################################################################
+    # the API
+    ########################################################################################
+    def start(self, port=14000):
+        """
+        listen for API requests on every (up) host's nic addresses; they're served from one thread
+
+        :param port: the port WekaApi connects to (scan_hosts' port)
+        """
+        wanted = len(self.by_ip) + 64
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < wanted:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(max(wanted, soft), hard), hard))
+
+        self._selector = selectors.DefaultSelector()
+        for ip, host in self.by_ip.items():
+            if host.down:
+                continue
+            server = SimulatedApiServer((ip, port), self, host)
+            self.servers.append(server)
+            self._selector.register(server, selectors.EVENT_READ)
+        threading.Thread(target=self.serve, name="simulator", daemon=True).start()
+        log.info(f"Simulating {len(self.hosts)} STEM-mode hosts on {len(self.servers)} addresses, port {port}")
+
+    def serve(self):
+        while self._selector is not None:
+            for key, events in self._selector.select(timeout=0.5):
+                key.fileobj.handle_request()  # it's ready, so this doesn't block; the request gets its own thread
+
+    def stop(self):
+        selector, self._selector = self._selector, None
+        if selector is not None:
+            selector.close()
+        for server in self.servers:
+            server.server_close()
+        self.servers = list()
+        self.uninstall()
+
+    def api_call(self, host, method):
+        """
+        :return: (JSON-RPC result, error) for a request to host
+        """
+        if method in ("userlogin", "user_refresh_token"):
+            return None, {"code": STEM_MODE_ERROR, "message": "Method not found"}  # we're in STEM mode
+        elif method == "cluster_list_beacons":
+            return self.beacons(), None
+        elif method == "machine_query_info":
+            return host.machine_info, None
+        return None, {"code": STEM_MODE_ERROR, "message": f"Method not found: {method}"}
+
+    ########################################################################################
+    # ssh
+    ########################################################################################
+    def install(self):
+        """
+        ssh sessions opened by the pool go to the simulated hosts
+        """
+        if self._saved_factory is None:
+            self._saved_factory = default_pool.server_factory
+        default_pool.server_factory = lambda hostname: SimulatedServer(self, hostname)
+
+    def uninstall(self):
+        if self._saved_factory is not None:
+            default_pool.server_factory = self._saved_factory
+            self._saved_factory = None
+
+    def pings(self, host, source_interface, target):
+        """
+        :return: True if host can ping target from source_interface - only on the same network, as on real
+                 dataplane networks without gateways between them
+        """
+        target_host = self.by_ip.get(target)
+        if target_host is None or target in target_host.unreachable:
+            return False
+        for nic in range(self.nics):
+            if host.nic_name(self, nic) == source_interface:
+                return target == self.nic_ip(target_host.index, nic)
+        return False
+
+    def run_command(self, host, command, timeout=None):
+        """
+        :param timeout: seconds before the command times out, or None for no limit
+        :return: CommandOutput for command, as if it were run on host
+        """
+        if timeout is not None and self.command_latency > timeout:
+            time.sleep(timeout)
+            return CommandOutput(TIMED_OUT, "", f"timed out after {timeout}s")
+        if self.command_latency > 0:
+            time.sleep(self.command_latency)
+        if "xargs" in command and "ping" in command:  # WekaHostGroup.ping_sweep
+            ips = command.split("printf '%s\\n' ", 1)[1].split(" |", 1)[0].split()
+            source_interface = command.split(" -I ")[-1].split()[0]
+            return CommandOutput(0, "\n".join(f"{ip} {0 if self.pings(host, source_interface, ip) else 1}"
+                                              for ip in ips) + "\n", "")
+        elif command.startswith("ping "):
+            words = command.split()
+            ok = self.pings(host, words[words.index("-I") + 1], words[-1])
+            if not ok:
+                return CommandOutput(1, "", "")
+            return CommandOutput(0, f"64 bytes from {words[-1]}: icmp_seq=1 ttl=64 time={self.latency * 1000:.3f} ms\n",
+                                 "")
+        elif '"format"' in command and "lscpu" in command:  # facts.facts_command()
+            return CommandOutput(0, json.dumps(host.facts(self)) + "\n", "")
+        elif command.startswith("lscpu"):
+            return CommandOutput(0, "".join(f"{key}: {value}\n" for key, value in host.lscpu(self).items()), "")
+        elif command.startswith("ip route get"):
+            words = command.split()
+            target, oif = words[3], words[5]
+            src = host.ips[[host.nic_name(self, nic) for nic in range(self.nics)].index(oif)]
+            if self.gateway and oif == host.nic_name(self, 0) and self.by_ip.get(target) is None:
+                return CommandOutput(0, f"{target} via {self.gateway_ip(0)} dev {oif} src {src}\n", "")
+            return CommandOutput(0, f"{target} dev {oif} src {src}\n", "")
+        elif command.startswith("ip rule show"):
+            return CommandOutput(1, "", "")  # grep -v all finds nothing
+        deployed = self.deploy_command(host, command)
+        if deployed is not None:
+            return deployed
+        return CommandOutput(127, "", f"sh: {command.split()[0]}: command not found")
+
+    def deploy_command(self, host, command):
+        """
+        :return: CommandOutput for one of the commands deploy.py runs on host, or None if it isn't one of them
+        """
+        if "weka " not in command and "resources_generator.py" not in command and not command.startswith("jq "):
+            return None
+        if self.chance(self.deploy_error_rate):
+            return CommandOutput(1, "", "error: simulated failure")
+        words = command.split()
+        if "resources_generator.py" in command:
+            cores = int(words[words.index("--drive-dedicated-cores") + 1])
+            host.drives_containers = max(1, math.ceil(cores / 19))
+        elif command.startswith("jq "):  # the drive paths in /tmp/drives<n>.json
+            container = int(words[-1][len("/tmp/drives"):-len(".json")])
+            paths = [f"/dev/nvme{drive}n1" for drive in range(self.drives)][container::host.drives_containers]
+            return CommandOutput(0, "".join(f"{path}\n" for path in paths), "")
+        elif "weka local setup" in command:
+            with self._containers_lock:
+                self.containers.append((host.name, words[words.index("--name") + 1]))
+        elif "weka cluster container" in command:
+            with self._containers_lock:
+                listing = "".join(f"{container_id} {hostname} {container}\n"
+                                  for container_id, (hostname, container) in enumerate(self.containers))
+            return CommandOutput(0, listing, "")
+        return CommandOutput(0, "", "")
+
+    def put(self, host, local, remote):
+        """
+        :return: CommandOutput for copying a file to host (the file isn't actually copied anywhere)
+        """
+        if self.command_latency > 0:
+            time.sleep(self.command_latency)
+        if self.chance(self.deploy_error_rate):
+            return CommandOutput(1, "", "error: simulated failure")
+        return CommandOutput(0, "", "")
+
+
+class SimulatedApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, fleet, host):
+        self.fleet = fleet
+        self.host = host
+        super(SimulatedApiServer, self).__init__(address, SimulatedApiHandler)
+
+    def server_bind(self):
+        # skip HTTPServer's getfqdn() - thousands of reverse lookups of 127.x addresses is slow
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(self.server_address)
+        self.server_address = self.socket.getsockname()
+        self.server_name, self.server_port = self.server_address
+
+
+class SimulatedApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+    def do_POST(self):
+        fleet = self.server.fleet
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length))
+        except ValueError:
+            self.send_error(400)
+            return
+
+        if fleet.latency > 0 or fleet.jitter > 0:
+            time.sleep(fleet.latency + fleet.jitter * fleet.random())
+        if fleet.chance(fleet.timeout_rate):
+            time.sleep(fleet.hang)
+        if fleet.chance(fleet.error_rate):
+            self.close_connection = True  # drop it - the client sees the connection reset
+            return
+
+        result, error = fleet.api_call(self.server.host, request.get("method"))
+        response = {"jsonrpc": "2.0", "id": request.get("id")}
+        if error is not None:
+            response["error"] = error
+        else:
+            response["result"] = result
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(f"{self.server.host.name}: {format % args}")
+
+
+class SimulatedServer(object):
+    """
+    stands in for wekapyutils' RemoteServer - runs commands against the simulated fleet
+    """
+    def __init__(self, fleet, hostname):
+        self.fleet = fleet
+        self.hostname = hostname
+        self.host = fleet.by_name.get(hostname)
+        self.connected = False
+
+    def connect(self):
+        if self.host is None or self.host.ssh_fails:
+            log.error(f"Unable to connect to {self.hostname}")
+            return
+        self.connected = True
+
+    def run(self, command, timeout=None):
+        return self.fleet.run_command(self.host, command, timeout)
+
+    def put(self, local, remote):
+        return self.fleet.put(self.host, local, remote)
+
+    def close(self):
+        self.connected = False
+
+
+def load_profile(filename):
+    """
+    :param filename: JSON object of Fleet keyword arguments
+    :return: dict, or None if the file isn't usable
+    """
+    try:
+        with open(filename) as fp:
+            profile = json.load(fp)
+    except (OSError, ValueError) as exc:
+        log.error(f"Unable to read simulator profile {filename}: {exc}")
+        return None
+    unknown = [key for key in profile.keys() if key not in PROFILE_KEYS] if isinstance(profile, dict) else None
+    if unknown is None or len(unknown) > 0:
+        log.error(f"Simulator profile {filename} must be a JSON object of {PROFILE_KEYS}")
+        return None
+    return profile
+
+
+if __name__ == '__main__':
+    import argparse
+    import logging
+
+    parser = argparse.ArgumentParser(description="Simulate a fleet of STEM-mode WEKA hosts on loopback addresses")
+    parser.add_argument("hosts", type=int, help="number of hosts to simulate")
+    parser.add_argument("-p", "--port", type=int, default=14000, help="API port (default 14000)")
+    parser.add_argument("--profile", type=str, default=None, help="JSON file of fleet settings")
+    parser.add_argument("--latency", type=float, default=None, help="seconds each API request takes")
+    parser.add_argument("--error-rate", dest="error_rate", type=float, default=None,
+                        help="fraction of API requests to drop")
+    parser.add_argument("--timeout-rate", dest="timeout_rate", type=float, default=None,
+                        help="fraction of API requests that hang")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    settings = dict()
+    if args.profile is not None:
+        settings = load_profile(args.profile)
+        if settings is None:
+            raise SystemExit(1)
+    for key in ("latency", "error_rate", "timeout_rate"):
+        if getattr(args, key) is not None:
+            settings[key] = getattr(args, key)
+
+    sim = Fleet(args.hosts, **settings)
+    sim.start(args.port)
+    log.info(f"First host is {sim.hosts[0].name} at {sim.reference_ip}; ^C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        sim.stop()
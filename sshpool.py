@@ -0,0 +1,228 @@
+################################################################################################
+# SSH connection pool
+################################################################################################
+# One ssh connection per host, shared by everything that needs to run commands there.  Commands run as channels
+# over that connection (up to max_sessions at a time per host), so we only pay for the handshake once per host.
+import threading
+import time
+from logging import getLogger
+from socket import gaierror
+
+from invoke.exceptions import CommandTimedOut
+from paramiko.ssh_exception import ChannelException
+from wekapyutils.wekassh import RemoteServer, CommandOutput
+
+from timeouts import default_timeouts
+from timing import default_recorder
+
+log = getLogger(__name__)
+
+# OpenSSH's default MaxSessions is 10; leave a little room for anyone else using the connection
+DEFAULT_MAX_SESSIONS = 8
+CHANNEL_RETRIES = 3
+TIMED_OUT = 124  # the status of a command that timed out (the same as timeout(1)'s)
+
+
+class TimedRemoteServer(RemoteServer):
+    """
+    RemoteServer, with a timeout on each command
+    """
+    def run(self, cmd, timeout=None):
+        """
+        :param timeout: seconds to let the command run before closing its channel, or None for no limit
+        :return: CommandOutput, like RemoteServer.run().  A command that times out has status TIMED_OUT
+        """
+        if timeout is None:
+            return super(TimedRemoteServer, self).run(cmd)
+        if not self.connected:
+            log.error(f'Cannot run command - not connected to host {self._hostname}')
+            return
+        try:
+            result = self.connection.run(cmd, hide=True, timeout=timeout)
+        except CommandTimedOut as exc:
+            self.output = CommandOutput(TIMED_OUT, exc.result.stdout, f"timed out after {timeout}s", exc)
+        except gaierror as exc:
+            log.error(f"Error connecting to {self._hostname}: hostname not found")
+            self.output = CommandOutput(127, "hostname not found", "", exc)
+        except Exception as exc:
+            log.debug(f"run (Exception): '{cmd[:100]}', exception='{exc}'")
+            result = exc.result
+            self.output = CommandOutput(result.return_code, result.stdout, result.stderr, exc)
+        else:
+            self.output = CommandOutput(result.return_code, result.stdout, result.stderr)
+        return self.output
+
+    def put(self, local, remote):
+        """
+        copy a file to the host over this connection (sftp), keeping its mode, like scp -p
+
+        :param remote: path, or directory (ending in /) to put it in
+        :return: CommandOutput - status 0 if it was copied
+        """
+        if not self.connected:
+            log.error(f'Cannot copy file - not connected to host {self._hostname}')
+            return
+        try:
+            self.connection.put(local, remote, preserve_mode=True)
+        except Exception as exc:
+            log.debug(f"put (Exception): '{local}' to '{remote}', exception='{exc}'")
+            return CommandOutput(1, "", str(exc), exc)
+        return CommandOutput(0, "", "")
+
+
+class SSHPool(object):
+    def __init__(self, max_sessions=DEFAULT_MAX_SESSIONS):
+        """
+        :param max_sessions: max number of commands to run over one host's connection at the same time
+        """
+        self.max_sessions = max_sessions
+        self.server_factory = TimedRemoteServer  # makes the session for a hostname (simulator.py swaps this out)
+        self.servers = dict()  # {hostname: RemoteServer}
+        self.channels = dict()  # {hostname: Semaphore} - limits the channels open on each connection
+        self.host_locks = dict()  # {hostname: Lock} - so only one thread does the handshake
+        self.handshakes = 0
+        self.failed_handshakes = 0
+        self.commands = 0
+        self._lock = threading.Lock()
+
+    def _host_lock(self, hostname):
+        with self._lock:
+            if hostname not in self.host_locks:
+                self.host_locks[hostname] = threading.Lock()
+                self.channels[hostname] = threading.Semaphore(self.max_sessions)
+            return self.host_locks[hostname]
+
+    def connect(self, hostname, interactive=True):
+        """
+        get the connection to a host, opening it if we don't have one yet
+
+        :param hostname: host to connect to
+        :param interactive: ask the user for credentials if key-based login fails (don't from threads)
+        :return: a connected RemoteServer, or None if we can't connect
+        """
+        with self._host_lock(hostname):
+            server = self.servers.get(hostname)
+            if server is not None and server.connected:
+                return server
+            server = self.server_factory(hostname)
+            setattr(server, "___interactive", interactive)
+            with default_recorder.span("ssh_connect", hostname) as timer:
+                server.connect()
+                if not server.connected:
+                    timer.outcome = "failed"
+            with self._lock:
+                self.handshakes += 1
+                if not server.connected:
+                    self.failed_handshakes += 1
+                    return None
+                self.servers[hostname] = server
+            return server
+
+    def alias(self, hostname, existing):
+        """
+        use existing's connection for hostname too (ie: when the reference host turns out to have another name)
+        """
+        self._host_lock(existing)
+        with self._lock:
+            self.host_locks[hostname] = self.host_locks[existing]
+            self.channels[hostname] = self.channels[existing]
+            if existing in self.servers:
+                self.servers[hostname] = self.servers[existing]
+
+    def run(self, hostname, command, timeout=None):
+        """
+        run a command on a host over its pooled connection
+
+        :param timeout: seconds to allow the command, or None to go by how long commands on the host have been
+                        taking (see timeouts.py)
+        :return: a CommandOutput object, like RemoteServer.run()
+        """
+        adaptive = timeout is None
+        if adaptive:
+            timeout = default_timeouts.get("ssh", hostname)
+        server = self.connect(hostname, interactive=False)
+        if server is None:
+            return CommandOutput(255, "", f"unable to open ssh session to {hostname}")
+        with self.channels[hostname]:
+            with self._lock:
+                self.commands += 1
+            for attempt in range(CHANNEL_RETRIES):
+                start = time.time()
+                try:
+                    output = server.run(command, timeout=timeout)
+                except AttributeError as exc:
+                    # RemoteServer.run() trips over exceptions that don't carry a command result - like
+                    # the far end refusing to open another channel, or the connection dropping
+                    cause = exc.__context__ if exc.__context__ is not None else exc
+                    output = CommandOutput(255, "", str(cause), cause)
+                    if not isinstance(cause, ChannelException):
+                        log.error(f"{hostname}: ssh session failed: {cause}")
+                        server.connected = False  # reconnect next time
+                        break
+                    log.debug(f"{hostname}: unable to open channel ({cause}), attempt {attempt + 1}")
+                    default_recorder.current().retries += 1
+                    time.sleep(attempt + 1)
+                    continue
+                if output is None:
+                    # another thread found the session dead - reconnect (connect() holds the host's lock while
+                    # it does) and try again
+                    log.debug(f"{hostname}: ssh session was closed, reconnecting, attempt {attempt + 1}")
+                    server = self.connect(hostname, interactive=False)
+                    if server is None:
+                        return CommandOutput(255, "", f"lost ssh session to {hostname}, unable to reconnect")
+                    continue
+                if output.status == TIMED_OUT:
+                    log.error(f"{hostname}: '{command[:100]}' timed out after {timeout}s")
+                    default_timeouts.timed_out("ssh", time.time() - start, hostname)
+                elif adaptive:
+                    default_timeouts.observe("ssh", time.time() - start, hostname)
+                return output
+        if output is None:
+            return CommandOutput(255, "", f"lost ssh session to {hostname}")
+        return output
+
+    def put(self, hostname, local, remote):
+        """
+        copy a file to a host over its pooled connection
+
+        :return: a CommandOutput object - status 0 if it was copied
+        """
+        server = self.connect(hostname, interactive=False)
+        if server is None:
+            return CommandOutput(255, "", f"unable to open ssh session to {hostname}")
+        with self.channels[hostname]:
+            with self._lock:
+                self.commands += 1
+            output = server.put(local, remote)
+            if output is None:  # another thread found the session dead
+                server = self.connect(hostname, interactive=False)
+                output = None if server is None else server.put(local, remote)
+            if output is None:
+                return CommandOutput(255, "", f"lost ssh session to {hostname}")
+            return output
+
+    def stats(self):
+        """
+        :return: dict of handshakes, commands, and reuse ratio (fraction of commands that didn't need a handshake)
+        """
+        with self._lock:
+            successful = self.handshakes - self.failed_handshakes
+            return {
+                "handshakes": self.handshakes,
+                "failed_handshakes": self.failed_handshakes,
+                "connections": len(self.servers),
+                "commands": self.commands,
+                "reuse_ratio": round(max(0.0, 1 - successful / self.commands), 3) if self.commands > 0 else 0.0,
+            }
+
+    def close_all(self):
+        with self._lock:
+            for hostname, server in self.servers.items():
+                try:
+                    server.close()
+                except Exception as exc:
+                    log.debug(f"error closing ssh session to {hostname}: {exc}")
+            self.servers = dict()
+
+
+default_pool = SSHPool()
@@ -0,0 +1,73 @@
+################################################################################################
+# Discovery state
+################################################################################################
+# saves what discovery found, so a later run can rescan just a few hosts (--rescan) instead of the whole fleet
+import json
+import os
+from logging import getLogger
+
+log = getLogger(__name__)
+
+STATE_FORMAT = 1
+DEFAULT_STATE_FILE = "wekaconfig_state.json"
+
+
+def save_state(hostgroup, filename):
+    """
+    save the results of discovery
+
+    :param hostgroup: a WekaHostGroup
+    :param filename: where to save it
+    """
+    hosts = dict()
+    owners = dict()  # {ipaddr: [hostname, ifname]} - so we can save pingable_ips by name
+    for hostname, host in hostgroup.usable_hosts.items():
+        hosts[hostname] = {
+            "machine_info": host.machine_info,
+            "beacon_ips": host.beacon_ips,
+            "gateways": {name: nic.gateway for name, nic in host.nics.items() if nic.gateway is not None},
+            "hyperthread": host.hyperthread,
+            "threads_per_core": host.threads_per_core,
+            "ip_rules": host.ip_rules,
+        }
+        for ifname, nic in host.nics.items():
+            owners[str(nic.ip)] = [hostname, ifname]
+
+    state = {
+        "format": STATE_FORMAT,
+        "weka_version": hostgroup.weka_version,
+        "reference_host": hostgroup.reference_host.name,
+        "beacons": hostgroup.beacons,
+        "hosts": hosts,
+        "accessible_hosts": {iface: sorted(host_set) for iface, host_set in hostgroup.accessible_hosts.items()},
+        "pingable_ips": {iface: [owners[str(nic.ip)] for nic in ip_list if str(nic.ip) in owners]
+                         for iface, ip_list in hostgroup.pingable_ips.items()},
+        "rejected_hosts": hostgroup.rejected_hosts,
+    }
+    try:
+        with open(filename, "w") as fp:
+            json.dump(state, fp)
+    except OSError as exc:
+        log.error(f"Unable to save discovery state to {filename}: {exc}")
+        return
+    log.info(f"Discovery state saved to {filename}")
+
+
+def load_state(filename):
+    """
+    :param filename: a file written by save_state()
+    :return: the saved state (dict), or None if there isn't a usable one
+    """
+    if not os.path.exists(filename):
+        log.error(f"No saved discovery state in {filename} - run a full scan first")
+        return None
+    try:
+        with open(filename) as fp:
+            state = json.load(fp)
+    except (OSError, ValueError) as exc:
+        log.error(f"Unable to read discovery state from {filename}: {exc}")
+        return None
+    if state.get("format") != STATE_FORMAT:
+        log.error(f"Discovery state in {filename} is from a different version of wekaconfig - run a full scan")
+        return None
+    return state
@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+import benchmark
+from answers import HeadlessConfig, load_answers
+from simulator import Fleet
+
+
+def make_config(num_hosts=8, nics=2):
+    group = benchmark.build_hostgroup(Fleet(num_hosts, nics=nics, cores=16))
+    benchmark.stage_analyze_networks(group)
+    benchmark.stage_host_table(group)
+    benchmark.stage_network_index(group)
+    return HeadlessConfig(group)
+
+
+def write(tmp_path, contents):
+    filename = tmp_path / "answers.json"
+    filename.write_text(contents if isinstance(contents, str) else json.dumps(contents))
+    return str(filename)
+
+
+def test_load_answers(tmp_path):
+    assert load_answers(write(tmp_path, {"cluster_name": "c1", "cores": {"fe": 2}})) == \
+        {"cluster_name": "c1", "cores": {"fe": 2}}
+    assert load_answers(str(tmp_path / "missing.json")) is None
+    assert load_answers(write(tmp_path, "{not json")) is None
+    assert load_answers(write(tmp_path, ["cluster_name"])) is None
+    assert load_answers(write(tmp_path, {"cluster_nmae": "c1"})) is None
+
+
+def test_defaults():
+    config = make_config()
+    assert config.apply({})
+    assert config.cleanexit
+    assert [str(dp) for dp in config.selected_dps] == [Fleet.network(0), Fleet.network(1)]
+    assert len(config.selected_hosts) == 8
+    assert config.HighAvailability  # more than one dataplane network
+    assert config.Multicontainer
+    assert (config.datadrives, config.paritydrives, config.hot_spares) == (5, 2, 1)
+    cores = config.selected_cores
+    assert cores.fe + cores.drives + cores.compute == cores.used <= cores.usable
+    assert config.protocols_memory == 0
+
+
+def test_one_network():
+    config = make_config()
+    assert config.apply({"networks": [Fleet.network(1)], "high_availability": None})
+    assert [str(dp) for dp in config.selected_dps] == [Fleet.network(1)]
+    assert not config.HighAvailability
+
+
+@pytest.mark.parametrize("networks", [["10.0.0.0/300"], ["192.168.0.0/16"], []])
+def test_bad_networks(networks):
+    assert not make_config().apply({"networks": networks})
+
+
+def test_include_and_exclude_hosts():
+    config = make_config(10)
+    assert config.apply({"hosts": {"include": ["simhost0000*"], "exclude": ["simhost00003", "simhost0000[78]"]}})
+    assert sorted(config.selected_hosts) == ["simhost00000", "simhost00001", "simhost00002", "simhost00004",
+                                             "simhost00005", "simhost00006", "simhost00009"]
+
+
+def test_too_few_hosts():
+    assert not make_config().apply({"hosts": {"include": ["simhost0000[0-3]"]}})
+    assert not make_config().apply({"hosts": {"include": ["simhost0000[0-4]"], "min_hosts": 6}})
+    config = make_config()
+    assert config.apply({"hosts": {"include": ["simhost0000[0-4]"]}})
+    assert (len(config.selected_hosts), config.datadrives) == (5, 3)
+
+
+def test_core_overrides():
+    config = make_config()
+    assert config.apply({"cores": {"fe": 2, "drives": 4, "compute": 8}})
+    cores = config.selected_cores
+    assert (cores.fe, cores.drives, cores.compute, cores.used) == (2, 4, 8, 14)
+
+
+@pytest.mark.parametrize("overrides", [{"fe": 0}, {"compute": 100}, {"fe": 10, "drives": 10, "compute": 10}])
+def test_bad_core_overrides(overrides):
+    assert not make_config().apply({"cores": overrides})
+
+
+def test_protocols_bias():
+    config = make_config()
+    assert config.apply({"bias": {"protocols": True}})
+    assert config.protocols_memory == 20
+    config = make_config()
+    assert config.apply({"bias": {"protocols_primary": True}})
+    assert config.protocols_memory == 60
+    assert not make_config().apply({"protocols_memory": 100000})
+
+
+@pytest.mark.parametrize("protection", [{"parity_drives": 3}, {"parity_drives": 4}, {"data_drives": 2},
+                                        {"data_drives": 7}, {"hot_spares": 8}, {"hot_spares": -1}])
+def test_bad_protection(protection):
+    assert not make_config().apply(protection)
@@ -0,0 +1,72 @@
+import threading
+from ipaddress import IPv4Network
+
+from wekalib.exceptions import CommunicationError, LoginError
+
+from apiracer import ApiRacer
+
+IPS = ["10.0.0.5", "10.1.0.5", "10.2.0.5"]
+
+
+def opener(behaviour, started=None):
+    """
+    :param behaviour: {ip: "ok", "fail", "login" or a threading.Event to wait for before failing}
+    """
+    def open_api(ip):
+        if started is not None:
+            started.append(ip)
+        what = behaviour[ip]
+        if what == "ok":
+            return f"api on {ip}"
+        elif what == "login":
+            raise LoginError("bad password")
+        elif isinstance(what, threading.Event):
+            what.wait(5)
+        raise CommunicationError("connection refused")
+    return open_api
+
+
+def test_first_ip_works():
+    started = list()
+    assert ApiRacer().race("host1", IPS, opener({ip: "ok" for ip in IPS}, started)) == ("api on 10.0.0.5",
+                                                                                       "10.0.0.5", 1)
+    assert started == ["10.0.0.5"]
+
+
+def test_next_starts_as_soon_as_one_fails():
+    racer = ApiRacer(stagger=10)  # it mustn't wait out the stagger
+    behaviour = {"10.0.0.5": "fail", "10.1.0.5": "login", "10.2.0.5": "ok"}
+    assert racer.race("host1", IPS, opener(behaviour)) == ("api on 10.2.0.5", "10.2.0.5", 3)
+
+
+def test_slow_ip_doesnt_hold_things_up():
+    hung = threading.Event()
+    try:
+        behaviour = {"10.0.0.5": hung, "10.1.0.5": "ok", "10.2.0.5": "ok"}
+        assert ApiRacer(stagger=0.01).race("host1", IPS, opener(behaviour)) == ("api on 10.1.0.5", "10.1.0.5", 2)
+    finally:
+        hung.set()
+
+
+def test_none_work():
+    assert ApiRacer(stagger=0.01).race("host1", IPS, opener({ip: "fail" for ip in IPS})) == (None, None, 3)
+
+
+def test_winning_subnets_go_first():
+    racer = ApiRacer()
+    racer.networks = [IPv4Network("10.1.0.0/16")]
+    behaviour = {"10.0.0.5": "fail", "10.1.0.5": "ok", "10.2.0.5": "ok"}
+    racer.race("host1", IPS, opener(behaviour))
+    assert racer.order(["10.0.0.6", "10.2.0.6", "10.1.0.6"]) == ["10.1.0.6", "10.0.0.6", "10.2.0.6"]
+    started = list()
+    assert racer.race("host2", ["10.0.0.6", "10.1.0.6"], opener({"10.0.0.6": "ok", "10.1.0.6": "ok"}, started))[1] \
+        == "10.1.0.6"
+    assert started == ["10.1.0.6"]
+
+
+def test_subnet():
+    racer = ApiRacer()
+    racer.networks = [IPv4Network("10.1.0.0/16")]
+    assert racer.subnet("10.1.2.3") == IPv4Network("10.1.0.0/16")
+    assert racer.subnet("192.168.7.9") == IPv4Network("192.168.7.0/24")
+    assert racer.subnet("host1.example.com") is None
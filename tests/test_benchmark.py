@@ -0,0 +1,19 @@
+import benchmark
+from simulator import Fleet
+
+
+def test_check_weka_release_does_the_same_work_every_run():
+    group = benchmark.build_hostgroup(Fleet(20, version_mismatch_rate=0.3, seed=1))
+    candidates = list(group.candidates)
+    for run in range(3):
+        benchmark.stage_check_weka_release(group)
+        assert list(group.candidates) == candidates
+        assert group.rejected_hosts == {}
+        assert sum(len(hostnames) for hostnames in group.uuids.values()) == \
+            len([host for host in group.candidates.values() if host.version == group.weka_version]) - 1
+
+
+def test_growth():
+    results = [{"hosts": 10, "seconds": 1.0}, {"hosts": 100, "seconds": 10.0}, {"hosts": 1000, "seconds": 1000.0},
+               {"hosts": 10000, "seconds": 0.0}]
+    assert benchmark.growth(results) == [1.0, 2.0, None]
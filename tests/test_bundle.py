@@ -0,0 +1,92 @@
+import atexit
+
+import pytest
+import wekalib.exceptions
+from wekapyutils.wekassh import CommandOutput
+
+from bundle import IOBundle
+
+
+class FakeApi(object):
+    STEMMode = True
+
+    def __init__(self):
+        self.calls = 0
+
+    def weka_api_command(self, method, parms=None):
+        self.calls += 1
+        if method == "bad_method":
+            raise wekalib.exceptions.APIError("no such method")
+        return {"method": method, "parms": parms, "call": self.calls}
+
+
+def recorded_bundle(tmp_path):
+    """
+    record a short session, and return the bundle's filename
+    """
+    filename = str(tmp_path / "bundle.json.gz")
+    bundle = IOBundle()
+    bundle.record(filename)
+    atexit.unregister(bundle.save)
+
+    api = bundle.open_api("host1", "10.0.0.5", FakeApi)
+    api.weka_api_command("machine_query_info")
+    api.weka_api_command("machine_query_info")
+    with pytest.raises(wekalib.exceptions.APIError):
+        api.weka_api_command("bad_method")
+    assert bundle.connect("host1", lambda: object()) is not None
+    assert bundle.connect("host2", lambda: None) is None
+    bundle.run("host1", "uname -r", lambda: CommandOutput(0, "5.14\n", ""))
+    bundle.run("host1", "false", lambda: CommandOutput(1, "", "failed"))
+    bundle.save()
+    return filename
+
+
+def replay_bundle(filename):
+    bundle = IOBundle()
+    assert bundle.replay(filename, latency=0)
+    return bundle
+
+
+def test_replay_api(tmp_path):
+    bundle = replay_bundle(recorded_bundle(tmp_path))
+    api = bundle.open_api("host1", "10.0.0.5", lambda: pytest.fail("replay opened the API"))
+    assert api.STEMMode
+    assert api.weka_api_command("machine_query_info")["call"] == 1
+    assert api.weka_api_command("machine_query_info")["call"] == 2
+    assert api.weka_api_command("machine_query_info")["call"] == 2  # repeats the last one
+    with pytest.raises(wekalib.exceptions.APIError):
+        api.weka_api_command("bad_method")
+    assert bundle.misses == 0
+
+
+def test_replay_ssh(tmp_path):
+    bundle = replay_bundle(recorded_bundle(tmp_path))
+    assert bundle.connect("host1", lambda: pytest.fail("replay connected")).connected
+    assert bundle.connect("host2", lambda: pytest.fail("replay connected")) is None
+    output = bundle.run("host1", "uname -r", lambda: pytest.fail("replay ran the command"))
+    assert (output.status, output.stdout) == (0, "5.14\n")
+    assert bundle.run("host1", "false", None).status == 1
+    assert bundle.misses == 0
+
+
+def test_replay_misses(tmp_path):
+    bundle = replay_bundle(recorded_bundle(tmp_path))
+    assert bundle.run("host1", "uname -a", None).status == 255
+    assert bundle.connect("host3", None) is None
+    with pytest.raises(wekalib.exceptions.CommunicationError):
+        bundle.open_api("host1", "10.1.0.5", None)
+    assert bundle.misses == 3
+
+
+def test_replay_bad_bundle(tmp_path):
+    (tmp_path / "bundle.json.gz").write_text("not gzip")
+    bundle = IOBundle()
+    assert not bundle.replay(str(tmp_path / "bundle.json.gz"))
+    assert bundle.mode is None
+
+
+def test_pass_through():
+    bundle = IOBundle()
+    assert bundle.run("host1", "true", lambda: CommandOutput(0, "", "")).status == 0
+    assert bundle.entries["run"] == {}
@@ -0,0 +1,98 @@
+import time
+
+from cache import MachineInfoCache
+
+IPS = ["10.0.0.5", "10.1.0.5"]
+
+
+def machine_info(version="4.2.1", cores=32):
+    return {"version": version, "cores": cores}
+
+
+def make_cache(tmp_path, **kwargs):
+    return MachineInfoCache(filename=str(tmp_path / "cache.json.gz"), **kwargs)
+
+
+def age(cache, hostname, seconds):
+    for entry in cache.hosts[hostname].values():
+        entry["timestamp"] -= seconds
+
+
+def test_hit(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.store("host1", IPS, machine_info(), "uuid-1")
+    assert cache.lookup("host1", "4.2.1", list(reversed(IPS))) == machine_info()  # ip order doesn't matter
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_miss_unknown_host(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.lookup("host1", "4.2.1", IPS) is None
+    assert (cache.hits, cache.misses) == (0, 1)
+
+
+def test_expired_entry_is_a_miss(tmp_path):
+    cache = make_cache(tmp_path, ttl=60)
+    cache.store("host1", IPS, machine_info(), "uuid-1")
+    age(cache, "host1", 61)
+    assert cache.lookup("host1", "4.2.1", IPS) is None
+
+
+def test_version_change_is_a_miss(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.store("host1", IPS, machine_info(), "uuid-1")
+    assert cache.lookup("host1", "4.3.0", IPS) is None
+
+
+def test_beacon_ip_change_is_a_miss(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.store("host1", IPS, machine_info(), "uuid-1")
+    assert cache.lookup("host1", "4.2.1", IPS[:1]) is None
+    assert cache.lookup("host1", "4.2.1", IPS + ["10.2.0.5"]) is None
+
+
+def test_newest_entry_wins(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.store("host1", IPS, machine_info(cores=16), "uuid-old")  # the host's board was replaced
+    age(cache, "host1", 10)
+    cache.store("host1", IPS, machine_info(cores=32), "uuid-new")
+    assert cache.lookup("host1", "4.2.1", IPS)["cores"] == 32
+
+
+def test_refresh_ignores_the_cache(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.store("host1", IPS, machine_info(), "uuid-1")
+    cache.refresh = True
+    assert cache.lookup("host1", "4.2.1", IPS) is None
+
+
+def test_invalidate(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.store("host1", IPS, machine_info(), "uuid-1")
+    cache.store("host2", IPS, machine_info(), "uuid-2")
+    cache.invalidate("host1")
+    cache.invalidate("host3")  # not there is fine
+    assert cache.lookup("host1", "4.2.1", IPS) is None
+    assert cache.lookup("host2", "4.2.1", IPS) is not None
+
+
+def test_save_and_load(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.store("host1", IPS, machine_info(), "uuid-1")
+    cache.save()
+    loaded = make_cache(tmp_path)
+    assert loaded.lookup("host1", "4.2.1", IPS) == machine_info()
+
+
+def test_save_drops_expired_entries(tmp_path):
+    cache = make_cache(tmp_path, ttl=60)
+    cache.store("host1", IPS, machine_info(), "uuid-1")
+    cache.store("host2", IPS, machine_info(), "uuid-2")
+    age(cache, "host1", 61)
+    cache.save()
+    assert list(make_cache(tmp_path).hosts) == ["host2"]
+
+
+def test_unreadable_cache_is_ignored(tmp_path):
+    (tmp_path / "cache.json.gz").write_text("not gzip")
+    assert make_cache(tmp_path).hosts == {}
@@ -0,0 +1,110 @@
+import json
+
+import pytest
+from wekapyutils.wekassh import CommandOutput
+
+import answers
+import benchmark
+import deploy
+from deploy import Deployment
+from output import ADD_DRIVES, WekaCluster
+from simulator import Fleet
+from sshpool import default_pool
+
+
+@pytest.fixture
+def fleet(monkeypatch):
+    monkeypatch.setattr(deploy, "RETRY_DELAY", 0)
+    fleet = Fleet(6, nics=1, drives=8)
+    fleet.install()
+    yield fleet
+    fleet.uninstall()
+    default_pool.close_all()
+
+
+def deployment(fleet, **kwargs):
+    group = benchmark.build_hostgroup(fleet)
+    benchmark.stage_analyze_networks(group)
+    benchmark.stage_host_table(group)
+    benchmark.stage_network_index(group)
+    config = answers.HeadlessConfig(group)
+    assert config.apply({"cluster_name": "test"})
+    return Deployment(WekaCluster(config), group, **kwargs)
+
+
+def fail_once(fleet, monkeypatch, words):
+    """
+    make the first command with all of words in it fail (after it has done what it does, as if it timed out)
+    """
+    failed = list()
+    deploy_command = fleet.deploy_command
+
+    def flaky(host, command):
+        output = deploy_command(host, command)
+        if len(failed) == 0 and all(word in command for word in words):
+            failed.append(command)
+            return CommandOutput(124, "", "timed out")
+        return output
+
+    monkeypatch.setattr(fleet, "deploy_command", flaky)
+    return failed
+
+
+def steps(report, text):
+    return [step for step in report["steps"] if text in step["step"]]
+
+
+def test_deploy(fleet):
+    deployed = deployment(fleet)
+    assert deployed.run()
+    report = deployed.report()
+    assert [phase["phase"] for phase in report["phases"]] == ["prepare", "create", "containers", "drives", "settings",
+                                                              "frontend"]
+    assert all(step["outcome"] == "ok" and step["attempts"] == 1 for step in report["steps"])
+    assert sorted(fleet.containers) == sorted((host.name, container) for host in fleet.hosts
+                                              for container in ("drives0", "compute0", "frontend0"))
+    # every drive of every host is added, from the lists read when the hosts were prepared
+    adds = steps(report, "Adding drives")
+    assert len(adds) == len(fleet.hosts)
+    assert len(deployed.drive_lists) == len(fleet.hosts)
+    assert all(len(paths) == 8 for paths in deployed.drive_lists.values())
+
+
+def test_retries_a_step_thats_safe_to_repeat(fleet, monkeypatch):
+    failed = fail_once(fleet, monkeypatch, ["resources_generator.py"])
+    deployed = deployment(fleet)
+    assert deployed.run()
+    assert len(failed) == 1
+    retried = [step for step in steps(deployed.report(), "Resources generator") if step["attempts"] > 1]
+    assert len(retried) == 1 and retried[0]["outcome"] == "ok"
+
+
+@pytest.mark.parametrize("words", [["weka local setup", "--name compute0"], ["weka cluster create"], [ADD_DRIVES]])
+def test_doesnt_retry_steps_that_cant_be_repeated(fleet, monkeypatch, words):
+    failed = fail_once(fleet, monkeypatch, words)
+    deployed = deployment(fleet)
+    assert not deployed.run()
+    assert len(failed) == 1
+    report = deployed.report()
+    assert all(step["attempts"] == 1 for step in report["steps"])
+    assert report["phases"][-1]["failed"] == 1
+
+
+def test_no_retries(fleet, monkeypatch):
+    fail_once(fleet, monkeypatch, ["weka local stop"])
+    deployed = deployment(fleet, retries=0)
+    assert not deployed.run()
+    report = deployed.report()
+    assert [phase["phase"] for phase in report["phases"]] == ["prepare"]
+    assert len(report["phases"][0]["failed_hosts"]) == 1
+    assert [step["attempts"] for step in steps(report, "weka local stop") if step["outcome"] != "ok"] == [1]
+
+
+def test_write_report(fleet, tmp_path):
+    deployed = deployment(fleet)
+    assert deployed.run()
+    deployed.write_report(str(tmp_path / "report.json"))
+    with open(tmp_path / "report.json") as fp:
+        report = json.load(fp)
+    assert report["format"] == deploy.REPORT_FORMAT
+    assert len(report["steps"]) == len(deployed.steps)
@@ -0,0 +1,40 @@
+import json
+
+from wekapyutils.wekassh import CommandOutput
+
+from facts import FACTS_FORMAT, facts_command, ip_rules, parse_facts
+
+
+def facts_output(**facts):
+    document = {"format": FACTS_FORMAT, "addr": [], "link": [], "route": [], "rule": [], "lscpu": {}}
+    document.update(facts)
+    return CommandOutput(0, json.dumps(document) + "\n", "")
+
+
+def test_command_has_the_format():
+    assert '{"format": ' + str(FACTS_FORMAT) in facts_command()
+
+
+def test_parse_facts():
+    facts = parse_facts("host1", facts_output(lscpu={"Socket(s)": "2"}))
+    assert facts["lscpu"] == {"Socket(s)": "2"}
+
+
+def test_parse_facts_failures():
+    assert parse_facts("host1", CommandOutput(1, "", "no shell")) is None
+    assert parse_facts("host1", CommandOutput(0, "{not json", "")) is None
+    assert parse_facts("host1", CommandOutput(0, json.dumps({"format": FACTS_FORMAT + 1}), "")) is None
+
+
+def test_ip_rules_keeps_source_rules():
+    facts = parse_facts("host1", facts_output(rule=[
+        {"priority": 0, "src": "all", "table": "local"},
+        {"priority": 100, "src": "10.1.0.5", "table": "100"},
+        {"priority": 101, "src": "10.2.0.0", "srclen": 16, "table": "101"},
+        {"priority": 32766, "src": "all", "table": "main"}]))
+    assert ip_rules(facts) == {"100": ["from", "10.1.0.5", "lookup", "100"],
+                               "101": ["from", "10.2.0.0/16", "lookup", "101"]}
+
+
+def test_ip_rules_without_json():
+    assert ip_rules(parse_facts("host1", facts_output(rule=None))) is None
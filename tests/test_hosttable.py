@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+
+from hosttable import HostTable
+
+
+def host(cores=32, ram=384.5, drives=(3840,) * 4, nics=("ens1", "ens2"), hyperthread=True):
+    return SimpleNamespace(num_cores=cores, physical_cores=None if cores is None else cores // 2, threads_per_core=2,
+                           hyperthread=hyperthread, total_ramGB=ram,
+                           drives={f"nvme{n}": {"sizeBytes": size} for n, size in enumerate(drives)},
+                           nics={name: None for name in nics})
+
+
+def make_table():
+    return HostTable({"host1": host(), "host2": host(), "host3": host(cores=64, drives=(3840, 7680)),
+                      "host4": host(cores=None, ram=None, nics=("ens1",), hyperthread=False)})
+
+
+def test_get():
+    table = make_table()
+    assert len(table) == 4
+    assert table.get("num_cores", "host1") == 32
+    assert table.get("ram_gb", "host1") == 384
+    assert table.get("hyperthread", "host1") is True
+    assert table.get("hyperthread", "host4") is False
+    assert table.get("num_cores", "host4") is None
+    assert table.get("drive_sizes", "host3") == (3840, 7680)
+
+
+def test_group_by():
+    table = make_table()
+    assert list(table.group_by("num_cores").items()) == [(None, ["host4"]), (32, ["host1", "host2"]),
+                                                        (64, ["host3"])]
+    assert dict(table.group_by("num_cores", ["host1", "host3", "nohost"])) == {32: ["host1"], 64: ["host3"]}
+    assert dict(table.group_by("drive_sizes")) == {3840: ["host1", "host2", "host3", "host4"], 7680: ["host3"]}
+
+
+def test_distinct():
+    table = make_table()
+    assert table.distinct("num_cores") == 3
+    assert table.distinct("num_cores", ["host1", "host2"]) == 1
+    assert table.distinct("nic_names") == 2
+
+
+def test_min_max_skip_unknowns():
+    table = make_table()
+    assert table.min("num_cores") == 32
+    assert table.max("num_cores") == 64
+    assert table.min("num_drives", ["host3", "host4"]) == 2
+    assert table.min("num_cores", ["host4"]) is None
+
+
+def test_outliers():
+    table = make_table()
+    assert table.outliers("num_cores") == ["host3", "host4"]
+    assert table.outliers("num_cores", ["host1", "host2"]) == []
+    assert table.outliers("num_cores", []) == []
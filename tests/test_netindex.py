@@ -0,0 +1,78 @@
+from ipaddress import IPv4Network
+from types import SimpleNamespace
+
+from netindex import NetworkIndex
+
+NET_A = IPv4Network("10.0.0.0/16")
+NET_B = IPv4Network("10.1.0.0/16")
+NET_C = IPv4Network("10.2.0.0/16")
+
+
+def host(**nics):
+    return SimpleNamespace(nics={ifname: SimpleNamespace(network=network) for ifname, network in nics.items()})
+
+
+HOSTS = {
+    "host1": host(ens1=NET_A, ens2=NET_B),
+    "host2": host(ens1=NET_A, ens2=NET_B, ens3=NET_C),
+    "host3": host(ens1=NET_A),
+    "host4": host(ens1=NET_B, ens2=NET_B),
+}
+
+
+def make_index():
+    # host5 isn't usable (it's not in hosts), but the reference host can reach it
+    return NetworkIndex(HOSTS, HOSTS["host1"], {"ens1": {"host1", "host2", "host3", "host5"},
+                                                "ens2": {"host2", "host4"}})
+
+
+def test_bits_and_hostnames():
+    index = make_index()
+    assert index.names == ["host1", "host2", "host3", "host4", "host5"]
+    assert index.bits(["host1", "host3"]) == 0b101
+    assert index.bits(["host2", "nohost"]) == 0b10
+    assert index.hostnames(index.bits(["host4", "host1"])) == ["host1", "host4"]
+    assert index.hostnames(0) == []
+
+
+def test_bits_for_more_than_a_byte_of_hosts():
+    index = NetworkIndex({f"host{n:02}": host(ens1=NET_A) for n in range(20)})
+    assert index.hostnames(index.bits(["host00", "host09", "host19"])) == ["host00", "host09", "host19"]
+    assert index.hostnames(index.on_all([NET_A])) == index.names
+
+
+def test_on_all():
+    index = make_index()
+    assert index.hostnames(index.on_all([NET_A])) == ["host1", "host2", "host3"]
+    assert index.hostnames(index.on_all([NET_A, NET_B])) == ["host1", "host2"]
+    assert index.hostnames(index.on_all([NET_A, NET_B, NET_C])) == ["host2"]
+    assert index.on_all([IPv4Network("192.168.0.0/24")]) == 0
+
+
+def test_on_all_no_networks_is_everyone():
+    index = make_index()
+    assert index.hostnames(index.on_all([])) == index.names
+
+
+def test_on_all_within():
+    index = make_index()
+    assert index.hostnames(index.on_all([NET_A], within=["host2", "host3", "host4"])) == ["host2", "host3"]
+    assert index.on_all([NET_A], within=[]) == 0
+
+
+def test_interfaces():
+    index = make_index()
+    assert index.interfaces["host4"] == {NET_B: ["ens1", "ens2"]}
+
+
+def test_reachable():
+    index = make_index()
+    assert index.hostnames(index.reachable([NET_A])) == ["host1", "host2", "host3", "host5"]
+    assert index.hostnames(index.reachable([NET_B])) == ["host2", "host4"]
+    assert index.hostnames(index.reachable([NET_A, NET_B])) == index.names
+    assert index.reachable([NET_C]) == 0
+    assert index.reachable([]) == 0
+
+
+def test_reachable_without_reference_host():
+    assert NetworkIndex(HOSTS).reachable([NET_A]) == 0
@@ -0,0 +1,123 @@
+import io
+import os
+import subprocess
+
+import pytest
+
+import answers
+import benchmark
+from output import ADD_DRIVES, WekaCluster
+from simulator import Fleet
+
+STUBS = {
+    # log what would have been run; the drive lists and the container listing are made up
+    "ssh": '#!/bin/bash\necho "ssh $*" >> "$STUB_LOG"\n'
+           'if [[ "$*" == *"jq -r"* ]]; then echo /dev/nvme0n1; echo /dev/nvme1n1; fi\n',
+    "scp": '#!/bin/bash\necho "scp $*" >> "$STUB_LOG"\n',
+    "sudo": '#!/bin/bash\necho "sudo $*" >> "$STUB_LOG"\n'
+            'if [[ "$*" == *"cluster container -o"* ]]; then cat "$STUB_CONTAINERS"; fi\n',
+}
+
+
+def make_cluster(num_hosts=6, max_jobs=32, **fleet):
+    group = benchmark.build_hostgroup(Fleet(num_hosts, nics=1, **fleet))
+    benchmark.stage_analyze_networks(group)
+    benchmark.stage_host_table(group)
+    benchmark.stage_network_index(group)
+    config = answers.HeadlessConfig(group)
+    assert config.apply({"cluster_name": "test"})
+    return WekaCluster(config, max_jobs)
+
+
+def script(cluster):
+    buffer = io.StringIO()
+    buffer.close = lambda: None  # cluster_config closes what it's given
+    cluster.cluster_config(buffer)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def run_script(tmp_path):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name, contents in STUBS.items():
+        (bin_dir / name).write_text(contents)
+        (bin_dir / name).chmod(0o755)
+
+    def run(cluster, *args):
+        (tmp_path / "config.sh").write_text(script(cluster))
+        (tmp_path / "containers").write_text("".join(f"{host.host_id} {host.name} drives0\n"
+                                                     for host in cluster.plan.hosts))
+        log = tmp_path / "log"
+        log.write_text("")
+        env = dict(os.environ, PATH=f"{bin_dir}:{os.environ['PATH']}", STUB_LOG=str(log),
+                   STUB_CONTAINERS=str(tmp_path / "containers"))
+        result = subprocess.run(["bash", str(tmp_path / "config.sh")] + list(args), env=env, capture_output=True,
+                                text=True, timeout=60)
+        return result, log.read_text().splitlines()
+    return run
+
+
+def test_script_is_valid_bash(tmp_path):
+    (tmp_path / "config.sh").write_text(script(make_cluster(max_jobs=7)))
+    assert subprocess.run(["bash", "-n", str(tmp_path / "config.sh")]).returncode == 0
+    assert "MAX_JOBS=7" in (tmp_path / "config.sh").read_text()
+
+
+def test_one_function_per_host_in_each_phase():
+    cluster = make_cluster()
+    text = script(cluster)
+    for phase in ("prepare", "containers", "frontend"):
+        for host in cluster.plan.hosts:
+            assert text.count(f"{phase}_{host.host_id}() {{    # {host.name}") == 1
+            assert text.count(f"run_limited {phase}_{host.host_id}\n") == 1
+
+
+@pytest.mark.parametrize("args", [[], ["--jobs", "2"], ["--no-parallel"]])
+def test_script_runs_each_hosts_steps_in_order(run_script, args):
+    cluster = make_cluster()
+    result, log = run_script(cluster, *args)
+    assert result.returncode == 0, result.stderr
+    assert "Configuration process complete" in result.stdout
+
+    create = [n for n, line in enumerate(log) if "weka cluster create" in line]
+    assert len(create) == 1
+    for host in cluster.plan.hosts:
+        lines = [n for n, line in enumerate(log) if line.startswith(f"ssh {host.name} ") or
+                 line.startswith(f"scp -p ./resources_generator.py {host.name}:")]
+        steps = [log[n] for n in lines]
+        assert steps[0].startswith("scp")
+        assert "weka local stop" in steps[1]
+        assert "resources_generator.py" in steps[2]
+        assert "jq -r" in steps[3]
+        assert "--name drives0" in steps[4]
+        assert lines[4] < create[0] < lines[5]  # the cluster is created once every host is prepared
+        assert "--name compute0" in steps[5]
+        assert "--name frontend0" in steps[-1]
+    assert any("update --cluster-name=test" in line for line in log)
+
+
+def test_drives_are_added_from_the_lists_read_while_preparing(run_script):
+    cluster = make_cluster()
+    result, log = run_script(cluster, "--jobs", "2")
+    assert result.returncode == 0, result.stderr
+    assert sum(1 for line in log if "cluster container -o" in line) == 1  # one listing, not one per container
+    adds = sorted(line for line in log if ADD_DRIVES in line)
+    assert adds == sorted(f"sudo {ADD_DRIVES[len('sudo '):]} {host.host_id} /dev/nvme0n1 /dev/nvme1n1"
+                          for host in cluster.plan.hosts)
+
+
+def test_bad_jobs(run_script):
+    result, log = run_script(make_cluster(), "--jobs", "0")
+    assert result.returncode == 1 and log == []
+
+
+def test_single_container_script():
+    cluster = make_cluster(version="3.14.0")
+    assert not cluster.plan.multicontainer
+    lines = script(cluster).splitlines()
+    assert lines[0].startswith("weka cluster create ")
+    assert lines[-1] == "weka cluster host apply --all --force"
+    adds = [line for line in lines if line.startswith("weka cluster drive add")]
+    assert [line.split()[4] for line in adds] == [str(host.host_id) for host in cluster.plan.hosts]
+    assert all(line.count("/dev/nvme") == 8 for line in adds)
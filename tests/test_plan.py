@@ -0,0 +1,83 @@
+import pytest
+
+import answers
+import benchmark
+from plan import MAX_JOIN_HOSTS, build_plan, containers_for
+from simulator import Fleet
+
+
+def make_config(num_hosts, answer=None, **fleet):
+    group = benchmark.build_hostgroup(Fleet(num_hosts, seed=num_hosts, **fleet))
+    benchmark.stage_analyze_networks(group)
+    benchmark.stage_host_table(group)
+    benchmark.stage_network_index(group)
+    config = answers.HeadlessConfig(group)
+    assert config.apply(dict({"cluster_name": "test"}, **(answer or {})))
+    return config
+
+
+@pytest.mark.parametrize("cores,containers", [(0, 0), (1, 1), (19, 1), (20, 2), (38, 2), (39, 3)])
+def test_containers_for(cores, containers):
+    assert containers_for(cores) == containers
+
+
+def test_hosts_are_planned_in_name_order():
+    config = make_config(8, nics=2)
+    plan = build_plan(config)
+    assert [host.name for host in plan.hosts] == sorted(config.selected_hosts)
+    assert [host.host_id for host in plan.hosts] == list(range(8))
+    assert all(config.selected_hosts[host.name].host_id == host.host_id for host in plan.hosts)
+    assert plan.by_name[plan.hosts[3].name] is plan.hosts[3]
+    assert plan.cluster_name == "test"
+
+
+def test_host_interfaces():
+    config = make_config(6, nics=2)
+    plan = build_plan(config)
+    for host in plan.hosts:
+        assert len(host.interfaces) == 2
+        assert list(host.interfaces) == sorted(host.interfaces)
+        assert [spec.split("/")[1] for spec in host.nic_specs] == [nic.ip.exploded for nic in host.interfaces]
+        assert len(host.management_ips) == (2 if config.HighAvailability else 1)
+        assert host.drives == tuple(drive['devPath'] for name, drive in
+                                    sorted(config.selected_hosts[host.name].drives.items()))
+
+
+@pytest.mark.parametrize("num_hosts,join_hosts", [(6, 5), (7, 7), (8, 7), (20, MAX_JOIN_HOSTS)])
+def test_join_ips_are_from_an_odd_number_of_hosts(num_hosts, join_hosts):
+    plan = build_plan(make_config(num_hosts, nics=1))
+    assert plan.join_ips == tuple(ip for host in plan.hosts[:join_hosts] for ip in host.management_ips)
+
+
+def test_containers():
+    config = make_config(6, {"cores": {"drives": 24, "compute": 20}}, nics=1, drives=24, cores=64)
+    plan = build_plan(config)
+    assert (plan.drives_cores, plan.compute_cores) == (24, 20)
+    assert dict(plan.containers) == {"drives": 2, "compute": 2, "frontend": 1}
+    assert list(plan.containers) == ["drives", "compute", "frontend"]
+
+
+def test_data_drives_are_clamped():
+    config = make_config(24, nics=1)
+    config.datadrives = 20
+    assert build_plan(config).data_drives == 16
+
+
+def test_plans_are_immutable():
+    plan = build_plan(make_config(6, nics=1))
+    with pytest.raises(TypeError):
+        plan.containers["drives"] = 5
+    with pytest.raises(AttributeError):
+        plan.join_ips = ()
+
+
+@pytest.mark.parametrize("high_availability", [False, True])
+def test_management_ips_follow_the_interfaces(high_availability):
+    config = make_config(6, nics=3)
+    config.HighAvailability = high_availability
+    plan = build_plan(config)
+    for host in plan.hosts:
+        assert len(host.interfaces) == 3
+        ips = tuple(nic.ip.exploded for nic in host.interfaces)
+        assert host.management_ips == (ips if high_availability else ips[:1])
+    assert plan.join_ips == tuple(nic.ip.exploded for host in plan.hosts[:5] for nic in host.interfaces)
@@ -0,0 +1,88 @@
+import ipaddress
+
+from routes import PrefixTrie, RouteTable
+
+MAIN_ROUTES = [
+    {"dst": "default", "gateway": "10.0.0.1", "dev": "eth0", "metric": 100},
+    {"dst": "default", "gateway": "10.1.0.1", "dev": "ens1", "metric": 200},
+    {"dst": "10.0.0.0/16", "dev": "eth0", "prefsrc": "10.0.0.5"},
+    {"dst": "10.1.0.0/16", "dev": "ens1", "prefsrc": "10.1.0.5"},
+    {"dst": "172.16.0.0/12", "gateway": "10.1.0.254", "dev": "ens1"},
+    {"dst": "172.16.5.0/24", "gateway": "10.1.0.253", "dev": "ens1"},
+]
+
+
+def test_trie_matches_longest_prefix_first():
+    trie = PrefixTrie()
+    for prefix in ("0.0.0.0/0", "10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24"):
+        trie.insert(ipaddress.IPv4Network(prefix), prefix)
+    assert trie.matches(ipaddress.IPv4Address("10.1.2.3")) == [["10.1.2.0/24"], ["10.1.0.0/16"], ["10.0.0.0/8"],
+                                                               ["0.0.0.0/0"]]
+    assert trie.matches(ipaddress.IPv4Address("192.168.1.1")) == [["0.0.0.0/0"]]
+
+
+def test_directly_connected_has_no_gateway():
+    table = RouteTable(MAIN_ROUTES, None)
+    assert table.gateway("10.0.3.4", "eth0") is None
+    assert table.lookup("10.0.3.4", "eth0")["dst"] == "10.0.0.0/16"
+
+
+def test_longest_prefix_wins():
+    table = RouteTable(MAIN_ROUTES, None)
+    assert table.gateway("172.16.5.9", "ens1") == "10.1.0.253"
+    assert table.gateway("172.17.0.1", "ens1") == "10.1.0.254"
+
+
+def test_only_routes_out_of_oif():
+    table = RouteTable(MAIN_ROUTES, None)
+    # 10.0.0.0/16 is on eth0, so out of ens1 it goes the default way
+    assert table.gateway("10.0.3.4", "ens1") == "10.1.0.1"
+    assert table.gateway("8.8.8.8", "eth0") == "10.0.0.1"
+    assert table.lookup("8.8.8.8", "ib0") is None
+
+
+def test_lowest_metric_wins():
+    routes = [{"dst": "default", "gateway": "10.0.0.1", "dev": "eth0", "metric": 300},
+              {"dst": "default", "gateway": "10.0.0.2", "dev": "eth0", "metric": 50}]
+    assert RouteTable(routes, None).gateway("8.8.8.8", "eth0") == "10.0.0.2"
+
+
+def test_multipath_uses_the_oif_nexthop():
+    routes = [{"dst": "default", "metric": 10, "nexthops": [{"gateway": "10.0.0.1", "dev": "eth0"},
+                                                            {"gateway": "10.1.0.1", "dev": "ens1"}]}]
+    table = RouteTable(routes, None)
+    assert table.gateway("8.8.8.8", "ens1") == "10.1.0.1"
+    assert table.gateway("8.8.8.8", "eth0") == "10.0.0.1"
+
+
+def test_unreachable_means_no_route():
+    routes = MAIN_ROUTES + [{"dst": "192.168.0.0/16", "type": "unreachable"}]
+    table = RouteTable(routes, None)
+    assert table.lookup("192.168.1.1", "ens1") is None
+    assert table.gateway("192.168.1.1", "ens1") is None
+
+
+def test_source_rule_selects_table():
+    routes = MAIN_ROUTES + [{"dst": "default", "gateway": "10.1.0.99", "dev": "ens1", "table": "100"}]
+    rules = [{"priority": 0, "src": "all", "table": "local"},
+             {"priority": 100, "src": "10.1.0.5", "table": "100"},
+             {"priority": 32766, "src": "all", "table": "main"}]
+    table = RouteTable(routes, rules)
+    assert table.gateway("8.8.8.8", "ens1", "10.1.0.5") == "10.1.0.99"
+    assert table.gateway("8.8.8.8", "ens1", "10.1.0.6") == "10.1.0.1"
+    assert table.gateway("8.8.8.8", "ens1") == "10.1.0.1"  # without a source, source rules don't apply
+
+
+def test_throw_goes_on_to_the_next_rule():
+    routes = MAIN_ROUTES + [{"dst": "8.0.0.0/8", "type": "throw", "table": "100"},
+                            {"dst": "default", "gateway": "10.1.0.99", "dev": "ens1", "table": "100"}]
+    rules = [{"priority": 100, "src": "10.1.0.5", "table": "100"},
+             {"priority": 32766, "src": "all", "table": "main"}]
+    table = RouteTable(routes, rules)
+    assert table.gateway("8.8.8.8", "ens1", "10.1.0.5") == "10.1.0.1"
+    assert table.gateway("9.9.9.9", "ens1", "10.1.0.5") == "10.1.0.99"
+
+
+def test_ipv6_routes_are_ignored():
+    table = RouteTable([{"dst": "fe80::/64", "dev": "eth0"}] + MAIN_ROUTES, None)
+    assert table.gateway("8.8.8.8", "eth0") == "10.0.0.1"
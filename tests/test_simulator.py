@@ -0,0 +1,47 @@
+import json
+
+from facts import facts_command, parse_facts
+from routes import RouteTable
+from simulator import Fleet
+
+
+def test_fleets_are_the_same_for_a_seed():
+    rates = {"down_rate": 0.2, "unreachable_rate": 0.2, "bad_eth_rate": 0.2, "version_mismatch_rate": 0.2}
+    first, second = Fleet(50, seed=7, **rates), Fleet(50, seed=7, **rates)
+    assert [host.machine_info for host in first.hosts] == [host.machine_info for host in second.hosts]
+    assert [host.down for host in first.hosts] == [host.down for host in second.hosts]
+    assert [host.down for host in first.hosts] != [host.down for host in Fleet(50, seed=8, **rates).hosts]
+
+
+def test_beacons():
+    fleet = Fleet(300, nics=3)
+    beacons = fleet.beacons()
+    assert len(beacons) == 900
+    assert len(set(beacons.values())) == 300
+    assert beacons[fleet.reference_ip] == "simhost00000"
+
+
+def test_cpu_topology():
+    fleet = Fleet(1, sockets=2, cores=8, threads_per_core=2)
+    cores = fleet.hosts[0].machine_info["cores"]
+    assert len(cores) == 32
+    assert len({(core["socket"], core["core_id"]) for core in cores}) == 16
+    assert all(set(core) == {"model"} for core in Fleet(1, cpu_topology=False).hosts[0].machine_info["cores"])
+
+
+def test_pings_only_on_the_same_network():
+    fleet = Fleet(3, nics=2)
+    host = fleet.hosts[0]
+    assert fleet.run_command(host, f"ping -c1 -W1 -I ens1 {fleet.nic_ip(2, 1)}").status == 0
+    assert fleet.run_command(host, f"ping -c1 -W1 -I ens0 {fleet.nic_ip(2, 1)}").status == 1
+
+
+def test_facts_match_the_routes():
+    fleet = Fleet(2, nics=2)
+    host = fleet.hosts[1]
+    output = fleet.run_command(host, facts_command())
+    facts = parse_facts(host.name, output)
+    assert facts == json.loads(output.stdout)
+    table = RouteTable(facts["route"], facts["rule"])
+    assert table.gateway("8.8.8.8", "ens0") == fleet.gateway_ip(0)
+    assert table.gateway(fleet.nic_ip(0, 1), "ens1") is None
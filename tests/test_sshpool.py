@@ -0,0 +1,127 @@
+import threading
+
+import pytest
+from paramiko.ssh_exception import ChannelException
+from wekapyutils.wekassh import CommandOutput
+
+import sshpool
+from sshpool import TIMED_OUT, SSHPool
+from timeouts import AdaptiveTimeouts
+
+
+class FakeServer(object):
+    """
+    stands in for a TimedRemoteServer
+    """
+    refuse = set()  # hostnames that don't let us in
+    channel_failures = 0  # commands that fail to get a channel before one works
+
+    def __init__(self, hostname):
+        self.hostname = hostname
+        self.connected = False
+        self.commands = list()
+
+    def connect(self):
+        self.connected = self.hostname not in FakeServer.refuse
+
+    def run(self, command, timeout=None):
+        if not self.connected:
+            return None  # like RemoteServer.run()
+        if FakeServer.channel_failures > 0:
+            FakeServer.channel_failures -= 1
+            try:
+                raise ChannelException(1, "Administratively prohibited")
+            except ChannelException:
+                raise AttributeError("'ChannelException' object has no attribute 'result'")
+        self.commands.append(command)
+        if command == "sleep":
+            return CommandOutput(TIMED_OUT, "", f"timed out after {timeout}s")
+        return CommandOutput(0, f"{self.hostname}: {command}\n", "")
+
+    def put(self, local, remote):
+        if not self.connected:
+            return None
+        return CommandOutput(0, "", "")
+
+    def close(self):
+        self.connected = False
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(sshpool, "default_timeouts", AdaptiveTimeouts())
+    monkeypatch.setattr(sshpool.time, "sleep", lambda seconds: None)
+    monkeypatch.setattr(FakeServer, "refuse", set())
+    monkeypatch.setattr(FakeServer, "channel_failures", 0)
+    pool = SSHPool(max_sessions=2)
+    pool.server_factory = FakeServer
+    return pool
+
+
+def test_one_handshake_per_host(pool):
+    threads = [threading.Thread(target=pool.run, args=(f"host{n % 3}", "true")) for n in range(30)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = pool.stats()
+    assert (stats["handshakes"], stats["connections"], stats["commands"]) == (3, 3, 30)
+    assert stats["reuse_ratio"] == 0.9
+    assert sum(len(server.commands) for server in pool.servers.values()) == 30
+
+
+def test_connect_failure(pool):
+    FakeServer.refuse.add("host1")
+    output = pool.run("host1", "true")
+    assert output.status == 255
+    assert pool.put("host1", "a", "b").status == 255
+    assert pool.stats()["failed_handshakes"] == 2
+    assert "host1" not in pool.servers
+
+
+def test_reconnects_a_dead_session(pool):
+    assert pool.run("host1", "true").status == 0
+    pool.servers["host1"].connected = False  # another thread found it dead
+    assert pool.run("host1", "true").status == 0
+    pool.servers["host1"].connected = False
+    assert pool.put("host1", "a", "b").status == 0
+    assert pool.stats()["handshakes"] == 3
+
+
+def test_lost_session_that_cant_be_reopened(pool, monkeypatch):
+    assert pool.run("host1", "true").status == 0
+    server = pool.servers["host1"]
+
+    def dies(command, timeout=None):
+        server.connected = False  # the session dropped while we were using it, and the host won't let us back in
+        FakeServer.refuse.add("host1")
+
+    monkeypatch.setattr(server, "run", dies)
+    output = pool.run("host1", "true")
+    assert output.status == 255 and "unable to reconnect" in output.stderr
+
+
+def test_retries_when_a_channel_is_refused(pool):
+    FakeServer.channel_failures = 2
+    assert pool.run("host1", "true").status == 0
+    FakeServer.channel_failures = sshpool.CHANNEL_RETRIES
+    assert pool.run("host1", "true").status == 255
+
+
+def test_timeouts(pool):
+    assert pool.run("host1", "sleep", timeout=5).status == TIMED_OUT
+    assert sshpool.default_timeouts.timeouts == 1
+
+
+def test_alias(pool):
+    pool.run("host1", "true")
+    pool.alias("10.0.0.1", "host1")
+    assert pool.run("10.0.0.1", "true").stdout == "host1: true\n"
+    assert pool.stats()["handshakes"] == 1
+
+
+def test_close_all(pool):
+    pool.run("host1", "true")
+    server = pool.servers["host1"]
+    pool.close_all()
+    assert not server.connected and pool.servers == {}
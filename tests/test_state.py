@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from simulator import Fleet
+from sshpool import default_pool
+from state import STATE_FORMAT, load_state
+from weka import scan_hosts
+
+PORT = 14791
+
+
+@pytest.fixture
+def fleet(monkeypatch):
+    fleet = Fleet(8, nics=2, seed=5)
+    queries = list()
+    api_call = fleet.api_call
+
+    def counted(host, method):
+        if method == "machine_query_info":
+            queries.append(host.name)
+        return api_call(host, method)
+
+    monkeypatch.setattr(fleet, "api_call", counted)
+    fleet.queries = queries
+    fleet.start(PORT)
+    fleet.install()
+    yield fleet
+    fleet.stop()
+    default_pool.close_all()
+
+
+def scan(fleet, state_file=None, previous=None, rescan=None):
+    return scan_hosts([fleet.reference_ip], PORT, True, state_file=state_file, previous=previous, rescan=rescan)
+
+
+def summary(group):
+    return {hostname: ([str(nic) for nic in host.nics.values()], host.threads_per_core, len(host.drives))
+            for hostname, host in group.usable_hosts.items()}
+
+
+def test_rescan_only_queries_the_rescanned_hosts(fleet, tmp_path):
+    state_file = str(tmp_path / "state.json")
+    first = scan(fleet, state_file)
+    assert len(first.usable_hosts) == 8
+
+    previous = load_state(state_file)
+    assert sorted(previous["hosts"]) == sorted(first.usable_hosts)
+    del fleet.queries[:]
+    second = scan(fleet, previous=previous, rescan=["simhost00003"])
+    assert sorted(set(fleet.queries)) == ["simhost00000", "simhost00003"]  # the reference host is always queried
+    assert summary(second) == summary(first)
+    assert {iface: set(hosts) for iface, hosts in second.accessible_hosts.items()} == \
+        {iface: set(hosts) for iface, hosts in first.accessible_hosts.items()}
+
+
+def test_no_state_file_means_no_state(fleet, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    scan(fleet)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_load_state_failures(tmp_path):
+    assert load_state(str(tmp_path / "missing.json")) is None
+    (tmp_path / "bad.json").write_text("{not json")
+    assert load_state(str(tmp_path / "bad.json")) is None
+    (tmp_path / "old.json").write_text(json.dumps({"format": STATE_FORMAT + 1}))
+    assert load_state(str(tmp_path / "old.json")) is None
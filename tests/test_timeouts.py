@@ -0,0 +1,69 @@
+from ipaddress import IPv4Network
+
+from timeouts import MAX_SAMPLES, MIN_SAMPLES, MULTIPLIER, TIMEOUT_BOUNDS, AdaptiveTimeouts
+
+SUBNET = IPv4Network("10.0.0.0/16")
+
+
+def observed(kind, samples, **where):
+    timeouts = AdaptiveTimeouts()
+    for seconds in samples:
+        timeouts.observe(kind, seconds, **where)
+    return timeouts
+
+
+def test_default_until_enough_samples():
+    timeouts = observed("ssh", [60.0] * (MIN_SAMPLES - 1))
+    assert timeouts.get("ssh") == TIMEOUT_BOUNDS["ssh"][0]
+    timeouts.observe("ssh", 60.0)
+    assert timeouts.get("ssh") == 60.0 * MULTIPLIER
+
+
+def test_multiple_of_the_95th_percentile():
+    # one slow outlier in 100 doesn't move the timeout
+    timeouts = observed("ssh", [10.0] * 99 + [500.0])
+    assert timeouts.get("ssh") == 10.0 * MULTIPLIER
+
+
+def test_clamped_to_the_bounds():
+    default, minimum, maximum = TIMEOUT_BOUNDS["ssh"]
+    assert observed("ssh", [0.01] * MIN_SAMPLES).get("ssh") == minimum
+    assert observed("ssh", [1000.0] * MIN_SAMPLES).get("ssh") == maximum
+
+
+def test_host_then_subnet_then_everything():
+    timeouts = observed("api", [2.0] * 200, subnet=SUBNET)
+    for seconds in [3.0] * MIN_SAMPLES:
+        timeouts.observe("api", seconds, host="host1", subnet=SUBNET)
+    assert timeouts.get("api", "host1", SUBNET) == 3.0 * MULTIPLIER
+    assert timeouts.get("api", "host2", SUBNET) == 2.0 * MULTIPLIER
+    timeouts.observe("api", 4.0, subnet=IPv4Network("10.1.0.0/16"))  # not enough to go by
+    assert timeouts.get("api", "host2", IPv4Network("10.1.0.0/16")) == 2.0 * MULTIPLIER  # everything of this kind
+    assert timeouts.get("ssh", "host1", SUBNET) == TIMEOUT_BOUNDS["ssh"][0]
+
+
+def test_only_recent_samples_are_kept():
+    timeouts = observed("ssh", [100.0] * MAX_SAMPLES + [10.0] * MAX_SAMPLES)
+    assert timeouts.get("ssh") == 10.0 * MULTIPLIER
+
+
+def test_timeouts_are_samples():
+    timeouts = AdaptiveTimeouts()
+    for attempt in range(MIN_SAMPLES):
+        timeouts.timed_out("api", 6.0, "host1")
+    assert timeouts.timeouts == MIN_SAMPLES
+    assert timeouts.get("api", "host1") == 6.0 * MULTIPLIER
+
+
+def test_fixed_kinds_use_the_default():
+    timeouts = observed("ping", [2.0] * MIN_SAMPLES)
+    timeouts.fix("ping")
+    assert timeouts.get("ping") == TIMEOUT_BOUNDS["ping"][0]
+
+
+def test_fast_logins_dont_shorten_machine_info():
+    timeouts = observed("api", [0.01] * 100, subnet=SUBNET)
+    for seconds in [0.2] * 100:
+        timeouts.observe("machine_info", seconds, subnet=SUBNET)
+    assert timeouts.get("api", subnet=SUBNET) == TIMEOUT_BOUNDS["api"][1]
+    assert timeouts.get("machine_info", subnet=SUBNET) >= 5.0
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from timing import TimingRecorder, percentile, percentiles
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(reversed(values), 100) == 100
+    assert percentile([7], 95) == 7
+
+
+def test_percentiles():
+    assert percentiles([]) == {"count": 0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+    assert percentiles([3, 1, 2]) == {"count": 3, "p50": 2, "p95": 3, "max": 3}
+
+
+def test_spans_are_reported_by_stage_and_host():
+    recorder = TimingRecorder()
+    with recorder.span("ssh", "host1") as timer:
+        timer.outcome = "rejected"
+    with recorder.span("ssh", "host2"):
+        with recorder.span("facts", "host2"):
+            recorder.current().retries += 1
+    with pytest.raises(ValueError):
+        with recorder.span("facts", "host1"):
+            raise ValueError()
+
+    report = recorder.report()
+    assert report["stages"]["ssh"]["count"] == 2
+    assert report["stages"]["ssh"]["outcomes"] == {"rejected": 1, "ok": 1}
+    assert report["stages"]["facts"]["retries"] == 1
+    assert report["stages"]["facts"]["outcomes"] == {"ok": 1, "error": 1}
+    assert {host["host"] for host in report["slowest_hosts"]} == {"host1", "host2"}
+
+
+def test_trace_is_one_complete_event_per_span():
+    recorder = TimingRecorder()
+    with recorder.span("discovery"):
+        with recorder.span("ssh", "host1"):
+            pass
+    events = [event for event in recorder.trace()["traceEvents"] if event["ph"] == "X"]
+    assert [event["name"] for event in events] == ["discovery", "ssh host1"]
+    json.dumps(recorder.trace())  # it has to be writable
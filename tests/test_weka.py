@@ -0,0 +1,57 @@
+import pytest
+
+import benchmark
+from simulator import Fleet
+from sshpool import default_pool
+from weka import STEMHost, parallel_hosts
+
+
+@pytest.fixture
+def group():
+    # machine info without cpu topology, and no facts, so discovery has to ssh to the hosts for lscpu and ip rules
+    fleet = Fleet(4, nics=2, cpu_topology=False)
+    fleet.install()
+    try:
+        group = benchmark.build_hostgroup(fleet)
+        benchmark.stage_analyze_networks(group)
+        yield group
+    finally:
+        fleet.uninstall()
+        default_pool.close_all()
+
+
+def test_hosts_are_slotted(group):
+    with pytest.raises(AttributeError):
+        group.reference_host.not_a_slot = True
+
+
+def test_lscpu_on_all_hosts(group):
+    hosts = list(group.usable_hosts.values())
+    parallel_hosts(hosts, STEMHost.lscpu)
+    assert all(host.lscpu_data["Thread(s) per core"] == "2" for host in hosts)
+
+
+def test_source_routing_on_all_hosts(group):
+    hosts = list(group.usable_hosts.values())
+    parallel_hosts(hosts, STEMHost.check_source_routing)
+    assert all(host.ip_rules == {} for host in hosts)
+
+
+def test_hardware_info_falls_back_to_lscpu(group):
+    assert all(host.threads_per_core is None for host in group.usable_hosts.values())
+    group.get_hardware_info()
+    assert all(host.threads_per_core == 2 and host.hyperthread for host in group.usable_hosts.values())
+
+
+def test_release_and_uuid_checks():
+    fleet = Fleet(6)
+    fleet.hosts[2].machine_info["version"] = "3.14.0"
+    fleet.hosts[4].machine_info["osinfo"]["sys_vendor_info"]["product_uuid"] = \
+        fleet.hosts[3].machine_info["osinfo"]["sys_vendor_info"]["product_uuid"]
+    group = benchmark.build_hostgroup(fleet)
+    group.uuids = dict()
+    hosts = list(group.candidates.values())
+    assert [group.check_machine_info(host) for host in hosts] == [True, True, False, True, False, True]
+    assert sorted(group.rejected_hosts) == ["simhost00002", "simhost00004"]
+    assert group.rejected_hosts["simhost00002"] == ["Host is running 3.14.0 - not compatible with 4.2.1"]
+    assert "simhost00004" not in group.candidates
@@ -0,0 +1,104 @@
+################################################################################################
+# Adaptive timeouts
+################################################################################################
+# Rather than one fixed timeout for every host, learn how long API calls, ssh commands and pings actually take as
+# discovery runs - per host and per subnet - and time out at a multiple of what we've seen, within bounds.  A fast
+# LAN doesn't wait seconds on a dead ip, and a slow WAN-attached lab isn't rejected for being slow.
+import threading
+from collections import deque
+from logging import getLogger
+
+from timing import percentile
+
+log = getLogger(__name__)
+
+# {kind: (default until we have enough samples, minimum, maximum)} in seconds
+TIMEOUT_BOUNDS = {
+    "api": (5.0, 2.0, 30.0),  # WekaApi logins
+    "machine_info": (5.0, 5.0, 60.0),  # machine_query_info - a much bigger response than a login, so never less
+    "ssh": (120.0, 30.0, 600.0),  # one command on a host
+    "ping": (1.0, 1.0, 10.0),  # ping -W
+}
+PERCENTILE = 95  # time out at MULTIPLIER times this percentile of what we've seen...
+MULTIPLIER = 4
+MIN_SAMPLES = 5  # ...once we've seen at least this many
+MAX_SAMPLES = 256  # the most recent samples we keep for each host/subnet
+
+
+class AdaptiveTimeouts(object):
+    def __init__(self, bounds=None):
+        """
+        :param bounds: dict like TIMEOUT_BOUNDS
+        """
+        self.bounds = dict(TIMEOUT_BOUNDS if bounds is None else bounds)
+        self.samples = dict()  # {(kind, scope, key): deque of seconds} - scope is "host", "subnet" or "all"
+        self.timeouts = 0  # how many operations timed out
+        self.fixed = set()  # kinds that always get their default (see fix())
+        self._lock = threading.Lock()
+
+    def observe(self, kind, seconds, host=None, subnet=None):
+        """
+        note how long something took
+
+        :param kind: "api", "machine_info", "ssh" or "ping"
+        :param host: the hostname it was for, if any
+        :param subnet: the network it went over (ipaddress.IPv4Network), if known
+        """
+        with self._lock:
+            for scope, key in (("host", host), ("subnet", subnet), ("all", None)):
+                if scope != "all" and key is None:
+                    continue
+                self.samples.setdefault((kind, scope, key), deque(maxlen=MAX_SAMPLES)).append(seconds)
+
+    def timed_out(self, kind, seconds, host=None, subnet=None):
+        """
+        note that something timed out after seconds - it counts as a sample, so a slow host's timeout grows
+        """
+        log.debug(f"{kind} to {host or subnet} timed out after {round(seconds, 3)}s")
+        with self._lock:
+            self.timeouts += 1
+        self.observe(kind, seconds, host, subnet)
+
+    def fix(self, kind):
+        """
+        always use the default timeout for kind - ie: while recording or replaying a bundle, where the ping timeout
+        is part of the recorded command, so it has to be the same every run
+        """
+        self.fixed.add(kind)
+
+    def get(self, kind, host=None, subnet=None):
+        """
+        :return: the timeout in seconds - from what we've seen of this host if we've seen enough, otherwise this
+                 subnet, otherwise everything of this kind; the default if we haven't seen enough of anything
+        """
+        default, minimum, maximum = self.bounds[kind]
+        if kind in self.fixed:
+            return default
+        with self._lock:
+            for scope, key in (("host", host), ("subnet", subnet), ("all", None)):
+                if scope != "all" and key is None:
+                    continue
+                samples = self.samples.get((kind, scope, key))
+                if samples is not None and len(samples) >= MIN_SAMPLES:
+                    return min(maximum, max(minimum, percentile(samples, PERCENTILE) * MULTIPLIER))
+        return default
+
+    def report(self):
+        """
+        log what we've learned, so the bounds can be tuned
+        """
+        with self._lock:
+            learned = sorted(self.samples.items(), key=lambda item: (item[0][0], item[0][1], str(item[0][2])))
+        for (kind, scope, key), samples in learned:
+            if scope == "all":
+                log.info(f"{kind} timeout {round(self.get(kind), 3)}s: {len(samples)} samples, " +
+                         f"p50 {round(percentile(samples, 50) * 1000, 1)}ms, " +
+                         f"p{PERCENTILE} {round(percentile(samples, PERCENTILE) * 1000, 1)}ms")
+            else:
+                timeout = self.get(kind, **{scope: key})
+                log.debug(f"{kind} timeout for {scope} {key}: {round(timeout, 3)}s ({len(samples)} samples)")
+        if self.timeouts > 0:
+            log.info(f"{self.timeouts} operations timed out")
+
+
+default_timeouts = AdaptiveTimeouts()
@@ -0,0 +1,210 @@
+################################################################################################
+# Timing spans
+################################################################################################
+# Records how long each discovery stage takes, overall and for each host, so we can see where the time goes
+# on a big fleet (--timing-report), and when (--trace, in Chrome Trace Event Format for chrome://tracing or Perfetto)
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from logging import getLogger
+
+log = getLogger(__name__)
+
+REPORT_FORMAT = 1
+DEFAULT_TOP_HOSTS = 10
+
+
+class Span(object):
+    def __init__(self, stage, host=None):
+        """
+        :param stage: what we're timing, ie: "open_api"
+        :param host: the host it's for, or None for a whole-group stage
+        """
+        self.stage = stage
+        self.host = host
+        self.thread = threading.current_thread().name
+        self.start = time.time()
+        self.end = None
+        self.outcome = "ok"
+        self.retries = 0
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.time()) - self.start
+
+
+class TimingRecorder(object):
+    def __init__(self):
+        self.spans = list()
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._local = threading.local()  # each thread's stack of open spans
+
+    @contextmanager
+    def span(self, stage, host=None):
+        """
+        time a block of code:
+            with default_recorder.span("ssh", hostname) as timer:
+                ...
+                timer.outcome = "rejected"
+        exceptions are recorded as outcome "error" and passed on
+        """
+        new_span = Span(stage, host)
+        stack = self._stack()
+        stack.append(new_span)
+        try:
+            yield new_span
+        except Exception:
+            new_span.outcome = "error"
+            raise
+        finally:
+            new_span.end = time.time()
+            stack.pop()
+            with self._lock:
+                self.spans.append(new_span)
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = list()
+        return self._local.stack
+
+    def current(self):
+        """
+        :return: the innermost span open in this thread, so code further down can note retries and outcomes.
+                 If there isn't one, a throwaway Span
+        """
+        stack = self._stack()
+        return stack[-1] if len(stack) > 0 else Span(None)
+
+    def report(self, top=DEFAULT_TOP_HOSTS):
+        """
+        :param top: how many of the slowest hosts to list
+        :return: dict of per-stage totals, per-host percentiles for each stage, and the slowest hosts
+        """
+        with self._lock:
+            spans = list(self.spans)
+
+        stages = dict()
+        host_stage_times = dict()  # {stage: {host: seconds}}
+        host_totals = dict()  # {host: {stage: seconds}}
+        for span in spans:
+            stage = stages.setdefault(span.stage, {"count": 0, "total": 0.0, "max": 0.0, "retries": 0,
+                                                   "first_start": span.start, "last_end": span.end,
+                                                   "outcomes": dict()})
+            stage["count"] += 1
+            stage["total"] += span.duration
+            stage["max"] = max(stage["max"], span.duration)
+            stage["retries"] += span.retries
+            stage["first_start"] = min(stage["first_start"], span.start)
+            stage["last_end"] = max(stage["last_end"], span.end)
+            stage["outcomes"][span.outcome] = stage["outcomes"].get(span.outcome, 0) + 1
+            if span.host is not None:
+                by_host = host_stage_times.setdefault(span.stage, dict())
+                by_host[span.host] = by_host.get(span.host, 0.0) + span.duration
+                by_stage = host_totals.setdefault(span.host, dict())
+                by_stage[span.stage] = by_stage.get(span.stage, 0.0) + span.duration
+
+        for stage in stages.values():
+            stage["wall"] = round(stage.pop("last_end") - stage.pop("first_start"), 3)
+            stage["total"] = round(stage["total"], 3)
+            stage["max"] = round(stage["max"], 3)
+
+        per_host = {stage: percentiles(times.values()) for stage, times in host_stage_times.items()}
+        per_host["all"] = percentiles([sum(times.values()) for times in host_totals.values()])
+
+        slowest = sorted(host_totals.items(), key=lambda item: sum(item[1].values()), reverse=True)[:top]
+        return {
+            "format": REPORT_FORMAT,
+            "elapsed": round(time.time() - self.started, 3),
+            "stages": stages,
+            "per_host": per_host,
+            "slowest_hosts": [{"host": host,
+                               "total": round(sum(times.values()), 3),
+                               "stages": {stage: round(seconds, 3) for stage, seconds in times.items()}}
+                              for host, times in slowest],
+        }
+
+    def write_report(self, filename, top=DEFAULT_TOP_HOSTS):
+        try:
+            with open(filename, "w") as fp:
+                json.dump(self.report(top), fp, indent=2)
+        except OSError as exc:
+            log.error(f"Unable to write timing report to {filename}: {exc}")
+            return
+        log.info(f"Timing report written to {filename}")
+
+    def trace(self):
+        """
+        :return: the spans as a Chrome Trace Event Format document - one complete ("X") event per span, on a track
+                 for the thread that ran it
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+
+        events = list()
+        tids = dict()  # {thread name: small int} - viewers sort tracks by tid.  Idents get reused; names don't
+        for span in spans:
+            if span.thread not in tids:
+                tids[span.thread] = len(tids)
+                events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tids[span.thread],
+                               "args": {"name": span.thread}})
+            args = {"outcome": span.outcome, "retries": span.retries}
+            if span.host is not None:
+                args["host"] = span.host
+            events.append({
+                "name": span.stage if span.host is None else f"{span.stage} {span.host}",
+                "cat": span.stage,
+                "ph": "X",
+                "ts": round((span.start - self.started) * 1000000),
+                "dur": round(span.duration * 1000000),
+                "pid": 1,
+                "tid": tids[span.thread],
+                "args": args})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_trace(self, filename):
+        try:
+            with open(filename, "w") as fp:
+                json.dump(self.trace(), fp)
+        except OSError as exc:
+            log.error(f"Unable to write trace to {filename}: {exc}")
+            return
+        log.info(f"Trace written to {filename}")
+
+
+def percentile(values, pct):
+    """
+    :param values: numbers (not empty)
+    :return: the pct'th percentile (nearest-rank)
+    """
+    ordered = sorted(values)
+    return ordered[max(0, -(-len(ordered) * pct // 100) - 1)]
+
+
+def percentiles(values):
+    """
+    :return: dict of count, p50, p95 and max of values (nearest-rank)
+    """
+    values = sorted(values)
+    if len(values) == 0:
+        return {"count": 0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+    return {"count": len(values), "p50": round(percentile(values, 50), 3), "p95": round(percentile(values, 95), 3),
+            "max": round(values[-1], 3)}
+
+
+default_recorder = TimingRecorder()
+
+
+def timed(stage):
+    """
+    decorator for STEMHost methods - times each call as a span for the host
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with default_recorder.span(stage, self.name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
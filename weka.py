@@ -3,22 +3,74 @@
 ################################################################################################
 import curses
 import ipaddress
+import json
+import math
+import re
+import shutil
 import socket
+import subprocess
 import sys
+import threading
+import time
+import zlib
+from array import array
 from logging import getLogger
 
 import wekalib.exceptions
 from sortedcontainers import SortedDict
 
 from wekalib import signal_handling
-from wekalib.exceptions import LoginError, CommunicationError, NewConnectionError
+from wekalib.exceptions import LoginError, CommunicationError
 from wekalib.wekaapi import WekaApi
 from wekapyutils.sthreads import default_threader
-from wekapyutils.wekassh import RemoteServer, parallel, threaded_method
+from wekapyutils.wekassh import CommandOutput, threaded_method
+
+from apiracer import default_racer
+from bundle import default_bundle
+from facts import facts_command, parse_facts, ip_rules
+from hosttable import HostTable
+from netindex import NetworkIndex
+from routes import RouteTable
+from sshpool import default_pool, TIMED_OUT
+from state import save_state
+from timeouts import default_timeouts
+from timing import default_recorder, timed
 
 log = getLogger(__name__)
 summary_log = getLogger("summary")
 
+# the maximum number of hosts in each discovery stage at any one time.  Hosts move through the stages on their own,
+# so these only bound the load on the far end.  Commands on any one host are limited by the ssh pool
+STAGE_LIMITS = {
+    "open_api": 32,
+    "machine_info": 16,
+    "ssh": 16,  # ssh handshakes from this host
+    "facts": 32,  # one command per host (see facts.py)
+    "reachability": 32,  # pings run via the reference host's ssh connection
+    "gateways": 32,
+    "mesh": 32,  # full-mesh probing - each host pings its peers over its own ssh connection
+}
+
+# the parts of machine_info we keep for each drive, interface and eth
+DRIVE_KEYS = ("devName", "devPath", "sizeBytes")
+INTERFACE_KEYS = ("name", "bondType", "linkLayer", "mtu", "ip4", "ip4Netmask", "name_slaves")
+ETH_KEYS = ("interface_alias", "ethName", "validationCode", "linkDetected", "speedMbps")
+
+# names a core's topology might have in machine_query_info.  These aren't confirmed against every release; if a
+# host's cores have none of them (or they don't add up), its topology comes from lscpu instead
+CORE_ID_KEYS = ("core_id", "coreId", "core id")
+CORE_SOCKET_KEYS = ("socket", "physical_id", "physicalId", "physical id")
+CORE_NUMA_KEYS = ("numa", "numa_node", "numaNode")
+
+# threads for the other parallel steps - the ssh pool keeps each host under its MaxSessions
+DEFAULT_THREADS = 32
+
+# batched ping sweeps: how many target ips go in one remote invocation (keeps the command line well under
+# ARG_MAX), and how many pings each invocation runs at once on the far side
+SWEEP_CHUNK_SIZE = 1024
+SWEEP_PARALLEL = 64
+
+PING_RTT = re.compile(r"time=([0-9.]+) ms")
 
 
 def shutdown_curses(opaque):
@@ -42,6 +94,18 @@ def get_local_ips():
     import netifaces
     return [netifaces.ifaddresses(iface)[netifaces.AF_INET][0]['addr'] for iface in netifaces.interfaces() if netifaces.AF_INET in netifaces.ifaddresses(iface)]
 
+def parallel_hosts(hosts, method, *args):
+    """
+    run method on each of hosts in its own thread, and wait for them all.  wekassh.parallel() can't be used on
+    STEMHosts - it sets an attribute on every object it's given, and STEMHosts are slotted
+
+    :param hosts: list of STEMHosts
+    :param method: STEMHost method to run
+    """
+    for host_obj in hosts:
+        threaded_method(host_obj, method, *args)
+    default_threader.run()
+
 def connect(ssh_session):
     try:
         ssh_session.connect()
@@ -60,60 +124,128 @@ class WekaInterface(ipaddress.IPv4Interface):
 
 class STEMHost(object):
     # uses ONLY the API...
+    # fleets can be thousands of hosts, so only keep what the configurator uses.  Once machine_info has been parsed,
+    # the raw JSON is only kept compressed (for the cache and the discovery state) unless keep_raw is set
+    __slots__ = ("name", "port", "host_api", "api_subnet", "_machine_info", "_packed_info", "ssh_client",
+                 "hyperthread", "threads_per_core", "lscpu_data", "ip_rules", "facts", "routes", "drives", "nics",
+                 "interfaces", "eths", "cpu_model", "num_cores", "physical_cores", "sockets", "core_numa",
+                 "dataplane_nics", "total_ramGB", "version", "is_reference", "is_local", "product_uuid", "beacon_ips",
+                 "from_cache", "host_id", "this_hosts_ifs")
+    keep_raw = False  # keep machine_info and the facts as they came (--keep-raw, for debugging)
+
     def __init__(self, name, port=14000):
         self.name = name
         self.port = port
         self.host_api = None
-        self.machine_info = None
+        self.api_subnet = None  # the network the API was opened on (see apiracer.py)
+        self._machine_info = None
+        self._packed_info = None  # zlib-compressed machine_info JSON, once it's been parsed
         self.ssh_client = None
         self.hyperthread = None
+        self.threads_per_core = None
         self.lscpu_data = None
+        self.ip_rules = None
+        self.facts = None  # see facts.py
+        self.routes = None  # RouteTable, from the facts
         self.drives = SortedDict()
-        self.drive_devs = SortedDict()
         self.nics = SortedDict()
+        self.interfaces = ()  # the parts of machine_info['net']['interfaces'] we use
+        self.eths = dict()  # {interface alias or eth name: the parts of its machine_info['eths'] entry we use}
         self.cpu_model = None
-        self.num_cores = None
-        self.dataplane_nics = SortedDict()
+        self.num_cores = None  # logical cpus
+        self.physical_cores = None
+        self.sockets = None
+        self.core_numa = array('h')  # numa node of each cpu, by cpu index
+        self.dataplane_nics = dict()
         self.total_ramGB = None
         self.version = None
         self.is_reference = False
         self.is_local = False
         self.product_uuid = None
+        self.beacon_ips = None  # the ips we found the host on
+        self.from_cache = False  # machine_info came from the MachineInfoCache
+        self.host_id = None  # set by WekaCluster
+        self.this_hosts_ifs = None
+
+    @property
+    def machine_info(self):
+        """
+        what machine_query_info returned, or None if we don't have it
+        """
+        if self._machine_info is None and self._packed_info is not None:
+            return json.loads(zlib.decompress(self._packed_info))
+        return self._machine_info
+
+    @machine_info.setter
+    def machine_info(self, machine_info):
+        self._machine_info = machine_info
+        self._packed_info = None
 
     def __str__(self):
         return self.name
 
+    @timed("machine_info")
     def get_machine_info(self):
         """
         get the info_hw output from the API
         """
+        start = time.time()
         try:
             self.machine_info = self.host_api.weka_api_command("machine_query_info", parms={})
+        except wekalib.exceptions.TimeoutError:
+            log.info(f"host {self.name} timed out querying info")
+            default_timeouts.timed_out("machine_info", time.time() - start, self.name, self.api_subnet)
+            default_recorder.current().outcome = "failed"
+            return
         except LoginError:
             log.info(f"host {self.name} failed login querying info")
+            default_recorder.current().outcome = "failed"
             return
         except CommunicationError:
             log.info(f"Error communicating with host {self.name} querying info")
+            default_recorder.current().outcome = "failed"
             return
         except wekalib.exceptions.STEMModeError:
             log.info(f"host {self.name} is not in STEM mode")
+            default_recorder.current().outcome = "failed"
             return
+        default_timeouts.observe("machine_info", time.time() - start, self.name, self.api_subnet)
+        self.parse_summary()  # the rest is parsed if it's a host we want (see WekaHostGroup.check_machine_info)
 
+    def parse_machine_info(self):
+        """
+        take some of the info and put it in our object for easy reference
+        """
+        self.parse_summary()
+        self.parse_details()
 
-        # take some of the info and put it in our object for easy reference
-        self.num_cores = len(self.machine_info['cores'])
-        self.cpu_model = self.machine_info['cores'][0]['model']
-        self.version = self.machine_info['version']
-        self.total_ramGB = int(self.machine_info["memory"]["total"] / 1024 / 1024 / 1024)
+    def parse_summary(self):
+        """
+        the cheap part of parsing machine_info - enough to tell if the host can join the cluster (version, uuid) and
+        how big it is.  Hosts that can't join are dropped before we spend any time on the rest (parse_details)
+        """
+        machine_info = self.machine_info
+        self.num_cores = len(machine_info['cores'])
+        self.cpu_model = machine_info['cores'][0]['model']
+        self.version = machine_info['version']
+        self.total_ramGB = int(machine_info["memory"]["total"] / 1024 / 1024 / 1024)
         try:
-            self.product_uuid = self.machine_info['osinfo']['sys_vendor_info']['product_uuid']
+            self.product_uuid = machine_info['osinfo']['sys_vendor_info']['product_uuid']
         except:
             self.product_uuid = ""
 
-        for drive in self.machine_info['disks']:
+    def parse_details(self):
+        """
+        the rest of machine_info - cpu topology, drives, interfaces.  After this, we only keep machine_info
+        compressed (unless keep_raw)
+        """
+        machine_info = self.machine_info
+        self.parse_cpu_topology(machine_info['cores'])
+
+        for drive in machine_info['disks']:
             if drive['type'] == "DISK" and not drive['isRotational'] and not drive['isMounted'] and \
                     len(drive['pciAddr']) > 0 and drive['type'] == 'DISK':
-                self.drives[drive['devName']] = drive
+                self.drives[drive['devName']] = {key: drive[key] for key in DRIVE_KEYS if key in drive}
 
         # need to determine if any of the above drives are actually in use - boot devices, root drives, etc.
         # how?
@@ -122,13 +254,74 @@ class STEMHost(object):
         #                 "isMounted": true,
 
         # remove any drives with mounted partitions from the list
-        for drive in self.machine_info['disks']:
+        for drive in machine_info['disks']:
             if drive['type'] == "PARTITION" and drive['parentName'] in self.drives and drive['isMounted']:
                 del self.drives[drive['parentName']]
 
+        self.interfaces = tuple({key: net_adapter[key] for key in INTERFACE_KEYS if key in net_adapter}
+                                for net_adapter in machine_info['net']['interfaces']
+                                if net_adapter['name'] != 'lo')  # we can't use loopback interfaces anyway
+        self.eths = dict()
+        for eth in machine_info['eths']:  # changed interface_alias in newer releases, so index by both
+            details = {key: eth[key] for key in ETH_KEYS if key in eth}
+            self.eths.setdefault(eth['interface_alias'], details)
+            self.eths.setdefault(eth['ethName'], details)
+
+        if not self.keep_raw and self._machine_info is not None:
+            self._packed_info = zlib.compress(json.dumps(self._machine_info).encode("utf-8"))
+            self._machine_info = None
+
+    def parse_cpu_topology(self, cores):
+        """
+        work out SMT, physical cores, sockets and numa nodes from machine_info['cores'] (one entry per logical cpu), so
+        we don't have to ssh to the host and run lscpu.  If the API doesn't give us the topology, or what it gives
+        doesn't add up, these are left as None and WekaHostGroup.get_hardware_info() falls back to lscpu
+        """
+        def first(core, keys):
+            for key in keys:
+                if key in core:
+                    return core[key]
+            return None
+
+        threads = dict()  # {(socket, core_id): number of logical cpus}
+        numa_nodes = list()
+        for core in cores:
+            socket = first(core, CORE_SOCKET_KEYS)
+            core_id = first(core, CORE_ID_KEYS)
+            if socket is None or core_id is None:
+                log.debug(f"{self.name}: no cpu topology in machine info - will use lscpu")
+                return
+            threads[(socket, core_id)] = threads.get((socket, core_id), 0) + 1
+            numa_nodes.append(first(core, CORE_NUMA_KEYS))
+        if len(threads) == 0 or min(threads.values()) != max(threads.values()):
+            # every core has the same number of threads; if not, we've misread the fields
+            log.warning(f"{self.name}: cpu topology in machine info doesn't add up - will use lscpu")
+            return
+
+        self.core_numa = array('h', numa_nodes) if None not in numa_nodes else array('h')
+        self.physical_cores = len(threads)
+        self.sockets = len({socket for socket, core_id in threads.keys()})
+        self.threads_per_core = max(threads.values())
+        self.hyperthread = self.threads_per_core > 1
+        log.debug(f"{self.name}: {self.sockets} sockets, {self.physical_cores} cores, " +
+                  f"{self.threads_per_core} threads per core")
+
+    def all_nics_usable(self):
+        """
+        did every configured interface (one with an ipv4 address) pass validate_nics?  If not, its state is
+        likely to change (cabling fixed, link brought up, etc)
+        """
+        for net_adapter in self.interfaces:
+            if net_adapter['name'] == 'lo' or net_adapter['bondType'] == 'SLAVE':
+                continue
+            if len(net_adapter['ip4']) > 0 and net_adapter['name'] not in self.nics:
+                return False
+        return True
+
     # STEMhost validate_nics
+    @timed("validate_nics")
     def validate_nics(self):
-        for net_adapter in self.machine_info['net']['interfaces']:
+        for net_adapter in self.interfaces:
             if net_adapter['name'] == 'lo':  # we can't use loopback interfaces anyway
                 continue
 
@@ -187,19 +380,21 @@ class STEMHost(object):
                 log.info(f"{self.name}:{net_adapter['name']} - unknown bond type {net_adapter['bondType']}")
 
     def find_interface_details(self, iface):
-        for eth in self.machine_info['eths']:
-            if eth['interface_alias'] == iface or eth['ethName'] == iface:  # changed interface_alias in newer releases
-                if not (eth['validationCode'] == "OK" and eth['linkDetected']):
-                    log.debug(f"Skipping interface {self.name}/{iface} - down or not validated")
-                    return None   # not good/usable
-                return eth
-        log.debug(f"Skipping interface {self.name}/{iface} - not in eths")
-        return None  # not found
-
+        eth = self.eths.get(iface)
+        if eth is None:
+            log.debug(f"Skipping interface {self.name}/{iface} - not in eths")
+            return None  # not found
+        if not (eth['validationCode'] == "OK" and eth['linkDetected']):
+            log.debug(f"Skipping interface {self.name}/{iface} - down or not validated")
+            return None   # not good/usable
+        return eth
+
+    @timed("open_api")
     def open_api(self, ip_list=None):
         """
         Try to open a connection to the API on the host; try all listed IPs, take first one that works
         depending on how we're running, we may or may not be able to talk to the host over every ip...
+        (they're tried at the same time - see apiracer.py)
 
         :param ip_list: a list of ip addrs
         :return: weka api object
@@ -208,34 +403,60 @@ class STEMHost(object):
             ip_list = [self.name]
 
         #log.debug(f"host {self.name}: {ip_list}")
-        ip = None
-        for ip in ip_list:
-            try:
-                log.debug(f"{self.name}: trying on {ip}")
-                self.host_api = WekaApi(ip, port=self.port, scheme="http", verify_cert=False, timeout=5)
-                break
-            except LoginError:
-                log.debug(f"host {self.name} failed login on ip {ip}?")
-                continue
-            except CommunicationError as exc:
-                log.debug(f"Error opening API for host {self.name} on ip {ip}: {exc}")
-                continue
-            except NewConnectionError as exc:
-                #log.error(f"Unable to contact host {self.name}")
-                continue
-            except UnboundLocalError:
-                log.error(f"Unable to contact host {self.name}")
-                return None
-            except Exception as exc:
-                log.error(f"Other exception on host {self.name}: {exc}")
-                continue
+        self.host_api, ip, attempts = default_racer.race(self.name, ip_list, self.open_api_on)
+        default_recorder.current().retries = max(attempts - 1, 0)
+        self.api_subnet = default_racer.subnet(ip) if ip is not None else None
 
         if self.host_api is None:
             log.debug(f"{self.name}: unable to open api to {self.name} - skipping")
+            default_recorder.current().outcome = "failed"
             return None
         else:
             log.debug(f"host api opened on {self.name} via {ip}")
 
+    def open_api_on(self, ip):
+        """
+        open the API on one ip, with a timeout that fits how long logins on its subnet have been taking.  The same
+        WekaApi fetches machine_info later, so it gets that call's timeout if it's longer
+
+        :return: WekaApi object (raises if it can't be opened)
+        """
+        subnet = default_racer.subnet(ip)
+        timeout = max(default_timeouts.get("api", self.name, subnet),
+                      default_timeouts.get("machine_info", self.name, subnet))
+        start = time.time()
+        try:
+            api = default_bundle.open_api(
+                self.name, ip, lambda: WekaApi(ip, port=self.port, scheme="http", verify_cert=False, timeout=timeout))
+        except wekalib.exceptions.TimeoutError:
+            default_timeouts.timed_out("api", time.time() - start, self.name, subnet)
+            raise
+        default_timeouts.observe("api", time.time() - start, self.name, subnet)
+        return api
+
+    @timed("facts")
+    def collect_facts(self):
+        """
+        get everything we want to know about the host's OS in one command (see facts.py), and fill in lscpu_data,
+        ip_rules and routes from it.  Anything it can't tell us is left as None, so it's fetched the old way later
+        """
+        self.facts = parse_facts(self.name, self.run(facts_command()))
+        if self.facts is None:
+            default_recorder.current().outcome = "failed"
+            return
+        if self.facts["route"] is not None:
+            self.routes = RouteTable(self.facts["route"], self.facts["rule"])
+        if len(self.facts["lscpu"]) > 0:
+            self.lscpu_data = SortedDict(self.facts["lscpu"])
+        rules = ip_rules(self.facts)
+        if rules is not None:
+            self.ip_rules = SortedDict(rules)
+            if len(self.ip_rules) == 0:
+                log.info(f"{self.name}: No source-based routing rules found")
+        if not self.keep_raw:
+            self.facts = None  # we have what we need from it
+
+    @timed("lscpu")
     def lscpu(self):
         # it would be nice to be able to get json output, but some old OS versions don't support it
         self.lscpu_data = SortedDict()
@@ -253,7 +474,9 @@ class STEMHost(object):
                 log.error(f"Host {self.name}: Unable to parse lscpu output - no lines")
         else:
             log.error(f"lscpu failed on {self.name}")
+            default_recorder.current().outcome = "failed"
 
+    @timed("source_routing")
     def check_source_routing(self):
         # check if the host has source-based routing set up
         self.ip_rules = SortedDict()
@@ -280,21 +503,119 @@ class STEMHost(object):
         #    if nic.ip in self.ip_rules:
         #        log.info(f"{self.name}: {nic} has source-based routing set up")
 
-    def run(self, command, *args, **kwargs):
+    def bundle_key(self):
+        """
+        what --record/--replay call this host.  The reference host is renamed part way through discovery
+        (see WekaHostGroup.check_nics), so it needs a name that doesn't change
+        """
+        return "<reference>" if self.is_reference else self.name
+
+    def run(self, command, *args, timeout=None, **kwargs):
+        """
+        :param timeout: seconds to allow the command, or None to go by how long commands have been taking
+        """
+        # everything we run goes through the bundle, for --record and --replay
+        return default_bundle.run(self.bundle_key(), command, lambda: self._run(command, timeout))
 
+    def _run(self, command, timeout=None):
         if self.is_local:
             log.debug(f"Running command locally on {self.name}: {command}")
-            import subprocess
-            ssh_out = subprocess.run(command, shell=True, capture_output=True, text=True)
+            try:
+                ssh_out = subprocess.run(command, shell=True, capture_output=True, text=True,
+                                         timeout=default_timeouts.get("ssh") if timeout is None else timeout)
+            except subprocess.TimeoutExpired as exc:
+                log.error(f"{self.name}: '{command[:100]}' timed out after {exc.timeout}s")
+                return CommandOutput(TIMED_OUT, "", f"timed out after {exc.timeout}s", exc)
             ssh_out.status = ssh_out.returncode
             return ssh_out
         else:
             log.debug(f"Running command remotely on {self.name}: {command}")
-            # if we need to run something there, and it doesn't have an ssh session yet, open one
-            if self.ssh_client is None:
-                self.ssh_client = RemoteServer(self.name)
-                self.ssh_client.connect()
-            return self.ssh_client.run(command, *args, **kwargs)
+            # everything run on a host shares its pooled connection; the pool opens it if needed
+            return default_pool.run(self.name, command, timeout)
+
+    def put(self, local, remote):
+        """
+        copy a file to the host
+
+        :param remote: path, or directory (ending in /) to put it in
+        :return: CommandOutput - status 0 if it was copied
+        """
+        if self.is_local:
+            log.debug(f"Copying {local} to {remote} locally on {self.name}")
+            try:
+                shutil.copy2(local, remote)
+            except OSError as exc:
+                return CommandOutput(1, "", str(exc), exc)
+            return CommandOutput(0, "", "")
+        log.debug(f"Copying {local} to {remote} on {self.name}")
+        return default_pool.put(self.name, local, remote)
+
+
+class ReachabilityMatrix(object):
+    """
+    host x host x interface reachability, probed from every host (full-mesh mode).  Catches asymmetric and
+    host-to-host failures that pinging only from the reference host misses.
+    """
+    def __init__(self, hosts):
+        self.reachable = dict()  # {(hostname, ifname): set of ip addrs it can ping}
+        self.ips_by_net = dict()  # {hostname: {network: set of ip addrs}}
+        self.ifaces_by_net = dict()  # {hostname: {network: [ifname]}}
+        for host in hosts:
+            self.ips_by_net[host.name] = dict()
+            self.ifaces_by_net[host.name] = dict()
+            for ifname, nic in host.nics.items():
+                self.ips_by_net[host.name].setdefault(nic.network, set()).add(str(nic.ip))
+                self.ifaces_by_net[host.name].setdefault(nic.network, list()).append(ifname)
+                self.reachable[(host.name, ifname)] = {str(nic.ip)}  # it can always reach itself
+
+    def add(self, hostname, ifname, results):
+        """ merge the results of a ping sweep ({ipaddr: True/False}) from hostname/ifname """
+        self.reachable[(hostname, ifname)].update(ip for ip, ok in results.items() if ok)
+
+    def broken_links(self, hostnames, networks=None):
+        """
+        :param hostnames: the hosts to check between
+        :param networks: only check these networks (default: all)
+        :return: list of (source host, source interface, target host) where the source interface can't reach
+                 any of the target's ips on the same network
+        """
+        broken = list()
+        for source in hostnames:
+            for net, ifnames in self.ifaces_by_net.get(source, dict()).items():
+                if networks is not None and net not in networks:
+                    continue
+                for target in hostnames:
+                    target_ips = self.ips_by_net.get(target, dict()).get(net)
+                    if target == source or target_ips is None:  # not on this network
+                        continue
+                    for ifname in ifnames:
+                        if self.reachable[(source, ifname)].isdisjoint(target_ips):
+                            broken.append((source, ifname, target))
+        return broken
+
+    def isolate(self, hostnames, networks=None, keep=()):
+        """
+        drop the host with the most broken links until every remaining pair of hosts can talk to each other
+
+        :param keep: hostnames that must not be dropped (ie: the reference host)
+        :return: (set of good hostnames, dict of {dropped hostname: number of broken links})
+        """
+        good = set(hostnames)
+        dropped = dict()
+        broken = self.broken_links(good, networks)
+        while len(broken) > 0:
+            counts = dict()
+            for source, ifname, target in broken:
+                for hostname in (source, target):
+                    if hostname not in keep:
+                        counts[hostname] = counts.get(hostname, 0) + 1
+            if len(counts) == 0:
+                break  # only the hosts we have to keep are left with broken links
+            worst = max(sorted(counts), key=lambda hostname: counts[hostname])
+            dropped[worst] = counts[worst]
+            good.discard(worst)
+            broken = [link for link in broken if worst not in (link[0], link[2])]
+        return good, dropped
 
 
 class NamedDict(SortedDict):
@@ -311,7 +632,8 @@ class NamedDict(SortedDict):
 
 
 class WekaHostGroup():
-    def __init__(self, reference_host, beacons, skip_gateway_check):
+    def __init__(self, reference_host, beacons, skip_gateway_check, batch_ping=False, full_mesh=False, cache=None,
+                 previous=None, rescan=None):
         """
         This routine is run before the TUI starts to scope out the cluster.
 
@@ -320,6 +642,11 @@ class WekaHostGroup():
         Then analyze the hosts (networks and whatnot) to see how we can configure things
 
         :param beacons: dict of hostname:[list of ip addrs]
+        :param batch_ping: sweep each reference host interface's targets in one remote invocation
+        :param full_mesh: have every host ping every other host, not just the reference host
+        :param cache: a MachineInfoCache, or None to always fetch machine info from the hosts
+        :param previous: discovery state saved by an earlier run (see state.py), to rescan hosts from
+        :param rescan: list of hostnames to rescan; everything else comes from previous
         :return: a list of STEMHost objects
         """
         self.mixed_networking = False
@@ -330,40 +657,56 @@ class WekaHostGroup():
         self.usable_hosts = SortedDict()
         self.accessible_hosts = SortedDict()  # a dict of {ifname:(hostname)}  (set of hostnames on the nic)
         self.pingable_ips = SortedDict()
+        self.gateway_targets = dict()  # {interface: pingable ips, sorted} - what get_gateways() tries
         self.networks = SortedDict()
         self.candidates = SortedDict()
         self.rejected_hosts = SortedDict()
+        self.uuids = dict()  # {product_uuid: [hostnames]}, for all but the reference host (see claim_uuid)
         self.reference_host = reference_host
         self.skip_gateway_check = skip_gateway_check
+        self.batch_ping = batch_ping
+        self.full_mesh = full_mesh
+        self.mesh = None  # ReachabilityMatrix, if full_mesh
+        self.cache = cache
         #self.clients = SortedDict()
 
-        default_threader.num_simultaneous = 5  # ssh has a default limit of 10 sessions at a time
+        default_threader.num_simultaneous = DEFAULT_THREADS
         self.beacons = beacons
         self.weka_version = reference_host.version
-
-        # if we're not running locally on the reference host, open an ssh session to it
-        if not self.reference_host.is_local:
-            self.reference_host.ssh_client = RemoteServer(self.reference_host.name)
-            self.reference_host.ssh_client.connect()
+        self.stage_limits = {stage: threading.BoundedSemaphore(limit) for stage, limit in STAGE_LIMITS.items()}
+        self._lock = threading.Lock()
 
         log.info(f"Getting configuration info from hosts...")
-        self.create_candidates()
-        log.debug(f"candidates = {list(self.candidates.keys())}")
-
-        self.scan_machine_info()
-        self.check_uuids()
-        log.debug(f"candidates = {list(self.candidates.keys())}")
-        self.check_weka_release()
-        log.debug(f"candidates = {list(self.candidates.keys())}")
-        self.validate_nics()
-        log.debug(f"candidates = {list(self.candidates.keys())}")
-        self.explore_network()
+        with default_recorder.span("prepare_reference_host"):
+            self.prepare_reference_host()
+        with default_recorder.span("pipeline"):
+            if previous is None:
+                self.run_pipeline(self.beacons)
+            else:
+                self.run_pipeline(self.restore(previous, rescan))
         log.debug(f"candidates = {list(self.candidates.keys())}")
-        self.analyze_networks() # creates self.usable_hosts
+        with default_recorder.span("check_uuids"):
+            self.check_uuids()
+        if self.full_mesh:
+            with default_recorder.span("full_mesh"):
+                self.probe_mesh()
+        with default_recorder.span("analyze_networks"):
+            self.analyze_networks() # creates self.usable_hosts
         log.debug(f"candidates = {list(self.candidates.keys())}")
-        self.get_hardware_info()
+        with default_recorder.span("hardware_info"):
+            self.get_hardware_info()
+        self.host_table = HostTable(self.usable_hosts)  # for comparing and sizing the hosts
+        self.network_index = NetworkIndex(self.usable_hosts, self.reference_host, self.accessible_hosts)
         log.debug(f"candidates = {list(self.candidates.keys())}")
+        if self.cache is not None:
+            with default_recorder.span("update_cache"):
+                self.update_cache()
+
 
+        default_timeouts.report()
+        ssh_stats = default_pool.stats()
+        log.info(f"ssh: {ssh_stats['handshakes']} handshakes ({ssh_stats['failed_handshakes']} failed) for " +
+                 f"{ssh_stats['commands']} commands, reuse ratio {ssh_stats['reuse_ratio']}")
 
         summary_log.info("************************ Summary ************************")
         summary_log.info(f"usable_hosts = {list(self.usable_hosts.keys())}")
@@ -372,229 +715,378 @@ class WekaHostGroup():
             summary_log.info(f"    {host}: {reasons}")
 
     def reject_host(self, host, reason):
-        try:
-            log.debug(f"Rejecting {str(host)} - {reason}")
-            self.candidates.pop(str(host))
-        except (KeyError, NameError):
-            log.debug(f"{str(host)} not in candidates list - adding to rejected list")
-        if str(host) in self.rejected_hosts.keys():
-            log.debug(f"{str(host)} already rejected - adding reason")
-            self.rejected_hosts[str(host)].append(reason)
-        else:
-            self.rejected_hosts[str(host)] = [reason]
-
-    def create_candidates(self):
-        #
-        for host, ip_list in self.beacons.items():
-            # if we're going to do this, we have to create the STEMHost object first, not below
-            log.debug(f"creating candidate for {host}")
-            candidate = STEMHost(host, self.reference_host.port)
-            # Open an API to each host, in parallel
-            log.debug(f"opening api to {host}")
-            threaded_method(candidate, STEMHost.open_api, ip_list)  # schedule to run (they're slow)
-            self.candidates[host] = candidate
-        default_threader.run()  # run the threaded methods
-
-        for host, candidate in self.candidates.copy().items():
-            if candidate.host_api is None:
-                log.info(f"Unable to communicate with {host} API - skipping")
-                self.reject_host(candidate, "Unable to communicate with API")
-
-    """
-    def open_candidate_api(self):
-        # weed out the ones we can't talk to or reach
-        for host, candidate in self.candidates.items():
-            log.debug(f"opening api to {host}")
-            threaded_method(candidate, STEMHost.open_api, ip_list)  # schedule to run (they're slow)
-        default_threader.run()  # run the threaded methods
-
-        for host, candidate in self.candidates.copy().items():
-            if candidate.host_api is None:
-                log.info(f"Unable to communicate with {host} API - skipping")
-                self.reject_host(candidate, "Unable to communicate with API")
-    """
-
-    def scan_machine_info(self):
-        log.debug(f"Getting machine info from hosts...")
-        parallel(self.candidates.values(), STEMHost.get_machine_info)
-        # if get_machine_info fails, the host will not have a self.machine_info
-        for candidate in self.candidates.copy().values():
-            if candidate.machine_info is None:
-                log.error(f"Error communicating with {candidate.name} - removing from list")
-                self.reject_host(candidate, "Unable to fetch machine info")
-                continue
-            elif len(candidate.drives) == 0:
-                log.error(f"{candidate.name} has no usable drives?")
-                self.reject_host(candidate, "No valid data drives")
-                continue
-        log.debug(f"Got machine info from {list(self.candidates.keys())}")
-
-    def check_uuids(self):
-        errors = False
-        by_uuid = dict()
-        for host in self.candidates.values():
-            if host.product_uuid not in by_uuid:
-                by_uuid[host.product_uuid] = list()
-            by_uuid[host.product_uuid].append(host.product_uuid)
-        if len(self.candidates) != len(by_uuid):
-            # check to make sure all uuids are unique
-            for host in self.candidates.values():
-                if len(by_uuid[host.product_uuid]) > 1:
-                    log.error(f"UUID {host.product_uuid} is duplicated on {by_uuid[host.name]}")
-                    errors = True
-        # Terminate hard
-        if errors:
-            log.critical(f"Duplicate/bad machine UUIDs detected.  Please contact WEKA Customer Success Team")
-            sys.exit(1)
+        with self._lock:    # hosts are rejected from the pipeline threads
+            try:
+                log.debug(f"Rejecting {str(host)} - {reason}")
+                self.candidates.pop(str(host))
+            except (KeyError, NameError):
+                log.debug(f"{str(host)} not in candidates list - adding to rejected list")
+            if str(host) in self.rejected_hosts.keys():
+                log.debug(f"{str(host)} already rejected - adding reason")
+                self.rejected_hosts[str(host)].append(reason)
+            else:
+                self.rejected_hosts[str(host)] = [reason]
 
-    # WekaHostGroup.validate_nics
-    def validate_nics(self):
-        # at this point, the reference_host might not be the same STEMhost object as the one in the candidates list
+    def prepare_reference_host(self):
+        """
+        Validate the reference host's nics and see if we're running on it.  Every candidate is compared to
+        (and pinged from) the reference host, so this has to be done before the pipeline starts
+        """
         self.reference_host.validate_nics()
-        parallel(self.candidates.values(), STEMHost.validate_nics)
+        default_racer.networks = [nic.network for nic in self.reference_host.nics.values()]  # group api wins by these
 
         # check if we're running locally on the reference host; make a note of it for .run()
-        self.local_ips = get_local_ips()
+        self.local_ips = default_bundle.local_ips(get_local_ips)
         reference_host_ips = [str(iface.ip) for iface in self.reference_host.nics.values()]
 
         # if any of the local ips are in the reference host, then we're running locally
         self.reference_host.is_local = len(list(set(self.local_ips).intersection(reference_host_ips))) > 0
-        #print()
 
-        for hostname, candidate in self.candidates.copy().items():
-            if len(candidate.nics) == 0:
-                log.error(f"{hostname} has no usable nics?  Skipping...")
-                self.reject_host(candidate, "No usable nics")
-                continue
-        #if len(list(set(self.local_ips).intersection(reference_host_ips))) > 0:
-        #    self.reference_host.is_local = True
-
-        """
-        # do it the hard way...
-        for ip in self.local_ips:
-            if ip in reference_host_ips:
-                self.reference_host.is_local = True
-                break
-        """
-
-        """
-        # find reference_host in the candidates list
-        self.local_ips = get_local_ips()
-        for ip in self.local_ips:
-            for candidate in self.candidates.values():
-                candidate_ips = [str(iface.ip) for iface in candidate.nics.values()]
-                if ip in candidate_ips:
-                    self.reference_host = candidate
-                    candidate.is_reference = True
-                    break
-            if self.reference_host is not None:
-                break
-        if self.reference_host is None:
-            log.error(f"Unable to find local host in candidates list")
-            sys.exit(1)
+        # if we're not running locally on the reference host, open an ssh session to it
+        if not self.reference_host.is_local:
+            self.reference_host.ssh_client = default_bundle.connect(
+                self.reference_host.bundle_key(), lambda: default_pool.connect(self.reference_host.name))
+
+        # collect details of what weka hosts we can see on each reference host nic
+        for source_interface, nic in self.reference_host.nics.items():
+            self.accessible_hosts[source_interface] = set()  # hosts by interface on the reference host
+            self.accessible_hosts[source_interface].add(self.reference_host.name)  # always add this
+            self.pingable_ips[source_interface] = [nic]  # ips pingable from this interface - including itself
+            self.networks[source_interface] = set()
+
+    def restore(self, previous, rescan):
         """
+        Load the hosts from a previous run, except the ones we're rescanning.  Restored hosts keep what was found
+        last time (nics, reachability, gateways, lscpu), so only the rescanned hosts go through the pipeline.
 
-    def check_weka_release(self):
-        # find hosts that can cluster with reference_hostname - they pointed us at reference_hostname for a reason
-        log.info(f"Localhost is running WEKA version {self.weka_version}")
-        log.info(f"Searching for other {self.weka_version} hosts...")
-        for host, candidate in self.candidates.copy().items():  # copy it so we can del() from orig list
-            if candidate.version != self.weka_version:
-                log.info(f"    host {host} is not running v{self.weka_version} - removing from list")
-                self.reject_host(candidate,
-                             f"Host is running {candidate.version} - not compatible with {self.weka_version}")
+        :param previous: the saved state (see state.py)
+        :param rescan: list of hostnames to rescan
+        :return: dict of hostname:[list of ip addrs] for the hosts to rescan
+        """
+        if previous["weka_version"] != self.weka_version:
+            log.warning(f"Saved state is for WEKA {previous['weka_version']}, but the reference host is running " +
+                        f"{self.weka_version}")
+        if self.cache is not None:
+            self.cache.refresh = True  # the rescanned hosts always get fresh data
+
+        to_scan = dict()
+        for hostname in rescan:
+            ip_list = self.beacons.get(hostname, previous["beacons"].get(hostname))
+            if ip_list is None:
+                log.error(f"Unable to rescan {hostname} - it isn't beaconing and wasn't in the previous scan")
                 continue
-            else:
-                log.debug(f"    host {host} is running {self.weka_version}")
-            #log.info(f"Host {host} added to list of possible cluster hosts")
+            to_scan[hostname] = ip_list
 
-    """
-    def check_weka_release_old(self):
-        # find hosts that can cluster with reference_hostname - they pointed us at reference_hostname for a reason
-        log.info(f"Reference Host {self.reference_host.name} is running WEKA release {self.reference_host.version}")
-        log.info(f"Searching for other {self.reference_host.version} hosts...")
-        for host, candidate in self.candidates.copy().items():  # copy it so we can del() from orig list
-            if candidate.machine_info is None:
-                log.error(f"Error communicating with {host} - removing from list")
-                self.reject_host(candidate, "Error communicating with host - lacks machine info")
+        for hostname, saved in previous["hosts"].items():
+            if hostname in to_scan:
                 continue
-            elif candidate.version != self.reference_host.version:
-                log.info(f"    host {host} is not running v{self.reference_host.version} - removing from list")
-                self.reject_host(candidate,
-                        f"Host is running {candidate.version} - not compatible with {self.reference_host.version}")
+            host = STEMHost(hostname, self.reference_host.port)
+            host.machine_info = saved["machine_info"]
+            host.parse_machine_info()
+            host.beacon_ips = saved["beacon_ips"]
+            host.from_cache = True  # it's already cached, if it's cacheable
+            self.candidates[hostname] = host
+            self.claim_uuid(host)
+            host = self.check_nics(host)  # rebuild the nics; swaps in the reference host if it's this one
+            if host is None:
                 continue
-            else:
-                #candidate.validate_nics()
-                if len(candidate.nics) == 0:
-                    log.error(f"{host} has no usable nics?  Skipping...")
-                    self.reject_host(candidate, "No usable nics")
+            for ifname, gateway in saved["gateways"].items():
+                if ifname in host.nics:
+                    host.nics[ifname].gateway = gateway
+            host.hyperthread = saved["hyperthread"]
+            host.threads_per_core = saved["threads_per_core"]
+            if saved["ip_rules"] is not None:
+                host.ip_rules = SortedDict(saved["ip_rules"])
+
+        for source_interface, hostnames in previous["accessible_hosts"].items():
+            if source_interface in self.accessible_hosts:
+                self.accessible_hosts[source_interface].update(
+                    hostname for hostname in hostnames if hostname in self.candidates)
+        for source_interface, targets in previous["pingable_ips"].items():
+            if source_interface not in self.pingable_ips:
+                continue
+            for hostname, targetif in targets:
+                host = self.candidates.get(hostname)
+                if host is None or targetif not in host.nics:
                     continue
-            log.info(f"Host {host} added to list of possible cluster hosts")
-    """
+                if host is self.reference_host and source_interface == targetif:
+                    continue  # prepare_reference_host already added it
+                self.add_reachable(source_interface, hostname, host.nics[targetif])
+
+        for hostname, reasons in previous["rejected_hosts"].items():
+            if hostname not in to_scan and hostname not in self.candidates:
+                self.rejected_hosts[hostname] = reasons
+
+        log.info(f"Restored {len(self.candidates)} hosts from the previous scan; rescanning {list(to_scan.keys())}")
+        return to_scan
+
+    def run_pipeline(self, beacons):
+        """
+        Run each host through discovery on its own, rather than holding every host at a barrier between stages.
+        Each stage has its own limit (STAGE_LIMITS), so a slow host only delays itself.
+
+        :param beacons: dict of hostname:[list of ip addrs]
+        :return: Fills in self.candidates, self.accessible_hosts, self.pingable_ips and self.networks
+        """
+        log.info(f"Localhost is running WEKA version {self.weka_version}")
+        log.info(f"Searching for other {self.weka_version} hosts...")
+        log.info("Exploring network... this may take a while")
+        log.debug(f"refhost.nics = {list(self.reference_host.nics.keys())}")
+        # hosts waiting for a stage hold a thread, so allow enough threads to keep every stage full
+        default_threader.num_simultaneous = sum(STAGE_LIMITS.values())
+        for hostname, ip_list in beacons.items():
+            threaded_method(self, WekaHostGroup.discover_host, hostname, ip_list)
+        default_threader.run()
+        default_threader.num_simultaneous = DEFAULT_THREADS
+
+        hosts = [self.candidates[hostname] for hostname in beacons.keys() if hostname in self.candidates]
+        if self.batch_ping:
+            # every host's ips are known now, so sweep them all at once
+            with default_recorder.span("batch_sweep"):
+                self.sweep_reachability(hosts)
+
+        # gateways are probed once reachability is known for every host, so each host looks for a fallback gateway
+        # among the same targets, in the same order, whatever order the pipeline threads finished in
+        self.gateway_targets = {source_interface: sorted(target_list)
+                                for source_interface, target_list in self.pingable_ips.items()}
+        for candidate in hosts:
+            threaded_method(self, WekaHostGroup.gateway_stage, candidate)
+        default_threader.run()
+
+    def discover_host(self, hostname, ip_list):
+        """
+        Take one host through open_api -> machine_query_info -> nic validation -> ssh -> facts -> reachability.
+        If any stage fails, the host is rejected and goes no further.  With batch_ping, the host stops after ssh and
+        run_pipeline sweeps reachability for all hosts.  Gateways are probed by run_pipeline, after every host is done
+
+        :param hostname: the beacon hostname
+        :param ip_list: list of ip addrs to try the API on
+        """
+        log.debug(f"creating candidate for {hostname}")
+        candidate = STEMHost(hostname, self.reference_host.port)
+        candidate.beacon_ips = ip_list
+        with self._lock:  # the other pipeline threads are adding (and rejecting) candidates too
+            self.candidates[hostname] = candidate
+        try:
+            if not self.fetch_machine_info(candidate, ip_list):
+                return
+            if not self.check_machine_info(candidate):
+                return
+
+            candidate = self.check_nics(candidate)
+            if candidate is None:
+                return
+
+            with self.stage_limits["ssh"], default_recorder.span("ssh", hostname) as timer:
+                if not self.open_ssh(candidate):
+                    timer.outcome = "rejected"
+                    return
+
+            with self.stage_limits["facts"]:
+                candidate.collect_facts()
+
+            if self.batch_ping:
+                return
+
+            with self.stage_limits["reachability"], default_recorder.span("reachability", hostname):
+                self.probe_reachability(candidate)
+        except Exception as exc:
+            log.error(f"Error discovering {hostname}: {exc}")
+            self.reject_host(candidate, f"Error during discovery: {exc}")
+
+    def gateway_stage(self, candidate):
+        # go probe the host to see if it has a default route set, if so, we'll config weka to use it
+        if self.skip_gateway_check or not self.is_accessible(candidate):
+            return
+        try:
+            with self.stage_limits["gateways"], default_recorder.span("gateways", candidate.name):
+                self.probe_gateways(candidate)
+        except Exception as exc:
+            log.error(f"Error probing gateways on {candidate.name}: {exc}")
+            self.reject_host(candidate, f"Error during discovery: {exc}")
+
+    def fetch_machine_info(self, candidate, ip_list):
+        """
+        get the host's machine info - from the cache if we can, otherwise open the API and ask the host
+
+        :return: False if the host was rejected
+        """
+        if self.cache is not None:
+            candidate.machine_info = self.cache.lookup(candidate.name, self.weka_version, ip_list)
+            if candidate.machine_info is not None:
+                log.debug(f"{candidate.name}: using cached machine info")
+                candidate.from_cache = True
+                candidate.parse_summary()
+                return True
+
+        with self.stage_limits["open_api"]:
+            candidate.open_api(ip_list)
+        if candidate.host_api is None:
+            log.info(f"Unable to communicate with {candidate.name} API - skipping")
+            self.reject_host(candidate, "Unable to communicate with API")
+            return False
+
+        with self.stage_limits["machine_info"]:
+            candidate.get_machine_info()
+        return True
 
-    def explore_network(self):
-        log.info("Preparing to explore network...")
+    def check_machine_info(self, candidate):
+        """
+        Decide from the host's summary (version, product_uuid) whether it can join the cluster, and only then parse
+        the rest of its machine info.  Hosts that can't join are dropped before we spend any more time on them.
+
+        :return: False if the host was rejected
+        """
+        # if get_machine_info fails, the host will not have a version (so it wasn't parsed)
+        if candidate.version is None:
+            log.error(f"Error communicating with {candidate.name} - removing from list")
+            self.reject_host(candidate, "Unable to fetch machine info")
+            return False
+
+        problem = self.release_problem(candidate)
+        if problem is not None:
+            self.reject_host(candidate, problem)
+            candidate.machine_info = None  # we won't need it
+            return False
+
+        candidate.parse_details()
+        if len(candidate.drives) == 0:
+            log.error(f"{candidate.name} has no usable drives?")
+            self.reject_host(candidate, "No valid data drives")
+            return False
+        return True
+
+    def release_problem(self, candidate):
+        """
+        the checks we can do from the host's summary: is it running our release, and is its product_uuid its own
+
+        :return: why the host can't join the cluster, or None if it can
+        """
+        # find hosts that can cluster with reference_hostname - they pointed us at reference_hostname for a reason
+        if candidate.version != self.weka_version:
+            log.info(f"    host {candidate.name} is not running v{self.weka_version} - removing from list")
+            return f"Host is running {candidate.version} - not compatible with {self.weka_version}"
+        log.debug(f"    host {candidate.name} is running {self.weka_version}")
+
+        if not self.claim_uuid(candidate):
+            log.error(f"{candidate.name} has the same product UUID ({candidate.product_uuid}) as another host")
+            return f"Duplicate product UUID {candidate.product_uuid}"
+        return None
+
+    def claim_uuid(self, candidate):
+        """
+        Register the candidate's product_uuid.  The reference host's uuid isn't registered here - the candidate
+        that turns out to be the reference host has it too (see check_nics); check_uuids catches any other host
+        that has it.
+
+        :return: False if another host already has the uuid
+        """
+        if candidate.product_uuid == self.reference_host.product_uuid:
+            return True
+        with self._lock:
+            hostnames = self.uuids.setdefault(candidate.product_uuid, list())
+            if candidate.name not in hostnames:
+                hostnames.append(candidate.name)
+            return hostnames[0] == candidate.name
+
+    def check_uuids(self):
+        """
+        Every host must have a unique product_uuid - this includes the hosts check_machine_info already rejected
+        for having a duplicate, so it's a hard error either way
+        """
+        by_uuid = {uuid: list(hostnames) for uuid, hostnames in self.uuids.items()}
+        reference_uuid = self.reference_host.product_uuid
+        by_uuid[reference_uuid] = [host.name for host in self.candidates.values()
+                                   if host.product_uuid == reference_uuid]
+        errors = False
+        for uuid, hostnames in by_uuid.items():
+            if len(hostnames) > 1:
+                log.error(f"UUID {uuid} is duplicated on {hostnames}")
+                errors = True
+        # Terminate hard
+        if errors:
+            log.critical(f"Duplicate/bad machine UUIDs detected.  Please contact WEKA Customer Success Team")
+            sys.exit(1)
+
+    def check_nics(self, candidate):
+        """
+        validate the candidate's nics.  If the candidate turns out to be the reference host, the reference host
+        object takes its place
+
+        :return: the STEMHost to carry on with, or None if it was rejected
+        """
+        candidate.validate_nics()
+        if len(candidate.nics) == 0:
+            log.error(f"{candidate.name} has no usable nics?  Skipping...")
+            self.reject_host(candidate, "No usable nics")
+            return None
 
         # There may be a reference_host of localhost, and another copy of it with a "real" hostname
         # so we need to make sure we only have one copy of the reference_host
-        for host in self.candidates.copy().values():
-            # see if this one has the same ips as the reference host
-            reference_host_ips = [str(iface.ip) for iface in self.reference_host.nics.values()]
-            host_ips = [str(iface.ip) for iface in host.nics.values()]
-
-            if reference_host_ips == host_ips:
-                log.info(f"Found reference host {self.reference_host.name} in {host.name}")
-                #if self.reference_host.name == "localhost":
-                self.reference_host.name = host.name    # fix so it's not "localhost" or an ip addr
-                self.candidates[host.name] = self.reference_host
-                break
-                # what happens when we use localhost?  vince
-
-        # make sure reference_hostname can talk to the others over the dataplane networks; narrow the list,
-        # and collect details of what weka hosts we can see on each nic
-        # self.accessible_hosts = dict()  # a dict of {ifname:(hostname)}  (set of hostnames on the nic)
-        # self.pingable_ips = dict()
-        # self.numnets = dict()
-        for source_interface in self.reference_host.nics.keys():
-            self.accessible_hosts[source_interface] = set()  # hosts by interface on the reference host
-            self.accessible_hosts[source_interface].add(self.reference_host.name)  # always add this
-            self.pingable_ips[source_interface] = list()  # ips pingable from this interface
-            self.networks[source_interface] = set()
+        reference_host_ips = [str(iface.ip) for iface in self.reference_host.nics.values()]
+        host_ips = [str(iface.ip) for iface in candidate.nics.values()]
+        if reference_host_ips == host_ips:
+            log.info(f"Found reference host {self.reference_host.name} in {candidate.name}")
+            with self._lock:
+                old_name = self.reference_host.name
+                if not self.reference_host.is_local:
+                    default_pool.alias(candidate.name, old_name)  # keep using the session we already have
+                self.reference_host.name = candidate.name  # fix so it's not "localhost" or an ip addr
+                self.reference_host.beacon_ips = candidate.beacon_ips
+                for host_set in self.accessible_hosts.values():
+                    host_set.discard(old_name)
+                    host_set.add(candidate.name)
+                self.candidates[candidate.name] = self.reference_host
+            return self.reference_host
+        return candidate
+
+    def open_ssh(self, host):
+        """
+        open an ssh session to the host - any hosts we can't ssh to are rejected
+        """
+        if host.is_local:
+            return True
+        # we're in a thread; don't prompt
+        host.ssh_client = default_bundle.connect(host.bundle_key(),
+                                                 lambda: default_pool.connect(host.name, interactive=False))
+        if host.ssh_client is None:
+            log.error(f"Unable to open ssh session to {host} - removing from list")
+            self.reject_host(host, "Unable to open ssh session")
+            return False
+        return True
 
-        log.info("Exploring network... this may take a while")
+    def probe_reachability(self, hostobj):
+        """
+        make sure reference_hostname can talk to this host over the dataplane networks
 
-        # set up for parallel execution ########################
-        # this uses the reference host to ping all the candidates on the dataplane networks
-        log.debug(f"refhost.nics = {list(self.reference_host.nics.keys())}")
-        for hostname, hostobj in self.candidates.items():
-            log.info(f'Looking at host {hostname}...')
-            # see if the reference host can talk to the target ip on each interface
-            for source_interface in self.reference_host.nics.keys():  # refhost nic
-                for targetif, targetip in hostobj.nics.items():  # candidate nic
-                    if hostname == self.reference_host.name and source_interface == targetif:
-                        self.pingable_ips[source_interface].append(targetip)  # make sure refhost is there
-                        continue  # not sure why, but ping fails on loopback anyway
-
-                    log.debug(f"checking {hostobj.name}/{source_interface}/{targetip.ip} from {source_interface}")
-                    # source_interface is the interface on the reference host
-                    # hostobj is the host we're pinging
-                    # targetip is the ip on the host that we're pinging
-                    threaded_method(self, WekaHostGroup.ping_clients, source_interface, hostobj, targetip)
-                    #self.ping_clients(source_interface, hostobj, targetip) # debugging
-
-        # execute the pings...  ###################
-        default_threader.run()   # sets self.accessible_hosts and self.pingable_ips
+        :param hostobj: target STEMHost object
+        :return: Fills in self.accessible_hosts and self.pingable_ips (via ping_clients)
+        """
+        log.info(f'Looking at host {hostobj.name}...')
+        # see if the reference host can talk to the target ip on each interface
+        for source_interface in self.reference_host.nics.keys():  # refhost nic
+            for targetif, targetip in hostobj.nics.items():  # candidate nic
+                if hostobj is self.reference_host and source_interface == targetif:
+                    continue  # already in pingable_ips; not sure why, but ping fails on loopback anyway
+
+                log.debug(f"checking {hostobj.name}/{source_interface}/{targetip.ip} from {source_interface}")
+                # source_interface is the interface on the reference host
+                # hostobj is the host we're pinging
+                # targetip is the ip on the host that we're pinging
+                self.ping_clients(source_interface, hostobj, targetip)
+
+    def is_accessible(self, host):
+        return any(host.name in host_set for host_set in self.accessible_hosts.values())
+
+    def probe_gateways(self, host):
+        for nicname, nic_obj in host.nics.items():
+            if nic_obj.type != "IB":  # we don't support gateways on IB
+                self.get_gateways(host, nic_obj)
 
     def analyze_networks(self):
         # note: self.accessible_hosts is a dict of {ifname:(hostname)}  (set of hostnames on the nic)
         # note that self.pingable_ips is a dict of {ifname:[ipaddr]}  (list of ip addrs pingable from this interface)
 
-
-        # open ssh to all the hosts - make sure we can get to them
-        log.info(f"Opening ssh to hosts")
-        # any hosts we can't ssh to are rejected in the following function (removed from candidates)
-        self.open_ssh_toall()
-
         # merge the accessible_hosts sets - we need the superset for later
         log.info(f"starting network analysis")
         usable_set = set()  # a set will always be unique... no duplicates
@@ -627,13 +1119,22 @@ class WekaHostGroup():
 
         if len(self.usable_hosts) != len(self.candidates):
             log.error(f"Only {len(self.usable_hosts)} of {len(self.candidates)} candidates are ping-able via dataplane")
-            for host, candidate in self.candidates.items():
+            for host, candidate in self.candidates.copy().items():
                 if host not in self.usable_hosts:
                     self.reject_host(candidate, "Not ping-able via dataplane")
                     #log.error(f"    {host} is not ping-able via dataplane")
         else:
             log.info(f"All {len(self.usable_hosts)} hosts are ping-able via dataplane")
 
+        # with full-mesh probing, make sure the usable hosts can all talk to each other, not just to the reference host
+        if self.mesh is not None:
+            good, dropped = self.mesh.isolate(self.usable_hosts.keys(), keep=(self.reference_host.name,))
+            for source, ifname, target in self.mesh.broken_links(self.usable_hosts.keys()):
+                log.error(f"    {source}/{ifname} cannot reach {target}")
+            for hostname, num_broken in dropped.items():
+                log.error(f"{hostname} has {num_broken} broken dataplane links - removing from list")
+                self.reject_host(self.usable_hosts.pop(hostname), f"{num_broken} broken dataplane links (full-mesh)")
+
         log.info(f"There appear to be {len(self.usable_hosts)} usable hosts - {list(self.usable_hosts.keys())}")
 
         # are the other hosts on different subnets?
@@ -662,25 +1163,17 @@ class WekaHostGroup():
         if len(self.link_types) > 1:
             self.mixed_networking = True
 
-        # go probe the hosts to see if they have a default route set, if so, we'll config weka to use it
-        if not self.skip_gateway_check:
-            log.info("Probing for gateways")
-            for host, host_obj in self.usable_hosts.items():
-                for nicname, nic_obj in host_obj.nics.items():
-                    if nic_obj.type != "IB":  # we don't support gateways on IB
-                        threaded_method(self, WekaHostGroup.get_gateways, host_obj, nic_obj)
-                        #self.get_gateways(host_obj, nic_obj)
-
-        default_threader.run()   # update host object with gateway info
-
         # check if they need source-based routing and see if they have it set up
         if self.one_network:
             log.info("There is only one network on the reference host")
             if len(self.reference_host.nics) > 1:
                 log.info("There are multiple UP interfaces on the reference host")
                 log.info("Checking for source-based routing")
+                # hosts restored for --rescan already know
+                parallel_hosts([host_obj for host_obj in self.usable_hosts.values() if host_obj.ip_rules is None],
+                               STEMHost.check_source_routing)
                 for hostname, host_obj in self.usable_hosts.items():
-                    if not host_obj.check_source_routing():
+                    if len(host_obj.ip_rules) == 0:
                         log.error(f"{host_obj.name} needs source-based routing set up")
                     else:
                         log.info(f"{host_obj.name} appears to have source-based routing set up")
@@ -704,33 +1197,130 @@ class WekaHostGroup():
         # be sure to use the reference host!
 
         #import subprocess
-        log.debug(f"running:  ping -c1 -W1 -I {source_interface} {targetip.ip}")
-        ssh_out = self.reference_host.run(f"ping -c1 -W1 -I {source_interface} {targetip.ip}") # , shell=True, capture_output=True, text=True)
+        wait = math.ceil(default_timeouts.get("ping", subnet=targetip.network))  # ping -W is whole seconds
+        log.debug(f"running:  ping -c1 -W{wait} -I {source_interface} {targetip.ip}")
+        with default_recorder.span("ping", hostname) as timer:
+            ssh_out = self.reference_host.run(f"ping -c1 -W{wait} -I {source_interface} {targetip.ip}") # , shell=True, capture_output=True, text=True)
+            if ssh_out.status != 0:
+                timer.outcome = "failed"
         if ssh_out.status == 0:
+            rtt = PING_RTT.search(ssh_out.stdout)
+            if rtt is not None:
+                default_timeouts.observe("ping", float(rtt.group(1)) / 1000, subnet=targetip.network)
             log.debug(f"Ping from {self.reference_host.name}/{source_interface} to target {hostname}/{targetip} successful - adding {hostname} to accessible_hosts")
             # make sure we can ssh to the host
             #if hostobj.ssh_client is None:
             #    hostobj.ssh_client = RemoteServer(hostname)
             #    hostobj.ssh_client.connect()
             #self.clients[hostname] = hostobj.ssh_client
-
-            # we were able to ping the host!  add it to the set of hosts we can access via this IF
-            self.accessible_hosts[source_interface].add(hostname)
-            self.pingable_ips[source_interface].append(targetip)
-            if targetip.network not in self.networks[source_interface]:  # do this elsewhere?
-                self.networks[source_interface].add(targetip.network)  # note unique networks (should get blake's)
+            self.add_reachable(source_interface, hostname, targetip)
         else:
             log.debug(f"Ping from {self.reference_host.name}/{source_interface} target {hostname}/{targetip} failed with rc={ssh_out.status} - skipping")
 
+    def add_reachable(self, source_interface, hostname, targetip):
+        # we were able to ping the host!  add it to the set of hosts we can access via this IF
+        self.accessible_hosts[source_interface].add(hostname)
+        self.pingable_ips[source_interface].append(targetip)
+        if targetip.network not in self.networks[source_interface]:  # do this elsewhere?
+            self.networks[source_interface].add(targetip.network)  # note unique networks (should get blake's)
+
+    def sweep_reachability(self, hosts):
+        """
+        Ping every ip on every host from each reference host interface, sending each interface's whole target
+        list in one remote invocation (or a few, for very large lists).  The pings run in parallel on the far end.
+
+        :param hosts: list of STEMHost objects to ping
+        :return: the reachability matrix - a dict of {source_interface: {ipaddr: True/False}}.  Also fills in
+                 self.accessible_hosts, self.pingable_ips and self.networks
+        """
+        targets = dict()  # {ipaddr: (hostname, WekaInterface)}
+        for hostobj in hosts:
+            for targetif, targetip in hostobj.nics.items():
+                targets[str(targetip.ip)] = (hostobj.name, targetif, targetip)
+
+        matrix = SortedDict()
+        target_ips = list(targets.keys())
+        for source_interface in self.reference_host.nics.keys():
+            matrix[source_interface] = dict()
+            for start in range(0, len(target_ips), SWEEP_CHUNK_SIZE):
+                threaded_method(self, WekaHostGroup.ping_sweep, self.reference_host, source_interface,
+                                target_ips[start:start + SWEEP_CHUNK_SIZE], matrix[source_interface])
+        default_threader.run()
+
+        for source_interface, results in matrix.items():
+            for ip, (hostname, targetif, targetip) in targets.items():
+                if hostname == self.reference_host.name and source_interface == targetif:
+                    continue  # already in pingable_ips; not sure why, but ping fails on loopback anyway
+                if results.get(ip, False):
+                    self.add_reachable(source_interface, hostname, targetip)
+                else:
+                    log.debug(f"Ping from {self.reference_host.name}/{source_interface} target {hostname}/{ip} failed - skipping")
+        return matrix
+
+    def ping_sweep(self, source_host, source_interface, target_ips, results):
+        """
+        ping a list of ips from one interface of a host, in a single remote invocation
+
+        :param source_host: STEMHost to ping from (usually the reference host)
+        :param source_interface: The interface on source_host we want to ping from
+        :param target_ips: list of ip addrs (str)
+        :param results: dict to fill in with {ipaddr: True/False}
+        """
+        log.info(f"Sweeping {len(target_ips)} ips from {source_host.name}/{source_interface}")
+        wait = math.ceil(default_timeouts.get("ping", subnet=source_host.nics[source_interface].network))
+        command = f"printf '%s\\n' {' '.join(target_ips)} | xargs -P {SWEEP_PARALLEL} -I{{}} " + \
+                  f"sh -c 'ping -c1 -W{wait} -I {source_interface} {{}} >/dev/null 2>&1; echo {{}} $?'"
+        # each of the far end's SWEEP_PARALLEL pings can take up to wait seconds
+        timeout = wait * math.ceil(len(target_ips) / SWEEP_PARALLEL) + default_timeouts.get("ssh", source_host.name)
+        with default_recorder.span("ping_sweep", source_host.name) as timer:
+            ssh_out = source_host.run(command, timeout=timeout)
+        if ssh_out is None or ssh_out.status != 0:
+            timer.outcome = "failed"
+            log.error(f"Ping sweep from {source_host.name}/{source_interface} failed: " +
+                      f"{None if ssh_out is None else ssh_out.stderr}")
+            return
+        for line in ssh_out.stdout.split('\n'):
+            splitline = line.split()
+            if len(splitline) == 2:
+                results[splitline[0]] = splitline[1] == '0'
+
+    def probe_mesh(self):
+        """
+        Every candidate pings every other candidate's ips from each of its interfaces, over its own ssh session.
+        The hosts probe in parallel, so wall time doesn't grow much with cluster size.
+
+        :return: sets self.mesh, a ReachabilityMatrix
+        """
+        hosts = list(self.candidates.values())
+        log.info(f"Probing full-mesh dataplane reachability between {len(hosts)} hosts")
+        self.mesh = ReachabilityMatrix(hosts)
+        default_threader.num_simultaneous = STAGE_LIMITS["mesh"]
+        for host in hosts:
+            threaded_method(self, WekaHostGroup.probe_peers, host, hosts)
+        default_threader.run()
+        default_threader.num_simultaneous = DEFAULT_THREADS
+
+    def probe_peers(self, host, hosts):
+        with default_recorder.span("mesh", host.name) as timer:
+            if not self.open_ssh(host):  # restored hosts (--rescan) don't have sessions yet
+                timer.outcome = "rejected"
+                return
+            target_ips = [str(nic.ip) for peer in hosts if peer is not host for nic in peer.nics.values()]
+            for source_interface in host.nics.keys():
+                results = dict()
+                for start in range(0, len(target_ips), SWEEP_CHUNK_SIZE):
+                    self.ping_sweep(host, source_interface, target_ips[start:start + SWEEP_CHUNK_SIZE], results)
+                self.mesh.add(host.name, source_interface, results)
+
     def get_gateways(self, host, nic):
         log.info(f"probing gateway for {host}/{nic.name}")
 
         # try google DNS because we're sure they don't have it on their network...
-        if not self.probe_gateway(host, nic, '8.8.8.8'):
+        if not self.find_gateway(host, nic, '8.8.8.8'):
             # no default gateway, see if there are any gateways to the other nodes...
-            for interface, target_list in self.pingable_ips.items():
+            for interface, target_list in self.gateway_targets.items():
                 for target in target_list:
-                    if self.probe_gateway(host, nic, target.ip):
+                    if self.find_gateway(host, nic, target.ip):
                         break
         if nic.gateway is not None:
             log.info(f"    {host}/{nic.name} has gateway {nic.gateway}")
@@ -738,6 +1328,20 @@ class WekaHostGroup():
             log.warning(f"    {host}/{nic.name} has no dataplane gateway(s)")
         return  # gateway is set in nic, if it was found
 
+    def find_gateway(self, host, nic, target):
+        """
+        see if nic uses a gateway to get to target - from the host's routing tables if we have them (see routes.py),
+        otherwise by asking the host
+        :return: True if there's a gateway (and nic.gateway is set)
+        """
+        if host.routes is None:
+            return self.probe_gateway(host, nic, target)
+        gateway = host.routes.gateway(target, nic.name, nic.ip)
+        if gateway is None:
+            return False
+        nic.gateway = gateway
+        return True
+
     def probe_gateway(self, host, nic, target):
         cmd_output = host.run(f"ip route get {target} oif {nic.name}")
 
@@ -754,18 +1358,21 @@ class WekaHostGroup():
                       f" stderr={list(cmd_output.stderr)}")
         return False
 
-    def open_ssh_toall(self):
-        clients = dict()
-        for host, host_obj in self.candidates.items():
-            # open sessions to all the hosts
-            if host_obj.ssh_client is None:
-                host_obj.ssh_client = RemoteServer(host)
-            clients[host] = host_obj.ssh_client
-        parallel(clients.values(), RemoteServer.connect)
-        for host, host_obj in self.candidates.copy().items():
-            if not host_obj.ssh_client.connected:
-                log.error(f"Unable to open ssh session to {host} - removing from list")
-                self.reject_host(host_obj, "Unable to open ssh session")
+    def update_cache(self):
+        """
+        cache what we fetched from good hosts.  Anything rejected, or with an interface that didn't pass validation,
+        is dropped from the cache so it's fetched fresh next time (after they've fixed it)
+        """
+        for hostname in self.rejected_hosts.keys():
+            self.cache.invalidate(hostname)
+        for hostname, host_obj in self.usable_hosts.items():
+            if host_obj.from_cache or host_obj.beacon_ips is None:
+                continue
+            if host_obj.all_nics_usable():
+                self.cache.store(hostname, host_obj.beacon_ips, host_obj.machine_info, host_obj.product_uuid)
+            else:
+                self.cache.invalidate(hostname)
+        self.cache.save()
 
     def is_homogeneous(self):
         """
@@ -773,54 +1380,16 @@ class WekaHostGroup():
         :return:
         """
 
-        cores = SortedDict()  # dict of {numcores: [hosts]}
-        hyperthreads = SortedDict()
-        ram = SortedDict()  # dict of {ram_GB: [hosts]}
-        drives = SortedDict()  # dict of {num_drives: [hosts]}
-        drive_sizes = SortedDict()
-        nics = SortedDict()
-        nic_names = SortedDict()
+        # group the hosts by each of the things that should be the same - {value: [hostnames]}
+        cores = self.host_table.group_by("num_cores")
+        hyperthreads = self.host_table.group_by("hyperthread")
+        ram = self.host_table.group_by("ram_gb")
+        drives = self.host_table.group_by("num_drives")
+        drive_sizes = self.host_table.group_by("drive_sizes")
+        nics = self.host_table.group_by("num_nics")
+        nic_names = self.host_table.group_by("nic_names")
         homo = True
 
-        # loop through, make notes
-        for host, host_obj in self.usable_hosts.items():
-            # check cores
-            corehostlist = cores.get(host_obj.num_cores, list())
-            corehostlist.append(host)
-            cores[host_obj.num_cores] = corehostlist
-
-            hyperthreadlist = hyperthreads.get(host_obj.hyperthread, list())
-            hyperthreadlist.append(host)
-            hyperthreads[host_obj.hyperthread] = hyperthreadlist
-
-            # check RAM
-            ramhostlist = ram.get(int(host_obj.total_ramGB), list())
-            ramhostlist.append(host)
-            ram[int(host_obj.total_ramGB)] = ramhostlist
-
-            # check # of drives - {numdrives: [list of host objects]}
-            drivehostlist = drives.get(len(host_obj.drives), list())
-            drivehostlist.append(str(host_obj))
-            drives[len(host_obj.drives)] = drivehostlist
-
-            # these_drives = drive_sizes.get(host_obj.drives, list())   # returns list of drives
-            # find the host_obj.machine_info.disks entry (its a list) where dev_path == these_drives
-            for drive in host_obj.drives.values():
-                drive_size_hostlist = drive_sizes.get(drive['sizeBytes'], list())
-                if host not in drive_size_hostlist:
-                    drive_size_hostlist.append(host)
-                drive_sizes[drive['sizeBytes']] = drive_size_hostlist
-
-            # check that they all have the same number of usable nics... ? not sure if this is right
-            num_nicslist = nics.get(len(host_obj.nics), list())
-            num_nicslist.append(str(host_obj))
-            nics[len(host_obj.nics)] = num_nicslist
-
-            for iface, nic in host_obj.nics.items():
-                nic_namelist = nic_names.get(iface, list())
-                nic_namelist.append(host_obj.name)
-                nic_names[iface] = nic_namelist
-
         if len(cores) != 1:
             homo = False
             log.error("Hosts do not have a homogeneous number of cores")
@@ -870,13 +1439,19 @@ class WekaHostGroup():
     def get_hardware_info(self):
         """
         # get info on the hosts
+        Most hosts' cpu topology came from machine_info (see STEMHost.parse_cpu_topology); use lscpu for the rest
         :return:
         """
-        # Don't call ssh-using methods in parallel - can run the system out of ssh sessions
-        for host, host_obj in self.usable_hosts.items():
-            host_obj.lscpu()
+        # hosts restored for --rescan already know
+        hosts = {host: host_obj for host, host_obj in self.usable_hosts.items() if host_obj.threads_per_core is None}
+
+        if len(hosts) > 0:
+            log.info(f"{len(hosts)} hosts have no usable cpu topology in their machine info - using lscpu")
+        # most hosts got lscpu with their facts; the ssh pool limits the sessions on each host, so the rest can
+        # run in parallel
+        parallel_hosts([host_obj for host_obj in hosts.values() if host_obj.lscpu_data is None], STEMHost.lscpu)
 
-        for host, host_obj in self.usable_hosts.items():
+        for host, host_obj in hosts.items():
             if 'Thread(s) per core' in host_obj.lscpu_data:
                 threads = host_obj.lscpu_data.get('Thread(s) per core', '0')
                 host_obj.hyperthread = False if threads == '1' else True
@@ -885,6 +1460,11 @@ class WekaHostGroup():
                     log.error(f"Host {host}: Unable to parse lscpu output -TPC=0")
                 else:
                     log.debug(f"{host} hyperthreading/SMT is {host_obj.hyperthread}")
+                    host_obj.physical_cores = host_obj.num_cores // host_obj.threads_per_core
+                try:
+                    host_obj.sockets = int(host_obj.lscpu_data.get('Socket(s)'))
+                except (TypeError, ValueError):
+                    pass
             else:
                 log.error(f"Host {host}: Unable to parse lscpu output - TPC not found")
 
@@ -923,10 +1503,17 @@ def beacon_hosts(reference_host):
     return stem_beacons
 
 
-def scan_hosts(hostlist, port, skip_gateway_check):
+def scan_hosts(hostlist, port, skip_gateway_check, batch_ping=False, full_mesh=False, cache=None,
+               state_file=None, previous=None, rescan=None):
     """
     scan for STEM-mode Weka hosts
     :param reference_hostname: str
+    :param batch_ping: sweep reachability one remote invocation per reference host interface
+    :param full_mesh: probe reachability from every host, not just the reference host
+    :param cache: a MachineInfoCache, or None
+    :param state_file: save the results of discovery here, so hosts can be rescanned later
+    :param previous: discovery state from an earlier run, when rescanning
+    :param rescan: list of hostnames to rescan
     :return: a dict containing the valid STEMHost objects
     """
     # make sure we can talk to the local weka container/host
@@ -942,9 +1529,10 @@ def scan_hosts(hostlist, port, skip_gateway_check):
 
     # get the weka version
     reference_host.get_machine_info()
-    if reference_host.machine_info is None:
+    if reference_host.version is None:
         log.info(f"ERROR: Error getting machine info from '{reference_host.name}' via API")
         sys.exit(1)  # very hard error
+    reference_host.parse_details()
 
     weka_version = reference_host.version
     reference_host.is_reference = True
@@ -953,7 +1541,8 @@ def scan_hosts(hostlist, port, skip_gateway_check):
     # were we given a list of hosts to scan? (or a single host... then get beacons)
     if len(hostlist) <= 1:
         log.info(f"looking for WEKA beacons on {reference_host.name}")
-        stem_beacons = beacon_hosts(reference_host)
+        with default_recorder.span("beacons"):
+            stem_beacons = beacon_hosts(reference_host)
         # if we weren't given a list of hosts, we must be running on one of the nodes
         #reference_host.is_local = True
     else:
@@ -989,7 +1578,11 @@ def scan_hosts(hostlist, port, skip_gateway_check):
             sys.exit(1)
 
     log.info(f"list of potential WEKA hosts: {list(stem_beacons.keys())}")
-    hostgroup = WekaHostGroup(reference_host, stem_beacons, skip_gateway_check)
+    with default_recorder.span("discovery"):
+        hostgroup = WekaHostGroup(reference_host, stem_beacons, skip_gateway_check, batch_ping, full_mesh, cache,
+                                  previous, rescan)
+    if state_file is not None:
+        save_state(hostgroup, state_file)
     log.info("************************** Analysis **************************")
     if not hostgroup.is_homogeneous():
         log.info("Host group is not Homogeneous!  Please verify configuration(s)")
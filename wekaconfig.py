@@ -8,9 +8,18 @@ import sys
 
 from wekapyutils.wekalogging import configure_logging, register_module, DEFAULT
 
+from answers import load_answers, HeadlessConfig
 from apps import WekaConfigApp
-from output import WekaCluster
-from weka import scan_hosts
+from bundle import default_bundle
+from cache import MachineInfoCache, DEFAULT_CACHE_FILE, DEFAULT_CACHE_TTL
+from deploy import Deployment, DEFAULT_DEPLOY_REPORT, DEFAULT_STEP_RETRIES
+from output import WekaCluster, DEFAULT_MAX_JOBS
+from simulator import Fleet, load_profile
+from sshpool import default_pool, DEFAULT_MAX_SESSIONS
+from state import load_state, DEFAULT_STATE_FILE
+from timeouts import default_timeouts
+from timing import default_recorder, DEFAULT_TOP_HOSTS
+from weka import scan_hosts, STEMHost
 
 # get root logger
 log = logging.getLogger()
@@ -24,6 +33,59 @@ if __name__ == '__main__':
     parser.add_argument("-v", "--verbosity", action="count", default=0, help="increase output verbosity")
     parser.add_argument("--skip-gateway-check", dest="gateway_check", default=False, action="store_true",
                         help="skip checking for gateways")
+    parser.add_argument("--batch-ping", dest="batch_ping", default=False, action="store_true",
+                        help="ping all hosts from each interface in one remote command, rather than one at a time")
+    parser.add_argument("--full-mesh", dest="full_mesh", default=False, action="store_true",
+                        help="check dataplane reachability from every host to every other host")
+    parser.add_argument("--no-cache", dest="use_cache", default=True, action="store_false",
+                        help="don't use or update the machine info cache")
+    parser.add_argument("--refresh", dest="refresh", default=False, action="store_true",
+                        help="fetch machine info from every host, and refresh the cache")
+    parser.add_argument("--cache-ttl", dest="cache_ttl", type=int, default=DEFAULT_CACHE_TTL,
+                        help=f"seconds before cached machine info expires (default {DEFAULT_CACHE_TTL})")
+    parser.add_argument("--cache-file", dest="cache_file", type=str, default=DEFAULT_CACHE_FILE,
+                        help=f"machine info cache file (default {DEFAULT_CACHE_FILE})")
+    parser.add_argument("--state-file", dest="state_file", type=str, default=None,
+                        help=f"save discovery results to this file, for a later --rescan (--rescan reads and " +
+                             f"updates {DEFAULT_STATE_FILE} if this isn't given)")
+    parser.add_argument("--rescan", dest="rescan", type=str, default=None,
+                        help="comma-separated list of hosts to rescan; the rest are loaded from the last scan")
+    parser.add_argument("--ssh-max-sessions", dest="ssh_max_sessions", type=int, default=DEFAULT_MAX_SESSIONS,
+                        help=f"max commands to run at once over each host's ssh connection " +
+                             f"(default {DEFAULT_MAX_SESSIONS}; should be less than the hosts' sshd MaxSessions)")
+    parser.add_argument("--timing-report", dest="timing_report", type=str, default=None,
+                        help="write a JSON report of how long each discovery stage took (overall and per host)")
+    parser.add_argument("--timing-top", dest="timing_top", type=int, default=DEFAULT_TOP_HOSTS,
+                        help=f"number of slowest hosts to list in the timing report (default {DEFAULT_TOP_HOSTS})")
+    parser.add_argument("--trace", dest="trace", type=str, default=None,
+                        help="write a timeline of discovery and config generation in Chrome Trace Event Format")
+    parser.add_argument("--answers", dest="answers", type=str, default=None,
+                        help="don't run the UI - take the choices from this JSON answer file and write config.sh")
+    parser.add_argument("--script-jobs", dest="script_jobs", type=int, default=DEFAULT_MAX_JOBS,
+                        help=f"how many hosts config.sh (or --execute) works on at once, unless it's run with " +
+                             f"--jobs (default {DEFAULT_MAX_JOBS})")
+    parser.add_argument("--execute", dest="execute", default=False, action="store_true",
+                        help="after writing config.sh, do what it does from here, over the ssh sessions opened " +
+                             "during discovery (resources_generator.py must be in the current directory)")
+    parser.add_argument("--step-retries", dest="step_retries", type=int, default=DEFAULT_STEP_RETRIES,
+                        help=f"with --execute, times to retry a step that fails, if it's safe to repeat " +
+                             f"(default {DEFAULT_STEP_RETRIES})")
+    parser.add_argument("--deploy-report", dest="deploy_report", type=str, default=DEFAULT_DEPLOY_REPORT,
+                        help=f"with --execute, write how long each phase and step took to this JSON file " +
+                             f"(default {DEFAULT_DEPLOY_REPORT})")
+    parser.add_argument("--record", dest="record", type=str, default=None,
+                        help="record all API and ssh traffic to this bundle file")
+    parser.add_argument("--replay", dest="replay", type=str, default=None,
+                        help="run from a bundle made with --record, instead of talking to the hosts")
+    parser.add_argument("--replay-latency", dest="replay_latency", type=float, default=1.0,
+                        help="scale the recorded response times when replaying (default 1.0; 0 to not wait at all)")
+    parser.add_argument("--simulate", dest="simulate", type=int, default=None,
+                        help="scan a simulated fleet of this many STEM-mode hosts on loopback addresses (for testing)")
+    parser.add_argument("--simulate-profile", dest="simulate_profile", type=str, default=None,
+                        help="JSON file of simulated fleet settings - hardware, latency, error rates (see simulator.py)")
+    parser.add_argument("--keep-raw", dest="keep_raw", default=False, action="store_true",
+                        help="keep each host's machine info and facts as they came, rather than just what we use " +
+                             "(for debugging - uses much more memory on large fleets)")
     parser.add_argument("--version", dest="version", default=False, action="store_true",
                         help="Display version number")
     args = parser.parse_args()
@@ -84,24 +146,107 @@ if __name__ == '__main__':
 
     print(f"collecting host data... please wait...")
     log.info("*******************  Starting Weka Configurator  *******************")
-    host_list = scan_hosts(args.hosts, args.port, args.gateway_check)
+    default_pool.max_sessions = args.ssh_max_sessions
+    STEMHost.keep_raw = args.keep_raw
+    if args.record is not None and args.replay is not None:
+        log.critical("--record and --replay can't be used together")
+        sys.exit(1)
+    if args.script_jobs < 1:
+        log.critical("--script-jobs must be at least 1")
+        sys.exit(1)
+    if args.execute and args.replay is not None:
+        log.critical("--execute and --replay can't be used together")
+        sys.exit(1)
+    if args.step_retries < 0:
+        log.critical("--step-retries can't be negative")
+        sys.exit(1)
+    if args.record is not None:
+        default_bundle.record(args.record)
+    elif args.replay is not None:
+        if not default_bundle.replay(args.replay, args.replay_latency):
+            sys.exit(1)
+    if args.record is not None or args.replay is not None:
+        default_timeouts.fix("ping")  # the ping timeout is in the recorded commands, so it can't change between runs
+        if args.use_cache:
+            # everything has to come from the hosts to be recorded, and replay mustn't read or touch the real cache
+            log.info("Not using the machine info cache while recording or replaying")
+            args.use_cache = False
+    if args.simulate is not None:
+        if args.use_cache:
+            # simulated hosts' machine info mustn't end up where a real scan would use it
+            log.info("Not using the machine info cache for a simulated fleet")
+            args.use_cache = False
+        profile = dict()
+        if args.simulate_profile is not None:
+            profile = load_profile(args.simulate_profile)
+            if profile is None:
+                sys.exit(1)
+        fleet = Fleet(args.simulate, **profile)
+        fleet.start(args.port)
+        fleet.install()
+        args.hosts = [fleet.reference_ip]
+    answers = None
+    if args.answers is not None:
+        answers = load_answers(args.answers)  # check it before we spend time scanning
+        if answers is None:
+            sys.exit(1)
+    cache = MachineInfoCache(args.cache_file, args.cache_ttl, args.refresh) if args.use_cache else None
+    previous = None
+    rescan = None
+    state_file = args.state_file
+    if args.rescan is not None:
+        if state_file is None:
+            state_file = DEFAULT_STATE_FILE
+        previous = load_state(state_file)
+        if previous is None:
+            sys.exit(1)
+        rescan = [host.strip() for host in args.rescan.split(',') if len(host.strip()) > 0]
+    if args.simulate is not None and state_file is not None:
+        log.info(f"Not saving discovery state for a simulated fleet")
+        state_file = None
+    host_list = scan_hosts(args.hosts, args.port, args.gateway_check, args.batch_ping, args.full_mesh, cache,
+                           state_file, previous, rescan)
+    if args.timing_report is not None:
+        default_recorder.write_report(args.timing_report, args.timing_top)
+    if args.trace is not None:
+        default_recorder.write_trace(args.trace)  # in case they don't generate a config
 
     # pause here so the user can review what's happened before we go to full-screen mode
     if len(host_list.reference_host.nics) < 1:
         log.critical(f"There are no usable networks, aborting.")
         sys.exit(1)
-    print(f"Scanning Complete.  Press Enter to continue: ", end='')
-    user = input()
 
-    # UI starts here - it consists of an App, which has Forms (pages).  Each Form has data entry/display Widgets.
-    config = WekaConfigApp(host_list)
-    config.run()
+    if answers is not None:
+        # headless - make the same choices the UI would, from the answer file
+        config = HeadlessConfig(host_list)
+        if not config.apply(answers):
+            log.critical(f"Unable to configure the cluster from {args.answers}, aborting.")
+            sys.exit(1)
+    else:
+        print(f"Scanning Complete.  Press Enter to continue: ", end='')
+        user = input()
+
+        # UI starts here - it consists of an App, which has Forms (pages).  Each Form has data entry/display Widgets.
+        config = WekaConfigApp(host_list)
+        config.run()
     if not config.cleanexit:
         print("App was cancelled.")
     else:
         print(f"App exited - writing config.sh")
 
-        cluster = WekaCluster(config)
-        fo = open("config.sh", "w")
-        cluster.cluster_config(fo)
-        os.chmod("config.sh", 0o755)
+        with default_recorder.span("generate_config"):
+            cluster = WekaCluster(config, args.script_jobs)
+            fo = open("config.sh", "w")
+            cluster.cluster_config(fo)
+            os.chmod("config.sh", 0o755)
+        deployed = True
+        if args.execute:
+            print(f"Deploying the cluster...")
+            deployment = Deployment(cluster, host_list, args.script_jobs, args.step_retries)
+            deployed = deployment.run()
+            deployment.write_report(args.deploy_report)
+        if args.trace is not None:
+            default_recorder.write_trace(args.trace)
+        if not deployed:
+            log.critical(f"Deployment failed - see {args.deploy_report} and wekaconfig.log")
+            sys.exit(1)
@@ -533,22 +533,14 @@ class Networks(wekatui.TitleMultiSelect):
     def when_value_edited(self):
         PA = self.parent.parentApp
         PA.selected_dps = list()  # clear the list
-        PA.possible_hosts = set()
         for index in self.parent.dataplane_networks_field.value:
             # save the IPv4Network objects corresponding to the selected items
-            #  find hosts on this network...
-            for iface, nic in PA.target_hosts.reference_host.nics.items():
-                if nic.network == PA.nets[index]:   # is this nic on that network?
-                    PA.possible_hosts |= PA.target_hosts.accessible_hosts[nic.name]
-                    #for host in PA.target_hosts.accessible_hosts[nic.name]:
-                    #    for nic in host.nics:
-                    #        if nic.network == network:
-                    #            PA.possible_hosts |= host.hostname
-                    #            break
-
-            #PA.possible_hosts |= PA.target_hosts.accessible_hosts[PA.nets[index]]
             PA.selected_dps.append(PA.nets[index])  # ie: "ib0" ?network number?
 
+        #  find hosts on these networks...
+        network_index = PA.target_hosts.network_index
+        PA.possible_hosts = set(network_index.hostnames(network_index.reachable(PA.selected_dps)))
+
         PA.sorted_hosts = sorted(list(PA.possible_hosts))  # sorted hostnames
         PA.hosts_value = list(range(0, len(PA.sorted_hosts)))  # show all of them pre-selected
         if hasattr(self.parent, "hosts_field"):